@@ -1,8 +1,12 @@
+import copy
+import hashlib
+import heapq
 import itertools
 import json
 import logging
 import re
 import traceback
+import uuid
 from datetime import datetime
 
 import geoalchemy2  # Although this import seems unused is has to be here
@@ -11,11 +15,11 @@ import sqlalchemy as sa
 from django.core.exceptions import PermissionDenied
 from django.http import Http404, JsonResponse
 from omi.dialects.oep.parser import JSONParser_1_4, ParserException
-from shapely import wkb, wkt
+from shapely import wkb
 from sqlalchemy import Column, ForeignKey, MetaData, Table, exc, func, sql, cast
 from sqlalchemy import types as sqltypes
 from sqlalchemy import util
-from sqlalchemy.dialects.postgresql import TSVECTOR, array, ARRAY
+from sqlalchemy.dialects.postgresql import TSVECTOR, array, ARRAY, insert as pg_insert
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm.session import sessionmaker
 from sqlalchemy.sql import column
@@ -23,8 +27,11 @@ from sqlalchemy.sql.expression import func
 from omi.dialects.oep import OEP_V_1_4_Dialect as OmiDialect
 import api
 import login.models as login_models
-from api import DEFAULT_SCHEMA, references
+import oeplatform.securitysettings as sec
+from api import DEFAULT_SCHEMA, metrics, references
+from api.cache import CATALOG, DESCRIPTIONS, invalidate_table, load_table
 from api.connection import _get_engine
+from api.encode import IteratorReader
 from api.error import APIError
 from api.parser import get_or_403, read_bool, read_pgid, parse_type
 from api.sessions import (
@@ -34,7 +41,7 @@ from api.sessions import (
     load_session_from_context,
 )
 from dataedit.models import Table as DBTable
-from dataedit.structures import MetaSearch
+from dataedit.structures import MetaSearch, TableVersion
 from oeplatform.securitysettings import PLAYGROUNDS, UNVERSIONED_SCHEMAS
 
 pgsql_qualifier = re.compile(r"^[\w\d_\.]+$")
@@ -46,6 +53,28 @@ __INSERT = 0
 __UPDATE = 1
 __DELETE = 2
 
+# Inserts with at least this many rows are loaded via COPY
+BULK_INSERT_THRESHOLD = getattr(sec, "BULK_INSERT_THRESHOLD", 1000)
+
+# Maximal number of pending changes that are applied in one statement
+APPLY_BATCH_SIZE = getattr(sec, "APPLY_BATCH_SIZE", 10000)
+
+# Limits of searches by class of user (see _user_tier). Queries whose
+# estimated cost exceeds the limit are rejected, running statements are
+# cancelled after the timeout in seconds. None disables a limit.
+SEARCH_COST_LIMITS = getattr(
+    sec,
+    "SEARCH_COST_LIMITS",
+    {"anonymous": 1e6, "registered": 1e7, "group": 1e8},
+)
+SEARCH_STATEMENT_TIMEOUTS = getattr(
+    sec,
+    "SEARCH_STATEMENT_TIMEOUTS",
+    {"anonymous": 10, "registered": 60, "group": 300},
+)
+
+_META_FIELDS = ("_user", "_message", "_type")
+
 
 def get_column_obj(table, column):
     """
@@ -63,9 +92,9 @@ def get_column_obj(table, column):
 
 
 def get_table_name(schema, table, restrict_schemas=True):
-    if not has_schema(dict(schema=schema)):
+    if not CATALOG.has_schema(schema):
         raise Http404
-    if not has_table(dict(schema=schema, table=table)):
+    if not CATALOG.has_table(schema, table):
         raise Http404
     if schema.startswith("_") or schema == "public" or schema is None:
         raise PermissionDenied
@@ -92,15 +121,76 @@ def assert_permission(user, table, permission, schema=None):
         raise PermissionDenied
 
 
+_AS_TEXT_QUERY = sa.text(
+    "SELECT ST_AsText(CAST(g AS geometry)) "
+    "FROM unnest(CAST(:geometries AS text[])) WITH ORDINALITY AS t(g, i) "
+    "ORDER BY i"
+)
+
+
+def _geometries_as_text(elements):
+    """
+    Converts geometries to WKT with a single query. ST_AsText keeps the
+    format of the WKT the same as that of the database (e.g. `POINT(1 2)`).
+
+    :param elements: List of :class:`geoalchemy2.WKBElement`
+    :return: List of WKT strings
+    """
+    geometries = [
+        e.data if isinstance(e.data, str) else bytes(e.data).hex() for e in elements
+    ]
+    result = _get_engine().execute(_AS_TEXT_QUERY, geometries=geometries)
+    return [row[0] for row in result]
+
+
 def _translate_fetched_cell(cell):
-    if isinstance(cell, geoalchemy2.WKBElement):
-        return _get_engine().execute(cell.ST_AsText()).scalar()
-    elif isinstance(cell, memoryview):
+    """
+    Translates a fetched cell that is no geometry. Geometries are converted
+    by :func:`_translate_fetched_rows`.
+    """
+    if isinstance(cell, memoryview):
         return wkb.dumps(wkb.loads(cell.tobytes()), hex=True)
     else:
         return cell
 
 
+def _translate_fetched_rows(rows, description=None):
+    """
+    Translates a batch of fetched rows. All geometries of the batch are
+    converted to WKT with a single query.
+
+    :param rows: List of rows as returned by a cursor
+    :param description: The description of a psycopg2 cursor. If given, only
+        binary columns are translated, all other cells are passed through
+        unchanged.
+    :return: List of translated rows
+    """
+    columns = None
+    if description is not None:
+        columns = [
+            i
+            for i, col in enumerate(description)
+            if col.type_code in psycopg2.BINARY.values
+        ]
+        if not columns:
+            return [list(row) for row in rows]
+    result = []
+    geometries = []
+    for row in rows:
+        row = list(row)
+        for i in range(len(row)) if columns is None else columns:
+            if isinstance(row[i], geoalchemy2.WKBElement):
+                geometries.append((row, i))
+            elif row[i] is not None:
+                row[i] = _translate_fetched_cell(row[i])
+        result.append(row)
+    if geometries:
+        texts = _geometries_as_text([row[i] for row, i in geometries])
+        for (row, i), text in zip(geometries, texts):
+            row[i] = text
+    return result
+
+
 def __response_success():
     return {"success": True}
 
@@ -113,14 +203,6 @@ class InvalidRequest(Exception):
     pass
 
 
-def _translate_sqla_type(column):
-    if column.data_type.lower() == "array":
-        return column.element_type + "[]"
-    if column.data_type.lower() == "user-defined":
-        return column.udt_name
-    else:
-        return column.data_type
-
 def try_parse_metadata(inp):
     """
     :param inp: string or dict
@@ -156,7 +238,135 @@ def try_parse_metadata(inp):
         return metadata, None
 
 
-def describe_columns(schema, table):
+# Describes columns, indexes and constraints of a table in one round-trip. The
+# column fields are computed like in information_schema.columns, but without
+# its expensive joins.
+_DESCRIBE_TABLE_QUERY = sa.text(
+    """
+    SELECT
+        (
+            SELECT json_agg(json_build_object(
+                'column_name', a.attname,
+                'ordinal_position', a.attnum,
+                'column_default', pg_get_expr(ad.adbin, ad.adrelid),
+                'is_nullable', NOT (a.attnotnull OR (t.typtype = 'd' AND t.typnotnull)),
+                'data_type', CASE
+                    WHEN ty.typelem <> 0 AND ty.typlen = -1 THEN
+                        CASE WHEN et.typnamespace = CAST('pg_catalog' AS regnamespace)
+                        THEN format_type(et.oid, NULL) ELSE 'USER-DEFINED' END || '[]'
+                    WHEN ty.typnamespace = CAST('pg_catalog' AS regnamespace)
+                    THEN format_type(ty.oid, NULL)
+                    ELSE ty.typname
+                END,
+                'character_maximum_length',
+                information_schema._pg_char_max_length(tt.typid, tt.typmod),
+                'character_octet_length',
+                information_schema._pg_char_octet_length(tt.typid, tt.typmod),
+                'numeric_precision',
+                information_schema._pg_numeric_precision(tt.typid, tt.typmod),
+                'numeric_precision_radix',
+                information_schema._pg_numeric_precision_radix(tt.typid, tt.typmod),
+                'numeric_scale',
+                information_schema._pg_numeric_scale(tt.typid, tt.typmod),
+                'datetime_precision',
+                information_schema._pg_datetime_precision(tt.typid, tt.typmod),
+                'interval_type',
+                information_schema._pg_interval_type(tt.typid, tt.typmod),
+                'interval_precision', NULL,
+                'maximum_cardinality', NULL,
+                'dtd_identifier', CAST(a.attnum AS text),
+                'is_updatable', pg_column_is_updatable(c.oid, a.attnum, false)
+            ) ORDER BY a.attnum)
+            FROM pg_attribute AS a
+            JOIN pg_type AS t ON t.oid = a.atttypid
+            CROSS JOIN LATERAL (
+                SELECT
+                    CASE WHEN t.typtype = 'd' THEN t.typbasetype ELSE a.atttypid END AS typid,
+                    CASE WHEN t.typtype = 'd' THEN t.typtypmod ELSE a.atttypmod END AS typmod
+            ) AS tt
+            JOIN pg_type AS ty ON ty.oid = tt.typid
+            LEFT JOIN pg_type AS et ON et.oid = ty.typelem
+            LEFT JOIN pg_attrdef AS ad ON ad.adrelid = a.attrelid AND ad.adnum = a.attnum
+            WHERE a.attrelid = c.oid AND a.attnum > 0 AND NOT a.attisdropped
+        ) AS columns,
+        (
+            SELECT json_agg(json_build_object(
+                'indexname', i.relname,
+                'indexdef', pg_get_indexdef(i.oid)
+            ) ORDER BY i.relname)
+            FROM pg_index AS x
+            JOIN pg_class AS i ON i.oid = x.indexrelid
+            WHERE x.indrelid = c.oid
+        ) AS indexes,
+        (
+            SELECT json_agg(json_build_object(
+                'constraint_name', k.conname,
+                'constraint_type', CASE k.contype
+                    WHEN 'c' THEN 'CHECK'
+                    WHEN 'f' THEN 'FOREIGN KEY'
+                    WHEN 'p' THEN 'PRIMARY KEY'
+                    ELSE 'UNIQUE'
+                END,
+                'is_deferrable', CASE WHEN k.condeferrable THEN 'YES' ELSE 'NO' END,
+                'initially_deferred', CASE WHEN k.condeferred THEN 'YES' ELSE 'NO' END,
+                'definition', pg_get_constraintdef(k.oid)
+            ) ORDER BY k.conname)
+            FROM pg_constraint AS k
+            WHERE k.conrelid = c.oid AND k.contype IN ('c', 'f', 'p', 'u')
+        ) AS constraints
+    FROM pg_class AS c
+    JOIN pg_namespace AS n ON n.oid = c.relnamespace
+    WHERE n.nspname = :schema AND c.relname = :table
+    """
+)
+
+
+def describe_table(schema, table, version=None):
+    """
+    Loads the description of the columns, indexes and constraints of the
+    specified table with a single catalog query. Descriptions are cached per
+    table version (see :func:`get_table_version`) and dropped by
+    :func:`api.cache.invalidate_table`.
+
+    The returned dictionaries are shared by all callers and must not be
+    changed. Use :func:`describe_columns`, :func:`describe_indexes` and
+    :func:`describe_constraints` to get copies.
+
+    :param schema: Schema name
+    :param table: Table name
+    :param version: The current version of the table, if already known
+    :return: A dictionary with the keys `columns`, `indexes` and `constraints`
+    """
+    if version is None:
+        version, _ = get_table_version(schema, table)
+    cached = DESCRIPTIONS.get((schema, table))
+    if cached is not None and cached[0] == version:
+        return cached[1]
+
+    row = (
+        _get_engine()
+        .execute(_DESCRIBE_TABLE_QUERY, schema=schema, table=table)
+        .first()
+    )
+    if row is None:
+        return {"columns": {}, "indexes": {}, "constraints": {}}
+
+    description = {
+        "columns": {c.pop("column_name"): c for c in row.columns or []},
+        # Use a single-value dictionary to allow future extension with
+        # downward compatibility
+        "indexes": {
+            i["indexname"]: {"indexdef": i["indexdef"]} for i in row.indexes or []
+        },
+        "constraints": {
+            c.pop("constraint_name"): c for c in row.constraints or []
+        },
+    }
+    DESCRIPTIONS.put((schema, table), (version, description))
+    return description
+
+
+def describe_columns(schema, table, version=None):
     """
     Loads the description of all columns of the specified table and return their
     description as a dictionary. Each column is identified by its name and
@@ -181,50 +391,15 @@ def describe_columns(schema, table):
 
     :param table: Table name
 
+    :param version: The current version of the table, if already known
+
     :return: A dictionary of describing dictionaries representing the columns
     identified by their column names
     """
-
-    engine = _get_engine()
-    session = sessionmaker(bind=engine)()
-    query = (
-        "select column_name, "
-        "c.ordinal_position, c.column_default, c.is_nullable, c.data_type, "
-        "c.character_maximum_length, c.character_octet_length, "
-        "c.numeric_precision, c.numeric_precision_radix, c.numeric_scale, "
-        "c.datetime_precision, c.interval_type, c.interval_precision, "
-        "c.maximum_cardinality, c.dtd_identifier, c.udt_name, c.is_updatable, e.data_type as element_type "
-        "from INFORMATION_SCHEMA.COLUMNS  c "
-        "LEFT JOIN information_schema.element_types e "
-        "ON ((c.table_catalog, c.table_schema, c.table_name, 'TABLE', c.dtd_identifier) "
-        "= (e.object_catalog, e.object_schema, e.object_name, e.object_type, e.collection_type_identifier)) where table_name = "
-        "'{table}' and table_schema='{schema}';".format(table=table, schema=schema)
-    )
-    response = session.execute(query)
-    session.close()
-    return {
-        column.column_name: {
-            "ordinal_position": column.ordinal_position,
-            "column_default": column.column_default,
-            "is_nullable": column.is_nullable == "YES",
-            "data_type": _translate_sqla_type(column),
-            "character_maximum_length": column.character_maximum_length,
-            "character_octet_length": column.character_octet_length,
-            "numeric_precision": column.numeric_precision,
-            "numeric_precision_radix": column.numeric_precision_radix,
-            "numeric_scale": column.numeric_scale,
-            "datetime_precision": column.datetime_precision,
-            "interval_type": column.interval_type,
-            "interval_precision": column.interval_precision,
-            "maximum_cardinality": column.maximum_cardinality,
-            "dtd_identifier": column.dtd_identifier,
-            "is_updatable": column.is_updatable == "YES",
-        }
-        for column in response
-    }
+    return copy.deepcopy(describe_table(schema, table, version)["columns"])
 
 
-def describe_indexes(schema, table):
+def describe_indexes(schema, table, version=None):
     """
     Loads the description of all indexes of the specified table and return their
     description as a dictionary. Each index is identified by its name and
@@ -237,24 +412,15 @@ def describe_indexes(schema, table):
 
     :param table: Table name
 
+    :param version: The current version of the table, if already known
+
     :return: A dictionary of describing dictionaries representing the indexed
     identified by their column names
     """
-    engine = _get_engine()
-    session = sessionmaker(bind=engine)()
-    query = (
-        "select indexname, indexdef from pg_indexes where tablename = "
-        "'{table}' and schemaname='{schema}';".format(table=table, schema=schema)
-    )
-    response = session.execute(query)
-    session.close()
-
-    # Use a single-value dictionary to allow future extension with downward
-    # compatibility
-    return {column.indexname: {"indexdef": column.indexdef} for column in response}
+    return copy.deepcopy(describe_table(schema, table, version)["indexes"])
 
 
-def describe_constraints(schema, table):
+def describe_constraints(schema, table, version=None):
     """
     Loads the description of all constraints of the specified table and return their
     description as a dictionary. Each constraints is identified by its name and
@@ -270,26 +436,12 @@ def describe_constraints(schema, table):
 
     :param table: Table name
 
+    :param version: The current version of the table, if already known
+
     :return: A dictionary of describing dictionaries representing the columns
     identified by their column names
     """
-
-    engine = _get_engine()
-    session = sessionmaker(bind=engine)()
-    query = "select constraint_name, constraint_type, is_deferrable, initially_deferred, pg_get_constraintdef(c.oid) as definition from information_schema.table_constraints JOIN pg_constraint AS c  ON c.conname=constraint_name where table_name='{table}' AND constraint_schema='{schema}';".format(
-        table=table, schema=schema
-    )
-    response = session.execute(query)
-    session.close()
-    return {
-        column.constraint_name: {
-            "constraint_type": column.constraint_type,
-            "is_deferrable": column.is_deferrable,
-            "initially_deferred": column.initially_deferred,
-            "definition": column.definition,
-        }
-        for column in response
-    }
+    return copy.deepcopy(describe_table(schema, table, version)["constraints"])
 
 
 def perform_sql(sql_statement, parameter=None):
@@ -701,6 +853,7 @@ def column_alter(query, context, schema, table, column):
             + read_pgid(query["name"])
         ).format(schema=schema, table=table, column=column)
         perform_sql(sql)
+    table_changed(schema, table)
     return get_response_dict(success=True)
 
 
@@ -720,6 +873,7 @@ def column_add(schema, table, column, description):
 
     meta_schema = get_meta_schema_name(schema)
     perform_sql(s.format(schema=meta_schema, table=insert_table))
+    table_changed(schema, table)
     return get_response_dict(success=True)
 
 
@@ -788,6 +942,8 @@ def table_create(schema, table, columns, constraints_definitions, cursor, table_
 
     t = Table(table, metadata, *(columns + constraints), schema=schema, comment=comment_on_table)
     t.create(_get_engine())
+    CATALOG.add_table(schema, table)
+    table_changed(schema, table)
 
     return get_response_dict(success=True)
 
@@ -882,7 +1038,10 @@ def table_change_column(column_definition):
 
     sql_string = "".join(sql)
 
-    return perform_sql(sql_string)
+    try:
+        return perform_sql(sql_string)
+    finally:
+        table_changed(schema, table)
 
 
 def table_change_constraint(table, constraint_definition):
@@ -944,7 +1103,10 @@ def table_change_constraint(table, constraint_definition):
 
     sql_string = "".join(sql)
 
-    return perform_sql(sql_string)
+    try:
+        return perform_sql(sql_string)
+    finally:
+        table_changed(schema, table)
 
 
 def put_rows(schema, table, column_data):
@@ -966,10 +1128,65 @@ ACTIONS FROM OLD API
 
 
 def _get_table(schema, table):
-    engine = _get_engine()
-    metadata = MetaData(bind=_get_engine())
+    return load_table(schema, table)
+
 
-    return Table(table, metadata, autoload=True, autoload_with=engine, schema=schema)
+def bump_table_version(schema, table, cursor=None):
+    """
+    Increments the version of `schema`.`table` that is used to answer
+    conditional requests. If the table is changed in a transaction, pass its
+    cursor so the version changes atomically with the table. Otherwise, call
+    this only after the change was committed.
+
+    :param schema: Schema name
+    :param table: Table name
+    :param cursor: Cursor of the transaction that changes the table
+    """
+    versions = TableVersion.__table__
+    query = (
+        pg_insert(versions)
+        .values(schema=schema, table=table, version=1)
+        .on_conflict_do_update(
+            index_elements=[versions.c["schema"], versions.c["table"]],
+            set_={"version": versions.c.version + 1, "modified": func.now()},
+        )
+    )
+    if cursor is None:
+        _get_engine().execute(query)
+    else:
+        _execute_sqla(query, cursor)
+
+
+def get_table_version(schema, table):
+    """
+    :param schema: Schema name
+    :param table: Table name
+    :return: Tuple of the version of `schema`.`table` and the time of its
+        last change. Tables that were not changed since versions are tracked
+        have version 0 and no time.
+    """
+    versions = TableVersion.__table__
+    row = (
+        _get_engine()
+        .execute(
+            sa.select([versions.c.version, versions.c.modified]).where(
+                sa.and_(versions.c["schema"] == schema, versions.c["table"] == table)
+            )
+        )
+        .first()
+    )
+    if row is None:
+        return 0, None
+    return row.version, row.modified
+
+
+def table_changed(schema, table, cursor=None):
+    """
+    Drops cached information on `schema`.`table` and bumps its version (see
+    :func:`bump_table_version`).
+    """
+    invalidate_table(schema, table)
+    bump_table_version(schema, table, cursor)
 
 
 def __internal_select(query, context):
@@ -1015,11 +1232,7 @@ def __change_rows(request, context, target_table, setter, fields=None):
         fields = [field[0] for field in rows["description"]]
     fields += [f[0] for f in meta_fields]
 
-    table_name = orig_table
-    meta = MetaData(bind=_get_engine())
-    table = Table(
-        table_name, meta, autoload=True, schema=request.get("schema", DEFAULT_SCHEMA)
-    )
+    table = _get_table(request.get("schema", DEFAULT_SCHEMA), orig_table)
     pks = [c for c in table.columns if c.primary_key]
 
     inserts = []
@@ -1045,6 +1258,11 @@ def __change_rows(request, context, target_table, setter, fields=None):
         )
 
         insert_table = _get_table(meta_schema, target_table)
+        # Columns the meta table does not know cannot be recorded
+        inserts = [
+            {k: v for k, v in insert.items() if k in insert_table.c}
+            for insert in inserts
+        ]
         query = insert_table.insert(values=inserts)
         _execute_sqla(query, cursor)
     return {"rowcount": rows["rowcount"]}
@@ -1098,94 +1316,114 @@ def data_update(request, context=None):
     return result
 
 
-def data_insert_check(schema, table, values, context):
+_KEY_CONSTRAINT_QUERY = (
+    "SELECT c.conname, c.contype AS type, "
+    "   array_agg(a.attname::text ORDER BY k.ord) AS columns, "
+    "   array_agg(format_type(a.atttypid, a.atttypmod) ORDER BY k.ord) AS types "
+    "FROM pg_constraint AS c "
+    "CROSS JOIN LATERAL unnest(c.conkey) WITH ORDINALITY AS k(attnum, ord) "
+    "JOIN pg_attribute AS a "
+    "   ON a.attrelid = c.conrelid AND a.attnum = k.attnum "
+    "WHERE c.conrelid = CAST(:table AS regclass) "
+    "   AND c.contype IN ('u', 'p') "
+    "GROUP BY c.conname, c.contype;"
+)
 
-    engine = _get_engine()
-    session = sessionmaker(bind=engine)()
+
+def _is_null(value):
+    return value is None or (isinstance(value, str) and value.lower() == "null")
+
+
+def _find_key_violation(session, schema, table, columns, types, values):
+    """
+    Checks whether any row in `values` collides with an existing row or with
+    another row of `values` on the key given by `columns`. The existing rows
+    are checked by a single query that joins the table against the list of
+    candidate keys.
+
+    :return: The first violating row or None
+    """
+    keys = {}
+    for row in values:
+        key = tuple(row.get(c) for c in columns)
+        # NULLs never violate a unique constraint
+        if any(_is_null(k) for k in key):
+            continue
+        key = tuple(_pg_text(_load_value(k)) for k in key)
+        if key in keys:
+            return row
+        keys[key] = row
+    if not keys:
+        return None
+
+    preparer = _get_engine().dialect.identifier_preparer
+    candidates = list(keys.items())
+    params = {}
+    arrays = []
+    key_columns = []
+    conditions = []
+    for i, (c, t) in enumerate(zip(columns, types)):
+        params["k%d" % i] = [key[i] for key, _ in candidates]
+        arrays.append("CAST(CAST(:k{i} AS text[]) AS {t}[])".format(i=i, t=t))
+        key_columns.append("k%d" % i)
+        conditions.append("t.{c} = v.k{i}".format(c=preparer.quote(c), i=i))
     query = (
-        "SELECT array_agg(column_name::text) as columns, conname, "
-        "   contype AS type "
-        "FROM pg_constraint AS conkeys "
-        "JOIN information_schema.constraint_column_usage AS ccu "
-        "   ON ccu.constraint_name = conname "
-        "WHERE table_name='{table}' "
-        "   AND table_schema='{schema}' "
-        "   AND conrelid='{schema}.{table}'::regclass::oid "
-        "GROUP BY conname, contype;".format(table=table, schema=schema)
+        "SELECT v.n FROM {schema}.{table} AS t "
+        "JOIN unnest({arrays}) WITH ORDINALITY AS v({key_columns}, n) "
+        "ON {conditions} LIMIT 1".format(
+            schema=preparer.quote_schema(schema),
+            table=preparer.quote(table),
+            arrays=", ".join(arrays),
+            key_columns=", ".join(key_columns),
+            conditions=" AND ".join(conditions),
+        )
+    )
+    hit = session.execute(sa.text(query), params).first()
+    if hit is None:
+        return None
+    return candidates[hit.n - 1][1]
+
+
+def _violation_message(name, row):
+    return "Action violates {cn}. Failing row was {row}".format(
+        cn=name,
+        row="(" + ", ".join(str(row[c]) for c in row if not c.startswith("_")) + ")",
     )
-    response = session.execute(query)
-    session.close()
 
-    for constraint in response:
-        columns = constraint.columns
-        if constraint.type.lower() == "c":
-            pass
-        elif constraint.type.lower() == "f":
-            pass
-        elif constraint.type.lower() in ["u", "p"]:
-            # Load data selected by the from_select-clause
-            # TODO: I guess this should not be done this way.
-            #       Use joins instead to avoid piping your results through
-            #       python.
-            if isinstance(values, sa.sql.expression.Select):
-                values = engine.execute(values)
-            for row in values:
-                # TODO: This is horribly inefficient!
-                query = {
-                    "from": {"type": "table", "schema": schema, "table": table},
-                    "where": {
-                        "type": "operator",
-                        "operator": "AND",
-                        "operands": [
-                            {
-                                "operands": [
-                                    {"type": "column", "column": c},
-                                    {"type": "value", "value": _load_value(row[c])}
-                                    if c in row
-                                    else {"type": "value"},
-                                ],
-                                "operator": "=",
-                                "type": "operator",
-                            }
-                            for c in columns
-                        ],
-                    },
-                    "fields": [{"type": "column", "column": f} for f in columns],
-                }
-                rows = __internal_select(query, context)
-                if rows["data"]:
-                    raise APIError(
-                        "Action violates constraint {cn}. Failing row was {row}".format(
-                            cn=constraint.conname,
-                            row="("
-                            + (
-                                ", ".join(
-                                    str(row[c]) for c in row if not c.startswith("_")
-                                )
-                            ),
-                        )
-                        + ")"
-                    )
+
+def data_insert_check(schema, table, values, context):
+
+    engine = _get_engine()
+    session = sessionmaker(bind=engine)()
+    preparer = engine.dialect.identifier_preparer
+    try:
+        if isinstance(values, sa.sql.expression.Select):
+            values = [dict(row) for row in session.execute(values)]
+        constraints = session.execute(
+            sa.text(_KEY_CONSTRAINT_QUERY),
+            {"table": preparer.quote_schema(schema) + "." + preparer.quote(table)},
+        ).fetchall()
+        for constraint in constraints:
+            row = _find_key_violation(
+                session, schema, table, constraint.columns, constraint.types, values
+            )
+            if row is not None:
+                raise APIError(
+                    _violation_message("constraint " + constraint.conname, row)
+                )
+    finally:
+        session.close()
 
     for column_name, column in describe_columns(schema, table).items():
         if not column.get("is_nullable", True):
             for row in values:
                 val = row.get(column_name, None)
-                if val is None or (isinstance(val, str) and val.lower() == "null"):
+                if _is_null(val):
                     if column_name in row or not column.get("column_default", None):
                         raise APIError(
-                            "Action violates not-null constraint on {col}. Failing row was {row}".format(
-                                col=column_name,
-                                row="("
-                                + (
-                                    ", ".join(
-                                        str(row[c])
-                                        for c in row
-                                        if not c.startswith("_")
-                                    )
-                                ),
+                            _violation_message(
+                                "not-null constraint on " + column_name, row
                             )
-                            + ")"
                         )
 
 
@@ -1219,7 +1457,13 @@ def data_insert(request, context=None):
 
     query, values = api.parser.parse_insert(request, context)
     data_insert_check(orig_schema, orig_table, values, context)
-    _execute_sqla(query, cursor)
+    if _use_copy(request, values):
+        returning = [
+            api.parser.parse_expression(x) for x in request.get("returning", [])
+        ]
+        _copy_insert(query.table, values, returning, cursor)
+    else:
+        _execute_sqla(query, cursor)
     description = cursor.description
     response = {}
     if description:
@@ -1242,21 +1486,180 @@ def data_insert(request, context=None):
     return response
 
 
-def _execute_sqla(query, cursor):
-    dialect = _get_engine().dialect
+def _use_copy(request, values):
+    """
+    Decides whether the values of an insert request are loaded via COPY. This
+    is the case if the request asks for it (`bulk`) or contains at least
+    `BULK_INSERT_THRESHOLD` rows. Rows that contain SQL expressions or differ
+    in their columns are always inserted by a regular INSERT.
+
+    :param request: The insert request
+    :param values: Values as returned by :func:`api.parser.parse_insert`
+    :return: True, if COPY should be used
+    """
+    if request.get("method", "values") != "values" or not values:
+        return False
+    bulk = request.get("bulk")
+    if bulk is None:
+        if len(values) < BULK_INSERT_THRESHOLD:
+            return False
+    elif not read_bool(bulk):
+        return False
+    keys = set(values[0])
+    return all(
+        set(row) == keys
+        and not any(isinstance(v, sa.sql.ClauseElement) for v in row.values())
+        for row in values
+    )
+
+
+def _pg_text(value):
+    """Returns the PostgreSQL text representation of a JSON-like value"""
+    if value is True:
+        return "true"
+    elif value is False:
+        return "false"
+    elif isinstance(value, dict):
+        return json.dumps(value)
+    elif isinstance(value, (list, tuple)):
+        return _pg_array(value)
+    else:
+        return str(value)
+
+
+def _pg_array(values):
+    elements = []
+    for value in values:
+        if value is None:
+            elements.append("NULL")
+        elif isinstance(value, (list, tuple)):
+            elements.append(_pg_array(value))
+        else:
+            text = _pg_text(value)
+            elements.append(
+                '"' + text.replace("\\", "\\\\").replace('"', '\\"') + '"'
+            )
+    return "{" + ",".join(elements) + "}"
+
+
+def _copy_field(value, is_json=False):
+    if value is None:
+        return ""
+    if is_json and isinstance(value, (dict, list, tuple)):
+        # Lists are JSON arrays in JSON columns, as in a regular INSERT
+        text = json.dumps(value)
+    else:
+        text = _pg_text(value)
+    return '"' + text.replace('"', '""') + '"'
+
+
+def _copy_lines(values, columns, json_columns=()):
+    for row in values:
+        yield ",".join(_copy_field(row[c], c in json_columns) for c in columns) + "\n"
+
+
+def _copy_insert(table, values, returning, cursor):
+    """
+    Inserts `values` into `table` by streaming them into a temporary table
+    via COPY. The rows are moved to `table` by a single INSERT ... SELECT that
+    adds the meta fields (`_user`, `_message`, `_type`) on the server.
+
+    :param table: Reflected meta table the rows are inserted into
+    :param values: List of dictionaries as returned by
+        :func:`api.parser.parse_insert`
+    :param returning: List of expressions for the RETURNING clause
+    :param cursor: Cursor of the current session
+    """
+    meta_values = {k: values[0].get(k) for k in _META_FIELDS}
+    columns = [c for c in values[0] if c not in _META_FIELDS]
+    json_columns = {
+        c for c in columns if isinstance(get_column_obj(table, c).type, sqltypes.JSON)
+    }
+
+    preparer = _get_engine().dialect.identifier_preparer
+    staging = "_copy_" + uuid.uuid4().hex
+    column_list = ", ".join(preparer.quote(c) for c in columns)
+
+    helper = cursor.connection.cursor()
     try:
-        compiled = query.compile(dialect=dialect)
-    except exc.SQLAlchemyError as e:
+        helper.execute(
+            "CREATE TEMPORARY TABLE {staging} ON COMMIT DROP AS "
+            "SELECT {columns} FROM {table} WITH NO DATA".format(
+                staging=staging, columns=column_list, table=preparer.format_table(table)
+            )
+        )
+        helper.copy_expert(
+            "COPY {staging} ({columns}) FROM STDIN WITH CSV".format(
+                staging=staging, columns=column_list
+            ),
+            IteratorReader(_copy_lines(values, columns, json_columns)),
+        )
+        staging_table = sa.table(staging, *(column(c) for c in columns))
+        query = table.insert().from_select(
+            columns + list(_META_FIELDS),
+            sa.select(
+                [staging_table.c[c] for c in columns]
+                + [sa.literal(meta_values[k]).label(k) for k in _META_FIELDS]
+            ),
+        )
+        if returning:
+            query = query.returning(*returning)
+        _execute_sqla(query, cursor)
+        helper.execute("DROP TABLE {staging}".format(staging=staging))
+    except psycopg2.DataError as e:
         raise APIError(repr(e))
+    finally:
+        helper.close()
+
+
+def _execute_sqla(query, cursor):
+    _run_sqla(query, cursor.execute)
+
+
+def _copy_sqla(query, cursor, file):
+    """
+    Writes the result of `query` to `file` as CSV (with header line) using
+    ``COPY (...) TO STDOUT``. All values are quoted, NULL is written as an
+    unquoted empty field.
+
+    :param query: A SQLAlchemy select
+    :param cursor: An unnamed cursor of the current session
+    :param file: A file-like object with a ``write`` method
+    """
+
+    def copy(statement, params):
+        # COPY does not accept bind parameters, so they are inlined by
+        # psycopg2 here.
+        encoding = psycopg2.extensions.encodings[cursor.connection.encoding]
+        statement = cursor.mogrify(statement, params).decode(encoding)
+        cursor.copy_expert(
+            "COPY ({statement}) TO STDOUT "
+            "WITH (FORMAT csv, HEADER, FORCE_QUOTE *)".format(statement=statement),
+            file,
+        )
+
+    _run_sqla(query, copy)
+
+
+def _run_sqla(query, execute):
+    dialect = _get_engine().dialect
+    if isinstance(query, api.parser.CompiledQuery):
+        statement, params = query
+    else:
+        try:
+            compiled = query.compile(dialect=dialect)
+        except exc.SQLAlchemyError as e:
+            raise APIError(repr(e))
+        statement, params = str(compiled), compiled.params
     try:
-        params = dict(compiled.params)
+        params = dict(params)
         for key, value in params.items():
             if isinstance(value, dict):
                 if dialect._json_serializer is None:
                     params[key] = json.dumps(value)
                 else:
                     params[key] = dialect._json_serializer(value)
-        cursor.execute(str(compiled), params)
+        execute(statement, params)
     except (psycopg2.DataError, exc.IdentifierError, psycopg2.IntegrityError) as e:
         raise APIError(repr(e))
     except psycopg2.InternalError as e:
@@ -1295,10 +1698,126 @@ def process_value(val):
         return str(val)
 
 
+REJECTED_SEARCHES = metrics.Counter(
+    "oep_api_search_rejected_total",
+    "Searches rejected because of their estimated cost",
+    labels=("tier",),
+)
+
+
+def _user_tier(user):
+    """
+    Returns the class of `user` by which search limits are configured:
+    "anonymous", "registered" or "group" for admins and members of groups
+    """
+    if user is None or user.is_anonymous:
+        return "anonymous"
+    if user.is_admin or user.memberships.exists():
+        return "group"
+    return "registered"
+
+
+def _admit_query(query, cursor, tier):
+    """
+    Sets the statement timeout of `tier` in the transaction of `cursor` and
+    rejects `query` if its estimated cost exceeds the limit of `tier`. Both
+    happen in one round trip. The timeout must be lifted by
+    :func:`_reset_statement_timeout` once the query is done.
+
+    :return: True, if a statement timeout was set
+    """
+    limit = SEARCH_COST_LIMITS.get(tier)
+    timeout = SEARCH_STATEMENT_TIMEOUTS.get(tier)
+    if limit is None and timeout is None:
+        return False
+    prefix = ""
+    if timeout is not None:
+        prefix = "SET LOCAL statement_timeout = %d; " % (timeout * 1000)
+    # The cursor of the session may be a named one, which only runs a
+    # single query.
+    helper = cursor.connection.cursor()
+    try:
+        if limit is None:
+            helper.execute(prefix)
+            return True
+        _run_sqla(
+            query,
+            lambda statement, params: helper.execute(
+                prefix + "EXPLAIN (FORMAT JSON) " + statement, params
+            ),
+        )
+        plan = helper.fetchone()[0]
+    finally:
+        helper.close()
+    if isinstance(plan, str):
+        plan = json.loads(plan)
+    cost = plan[0]["Plan"]["Total Cost"]
+    if cost > limit:
+        REJECTED_SEARCHES.inc(tier=tier)
+        if timeout is not None:
+            _reset_statement_timeout(cursor.connection)
+        raise APIError(
+            "The estimated cost of this query ({cost:.0f}) exceeds the limit "
+            "of {limit:.0f} for {tier} users. Please restrict the query, e.g. "
+            "by conditions, joins on keys or a limit.".format(
+                cost=cost, limit=limit, tier=tier
+            )
+        )
+    return timeout is not None
+
+
+def _reset_statement_timeout(connection):
+    """
+    Lifts the statement timeout set by :func:`_admit_query`, so it does not
+    apply to later statements in the same transaction
+    """
+    helper = connection.cursor()
+    try:
+        helper.execute("SET LOCAL statement_timeout TO DEFAULT")
+    except psycopg2.InternalError:
+        # The transaction failed (e.g. by the timeout) and must be rolled
+        # back, which lifts the timeout as well.
+        pass
+    finally:
+        helper.close()
+
+
+def _cancelled_query():
+    return APIError("The query was cancelled by the statement timeout")
+
+
+def _fetch(fetch, *args):
+    # Named cursors run their query while the rows are fetched, so the
+    # statement timeout of a search may also end a fetch.
+    try:
+        return fetch(*args)
+    except psycopg2.errors.QueryCanceled:
+        raise _cancelled_query()
+
+
 def data_search(request, context=None):
-    query = api.parser.parse_select(request)
+    query = api.parser.compile_select(request)
+    session = load_session_from_context(context)
     cursor = load_cursor_from_context(context)
-    _execute_sqla(query, cursor)
+    tier = _user_tier(context.get("user"))
+    limited = _admit_query(query, cursor, tier)
+    try:
+        _execute_sqla(query, cursor)
+    except psycopg2.errors.QueryCanceled:
+        raise APIError(
+            "The query was cancelled after {timeout} seconds, the statement "
+            "timeout for {tier} users".format(
+                timeout=SEARCH_STATEMENT_TIMEOUTS[tier], tier=tier
+            )
+        )
+    finally:
+        if limited:
+            if cursor.name is None:
+                _reset_statement_timeout(cursor.connection)
+            else:
+                # The rows of named cursors are computed while they are
+                # fetched. The timeout is lifted when the cursor is closed.
+                session.limited_cursors.add(int(context["cursor_id"]))
     description = [
         [
             col.name,
@@ -1750,27 +2269,196 @@ def close_cursor(request, context):
     session_context = load_session_from_context(context)
     cursor_id = int(context["cursor_id"])
     session_context.close_cursor(cursor_id)
+    if cursor_id in session_context.limited_cursors:
+        session_context.limited_cursors.discard(cursor_id)
+        _reset_statement_timeout(session_context.connection)
     return {"cursor_id": cursor_id}
 
 
 def fetchone(request, context):
     cursor = load_cursor_from_context(context)
-    row = cursor.fetchone()
+    row = _fetch(cursor.fetchone)
     if row:
-        row = [_translate_fetched_cell(cell) for cell in row]
-        return row
+        return _translate_fetched_rows([row])[0]
     else:
         return row
 
 
-def fetchall(context):
+def fetchall(context, size=None):
+    """
+    Fetches the remaining rows of a cursor by repeated calls of
+    ``fetchmany``, so they are never held in memory all at once.
+
+    :param context: Context with the connection and cursor id
+    :param size: Number of rows per batch (default: the cursor's itersize)
+    :return: An iterator over lists of rows
+    """
     cursor = load_cursor_from_context(context)
-    return cursor.fetchall()
+    if size is None:
+        size = getattr(cursor, "itersize", 2000)
+    return iter(lambda: _fetch(cursor.fetchmany, size), [])
 
 
 def fetchmany(request, context):
     cursor = load_cursor_from_context(context)
-    return cursor.fetchmany(request["size"])
+    size = request.get("size", cursor.arraysize)
+    try:
+        size = int(size)
+    except (TypeError, ValueError):
+        raise APIError("Invalid size: %s" % size)
+    if size < 1:
+        raise APIError("Invalid size: %s" % size)
+    return _fetch(cursor.fetchmany, size)
+
+
+def _batch_fetchmany(request, context):
+    cursor = load_cursor_from_context(context)
+    rows = fetchmany(request, context)
+    return _translate_fetched_rows(rows, cursor.description or [])
+
+
+def _batch_fetchall(request, context):
+    cursor = load_cursor_from_context(context)
+    rows = [row for rows in fetchall(context) for row in rows]
+    return _translate_fetched_rows(rows, cursor.description or [])
+
+
+# Operations of a batch by the path of their endpoint below
+# /api/v0/advanced, and whether they run on a cursor. The connection is
+# opened, committed and closed by the batch itself.
+_BATCH_OPERATIONS = {
+    "search": (data_search, True),
+    "insert": (data_insert, True),
+    "update": (data_update, True),
+    "delete": (data_delete, True),
+    "has_schema": (has_schema, False),
+    "has_table": (has_table, False),
+    "has_sequence": (has_sequence, False),
+    "has_type": (has_type, False),
+    "get_schema_names": (get_schema_names, False),
+    "get_table_names": (get_table_names, False),
+    "get_view_names": (get_view_names, False),
+    "get_view_definition": (get_view_definition, False),
+    "get_columns": (get_columns, False),
+    "get_pk_constraint": (get_pk_constraint, False),
+    "get_foreign_keys": (get_foreign_keys, False),
+    "get_indexes": (get_indexes, False),
+    "get_unique_constraints": (get_unique_constraints, False),
+    "cursor/open": (open_cursor, False),
+    "cursor/close": (close_cursor, False),
+    "cursor/fetch_one": (fetchone, False),
+    "cursor/fetch_many": (_batch_fetchmany, False),
+    "cursor/fetch_all": (_batch_fetchall, False),
+}
+
+
+def _resolve_cursor_id(cursor_id, cursors):
+    # A cursor may be given by its id or as {"step": n}, which refers to the
+    # cursor opened or used by the n-th operation of the batch.
+    if not isinstance(cursor_id, dict):
+        return cursor_id
+    step = cursor_id.get("step")
+    if not isinstance(step, int) or not 0 <= step < len(cursors):
+        raise APIError("Invalid reference to step %s" % step)
+    if cursors[step] is None:
+        raise APIError("Step %d did not use a cursor" % step)
+    return cursors[step]
+
+
+def _run_batch_operation(operation, cursors, context):
+    """
+    :param cursors: The ids of the cursors used by the previous operations
+    :return: The result of the operation and the id of the cursor it opened
+        or used, if any
+    """
+    if not isinstance(operation, dict):
+        raise APIError("Operations must be objects")
+    action = get_or_403(operation, "action")
+    if action not in _BATCH_OPERATIONS:
+        raise APIError("Unknown operation: %s" % action)
+    func, requires_cursor = _BATCH_OPERATIONS[action]
+    request = operation.get("query", {})
+    context = dict(context)
+    if "cursor_id" in operation:
+        cursor_id = _resolve_cursor_id(operation["cursor_id"], cursors)
+        context["cursor_id"] = cursor_id
+        result = func(request, context)
+        if isinstance(result, dict):
+            result.setdefault("cursor_id", cursor_id)
+        return result, cursor_id
+    if not requires_cursor:
+        result = func(request, context)
+        if action == "cursor/open":
+            return result, result["cursor_id"]
+        return result, None
+    # Like requests to the single endpoints, operations without a cursor
+    # get one of their own that is read and closed right away.
+    context.update(open_cursor({}, context))
+    try:
+        result = func(request, context) or {}
+        cursor = load_cursor_from_context(context)
+        if cursor.description:
+            result["data"] = _translate_fetched_rows(
+                cursor.fetchall(), cursor.description
+            )
+    finally:
+        close_cursor({}, context)
+    return result, None
+
+
+def batch(request, context):
+    """
+    Runs a list of operations of the advanced API in one transaction and
+    returns their results in order. Each operation is an object with the
+    path of its endpoint as `action`, its `query` and optionally a
+    `cursor_id`, which may refer to the cursor of an earlier operation as
+    ``{"step": n}``.
+
+    If no `connection_id` is given, the batch runs on a connection of its
+    own that is committed if all operations succeed and rolled back
+    otherwise. On a given connection, the transaction is left open.
+
+    :param request: A dictionary with the list of `operations`
+    :param context: Context of the request
+    :return: List of the results of all operations
+    """
+    operations = get_or_403(request, "operations")
+    if not isinstance(operations, list):
+        raise APIError("Operations must be passed as a list")
+    context = {
+        key: context[key] for key in ("user", "connection_id") if key in context
+    }
+    own_connection = "connection_id" not in context
+    if own_connection:
+        context.update(open_raw_connection({}, context))
+    session = load_session_from_context(context)
+    results = []
+    cursors = []
+    try:
+        for step, operation in enumerate(operations):
+            try:
+                result, cursor_id = _run_batch_operation(operation, cursors, context)
+                results.append(result)
+                cursors.append(cursor_id)
+            except APIError as e:
+                raise APIError(
+                    "Step {step} failed: {reason}".format(step=step, reason=e.message),
+                    status=e.status,
+                )
+            except (psycopg2.DataError, psycopg2.ProgrammingError) as e:
+                raise APIError(
+                    "Step {step} failed: {reason}".format(step=step, reason=e)
+                )
+        if own_connection:
+            session.connection.commit()
+    except:
+        if own_connection:
+            session.connection.rollback()
+        raise
+    finally:
+        if own_connection:
+            session.close()
+    return results
 
 
 def get_comment_table_name(schema, table, create=True):
@@ -1828,15 +2516,27 @@ def create_meta_table(schema, table, meta_table, meta_schema=None, include_index
         if include_indexes:
             query += 'INCLUDING ALL EXCLUDING INDEXES, PRIMARY KEY (_id) '
         query += ') INHERITS (_edit_base);'
+        # Pending changes are looked up by this partial index, so
+        # applying them does not scan the history of the table
+        query += 'CREATE INDEX "{index}" ON "{meta_schema}"."{edit_table}" ' \
+                 '(_submitted, _id) WHERE _applied = FALSE;'
         query = query.format(
             meta_schema=meta_schema,
             edit_table=meta_table,
             schema=schema,
-            table=table)
+            table=table,
+            index=get_pending_index_name(meta_table))
         engine = _get_engine()
         engine.execute(query)
 
 
+def get_pending_index_name(meta_table):
+    # Index names are truncated to 63 characters by PostgreSQL. The digest
+    # keeps names of long tables with a common prefix apart.
+    digest = hashlib.md5(meta_table.encode("utf-8")).hexdigest()[:8]
+    return "{table}_pending_{digest}".format(table=meta_table[:40], digest=digest)
+
+
 def create_delete_table(schema, table, meta_schema=None):
     meta_table = get_delete_table_name(schema, table, create=False)
     create_meta_table(schema, table, meta_table, meta_schema, include_indexes=False)
@@ -1890,11 +2590,44 @@ def getValue(schema, table, column, id):
     return None
 
 
+def _pending_changes(connection, meta_table, mode):
+    """
+    Streams the ids of all unapplied changes in `meta_table` in the order they
+    were submitted. The rows are read through a server-side cursor, so memory
+    does not grow with the number of pending changes.
+
+    :return: Iterator over tuples (_submitted, mode, _id)
+    """
+    preparer = _get_engine().dialect.identifier_preparer
+    cursor = connection.cursor(name="apply_" + uuid.uuid4().hex)
+    cursor.itersize = APPLY_BATCH_SIZE
+    try:
+        cursor.execute(
+            "SELECT _submitted, _id "
+            "FROM {table} "
+            "WHERE _applied = FALSE "
+            "ORDER BY _submitted NULLS FIRST, _id;".format(
+                table=preparer.format_table(meta_table)
+            )
+        )
+        for submitted, rid in cursor:
+            yield submitted or datetime.min, mode, rid
+    finally:
+        cursor.close()
+
+
 def apply_changes(schema, table, cursor=None):
-    def add_type(d, type):
-        d["_type"] = type
-        return d
+    """
+    Applies all pending changes of a table in the order they were submitted.
+    The pending changes of the insert, edit and delete tables are merged
+    while they are streamed and applied in batches of consecutive changes of
+    the same type.
 
+    :param schema: Schema name
+    :param table: Table name
+    :param cursor: Cursor of the session to use. If not given, a new
+        connection is opened and committed afterwards.
+    """
     engine = _get_engine()
 
     artificial_connection = False
@@ -1905,81 +2638,27 @@ def apply_changes(schema, table, cursor=None):
         cursor = connection.cursor()
 
     try:
-        meta_schema = get_meta_schema_name(schema)
-
-        columns = list(describe_columns(schema, table).keys())
-        extended_columns = columns + ["_submitted", "_id"]
-
-        insert_table = get_insert_table_name(schema, table)
-        cursor.execute(
-            "select * "
-            "from {schema}.{table} "
-            "where _applied = FALSE;".format(schema=meta_schema, table=insert_table)
-        )
-        changes = [
-            add_type(
-                {
-                    c.name: v
-                    for c, v in zip(cursor.description, row)
-                    if c.name in extended_columns
-                },
-                "insert",
-            )
-            for row in cursor.fetchall()
+        table_obj = _get_table(schema, table)
+        streams = [
+            _pending_changes(cursor.connection, _get_meta_table(table_obj, mode), mode)
+            for mode in (__INSERT, __UPDATE, __DELETE)
         ]
 
-        update_table = get_edit_table_name(schema, table)
-        cursor.execute(
-            "select * "
-            "from {schema}.{table} "
-            "where _applied = FALSE;".format(schema=meta_schema, table=update_table)
-        )
-        changes += [
-            add_type(
-                {
-                    c.name: v
-                    for c, v in zip(cursor.description, row)
-                    if c.name in extended_columns
-                },
-                "update",
-            )
-            for row in cursor.fetchall()
-        ]
-
-        delete_table = get_delete_table_name(schema, table)
-        cursor.execute(
-            "select * "
-            "from {schema}.{table} "
-            "where _applied = FALSE;".format(schema=meta_schema, table=delete_table)
-        )
-        changes += [
-            add_type(
-                {
-                    c.name: v
-                    for c, v in zip(cursor.description, row)
-                    if c.name in ["_id", "id", "_submitted"]
-                },
-                "delete",
-            )
-            for row in cursor.fetchall()
-        ]
-
-        changes = list(changes)
-        table_obj = Table(table, MetaData(bind=engine), autoload=True, schema=schema)
-
         # ToDo: This may require some kind of dependency tree resolution
         prev_type = None
         change_batch = []
-        for change in sorted(changes, key=lambda x: x["_submitted"]):
-            distilled_change = {k: v for k, v in change.items() if k in columns}
-            if prev_type and change["_type"] != prev_type:
+        for _, change_type, rid in heapq.merge(*streams):
+            if change_batch and (
+                change_type != prev_type or len(change_batch) >= APPLY_BATCH_SIZE
+            ):
                 _apply_stack(cursor, table_obj, change_batch, prev_type)
                 change_batch = []
-            else:
-                change_batch.append((distilled_change, change["_id"]))
-            prev_type = change["_type"]
-        if prev_type:
+            change_batch.append(rid)
+            prev_type = change_type
+        if change_batch:
             _apply_stack(cursor, table_obj, change_batch, prev_type)
+        if prev_type is not None:
+            bump_table_version(schema, table, cursor)
         if artificial_connection:
             connection.commit()
     except:
@@ -1992,17 +2671,23 @@ def apply_changes(schema, table, cursor=None):
             connection.close()
 
 
-def _apply_stack(cursor, table_obj, changes, change_type):
-    distilled_change, rids = zip(*changes)
-    if change_type == "insert":
-        apply_insert(cursor, table_obj, distilled_change, rids)
-    elif change_type == "update":
-        apply_update(cursor, table_obj, distilled_change, rids)
-    elif change_type == "delete":
-        apply_deletion(cursor, table_obj, distilled_change, rids)
+def _apply_stack(cursor, table_obj, rids, change_type):
+    if change_type == __INSERT:
+        apply_insert(cursor, table_obj, rids)
+    elif change_type == __UPDATE:
+        apply_update(cursor, table_obj, rids)
+    elif change_type == __DELETE:
+        apply_deletion(cursor, table_obj, rids)
 
 
-def set_applied(session, table, rids, mode):
+def _any_of(values, type_):
+    """Returns `ANY(:values)` with all values bound as a single array"""
+    return sa.any_(
+        sa.bindparam("values", value=list(values), type_=ARRAY(type_), unique=True)
+    )
+
+
+def _get_meta_table(table, mode):
     if mode == __INSERT:
         name_map = get_insert_table_name
     elif mode == __DELETE:
@@ -2011,43 +2696,94 @@ def set_applied(session, table, rids, mode):
         name_map = get_edit_table_name
     else:
         raise NotImplementedError
-    meta_table = Table(
-        name_map(table.schema, table.name),
-        MetaData(bind=_get_engine()),
-        autoload=True,
-        schema=get_meta_schema_name(table.schema),
-    )
-    update_query = (
+    meta_schema = get_meta_schema_name(table.schema)
+    meta_name = name_map(table.schema, table.name, create=False)
+    # The meta table is only created (which checks the catalog again) if the
+    # catalog snapshot does not know it yet.
+    if not CATALOG.has_table(meta_schema, meta_name):
+        name_map(table.schema, table.name)
+        CATALOG.add_table(meta_schema, meta_name)
+    return _get_table(meta_schema, meta_name)
+
+
+def _shared_columns(table, meta_table):
+    # Columns added to a table outside of the API are missing in meta tables
+    # that were created before
+    return [c for c in table.columns if c.name in meta_table.c]
+
+
+def set_applied(session, table, rids, mode):
+    meta_table = _get_meta_table(table, mode)
+    query = (
         meta_table.update()
-        .where(sql.or_(*(meta_table.c._id == i for i in rids)))
+        .where(meta_table.c._id == _any_of(rids, meta_table.c._id.type))
         .values(_applied=True)
-        .compile()
     )
-    session.execute(str(update_query), update_query.params)
+    _execute_sqla(query, session)
 
 
-def apply_insert(session, table, rows, rids):
-    logger.info("apply inserts " + str(rids))
-    query = table.insert().values(rows)
+def apply_insert(session, table, rids):
+    """
+    Applies a batch of insertions with a single INSERT ... SELECT from the
+    insert table.
+    """
+    logger.info("apply inserts " + str(len(rids)))
+    meta_table = _get_meta_table(table, __INSERT)
+    columns = [c.name for c in _shared_columns(table, meta_table)]
+    rows = (
+        sa.select([meta_table.c[c] for c in columns])
+        .where(meta_table.c._id == _any_of(rids, meta_table.c._id.type))
+        .order_by(meta_table.c._submitted, meta_table.c._id)
+    )
+    query = table.insert().from_select(columns, rows)
     _execute_sqla(query, session)
     set_applied(session, table, rids, __INSERT)
 
 
-def apply_update(session, table, rows, rids):
-    for row, rid in zip(rows,rids):
-        logger.info("apply update " + str(row))
-        pks = [c.name for c in table.columns if c.primary_key]
-        query = table.update(*[getattr(table.c, pk) == row[pk] for pk in pks]).values(row)
-        _execute_sqla(query, session)
-        set_applied(session, table, [rid], __UPDATE)
+def apply_update(session, table, rids):
+    """
+    Applies a batch of edits with a single UPDATE ... FROM. The new values
+    are taken from the edit table directly. If a row was edited several
+    times, only its latest edit is applied.
+    """
+    logger.info("apply updates " + str(len(rids)))
+    pks = [c for c in table.columns if c.primary_key] or [table.c.id]
+    meta_table = _get_meta_table(table, __UPDATE)
+    columns = _shared_columns(table, meta_table)
+    latest = (
+        sa.select([meta_table.c[c.name] for c in columns])
+        .where(meta_table.c._id == _any_of(rids, meta_table.c._id.type))
+        .distinct(*(meta_table.c[pk.name] for pk in pks))
+        .order_by(
+            *(meta_table.c[pk.name] for pk in pks),
+            meta_table.c._submitted.desc(),
+            meta_table.c._id.desc()
+        )
+        .alias("latest")
+    )
+    query = (
+        table.update()
+        .where(sa.and_(*(pk == latest.c[pk.name] for pk in pks)))
+        .values(
+            {c.name: latest.c[c.name] for c in columns if not c.primary_key}
+        )
+    )
+    _execute_sqla(query, session)
+    set_applied(session, table, rids, __UPDATE)
 
 
-def apply_deletion(session, table, rows, rids):
-    for row, rid in zip(rows, rids):
-        logger.info("apply deletion " + str(row))
-        query = table.delete().where(*[getattr(table.c, col) == row[col] for col in row])
-        _execute_sqla(query, session)
-        set_applied(session, table, [rid], __DELETE)
+def apply_deletion(session, table, rids):
+    """
+    Applies a batch of deletions with a single DELETE ... WHERE id IN (...)
+    """
+    logger.info("apply deletions " + str(len(rids)))
+    meta_table = _get_meta_table(table, __DELETE)
+    ids = sa.select([meta_table.c.id]).where(
+        meta_table.c._id == _any_of(rids, meta_table.c._id.type)
+    )
+    query = table.delete().where(table.c.id.in_(ids))
+    _execute_sqla(query, session)
+    set_applied(session, table, rids, __DELETE)
 
 
 def update_meta_search(session, table, schema, insert_only=False):
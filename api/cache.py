@@ -0,0 +1,347 @@
+"""
+This module holds process-wide caches for catalog information that is
+expensive to load from the database on every request.
+"""
+
+import threading
+import time
+from collections import OrderedDict
+
+from sqlalchemy import MetaData, Table, text
+
+import oeplatform.securitysettings as sec
+from api.connection import _get_engine
+
+REFLECTION_CACHE_SIZE = getattr(sec, "REFLECTION_CACHE_SIZE", 512)
+
+CATALOG_CACHE_TTL = getattr(sec, "CATALOG_CACHE_TTL", 5)
+
+CATALOG_MISS_TTL = getattr(sec, "CATALOG_MISS_TTL", 1)
+
+COMPILED_QUERY_CACHE_SIZE = getattr(sec, "COMPILED_QUERY_CACHE_SIZE", 1024)
+
+
+class LRUCache:
+    """A thread-safe mapping that evicts its least recently used entries once
+    it holds more than `maxsize` items.
+    """
+
+    def __init__(self, maxsize):
+        self.maxsize = maxsize
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key, default=None):
+        with self._lock:
+            try:
+                value = self._data[key]
+            except KeyError:
+                return default
+            self._data.move_to_end(key)
+            return value
+
+    def put(self, key, value):
+        with self._lock:
+            self._data[key] = value
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def pop(self, key, default=None):
+        with self._lock:
+            return self._data.pop(key, default)
+
+    def discard_if(self, predicate):
+        """Remove all entries whose key satisfies `predicate`"""
+        with self._lock:
+            for key in [k for k in self._data if predicate(k)]:
+                del self._data[key]
+
+    def discard_values_if(self, predicate):
+        """Remove all entries whose value satisfies `predicate`"""
+        with self._lock:
+            for key in [k for k, v in self._data.items() if predicate(v)]:
+                del self._data[key]
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    def __contains__(self, key):
+        with self._lock:
+            return key in self._data
+
+    def __len__(self):
+        with self._lock:
+            return len(self._data)
+
+
+_TABLES = LRUCache(REFLECTION_CACHE_SIZE)
+
+# Table descriptions as loaded by api.actions.describe_table. Entries are
+# tagged with the version of their table and are reloaded once it changes.
+DESCRIPTIONS = LRUCache(REFLECTION_CACHE_SIZE)
+
+# Compiled select queries by the shape of their JSON representation (see
+# api.parser.compile_select). Entries have an attribute `tables` that holds
+# the schemas and names of all tables they refer to.
+COMPILED_QUERIES = LRUCache(COMPILED_QUERY_CACHE_SIZE)
+
+
+def _meta_table_keys(schema, table):
+    meta_schema = "_" + schema
+    return [
+        (meta_schema, "_{table}_{suffix}".format(table=table, suffix=suffix))
+        for suffix in ("insert", "edit", "delete", "cor")
+    ]
+
+
+_SEARCH_PATH_SCHEMA = []
+
+
+def search_path_schema():
+    """
+    :return: The schema that tables referred to without a schema resolve to,
+        i.e. the first existing schema in the search_path of the API. It is
+        loaded once per process.
+    """
+    if not _SEARCH_PATH_SCHEMA:
+        schema = _get_engine().execute(text("SELECT current_schema()")).scalar()
+        _SEARCH_PATH_SCHEMA.append(schema)
+    return _SEARCH_PATH_SCHEMA[0]
+
+
+def load_table(schema, table):
+    """
+    Returns the reflected :class:`sqlalchemy.Table` for `schema`.`table`.
+    Tables are reflected once and kept until they are evicted or invalidated
+    by :func:`invalidate_table`.
+
+    :param schema: Schema name
+    :param table: Table name
+    :return: A reflected table object
+    """
+    key = (schema, table)
+    # Loads the versions of all tables before the first one is cached, so
+    # that changes by other workers are noticed (see CatalogSnapshot)
+    CATALOG.refresh()
+    table_obj = _TABLES.get(key)
+    if table_obj is None:
+        engine = _get_engine()
+        # Every table gets its own MetaData, so evicting an entry does not
+        # leave references to it in a shared registry.
+        table_obj = Table(
+            table,
+            MetaData(bind=engine),
+            autoload=True,
+            autoload_with=engine,
+            schema=schema,
+        )
+        _TABLES.put(key, table_obj)
+    return table_obj
+
+
+def invalidate_table(schema, table=None):
+    """
+    Drops cached reflections, descriptions and compiled queries of
+    `schema`.`table` and its meta tables. If no table is given, all tables of
+    that schema are dropped.
+
+    :param schema: Schema name
+    :param table: Table name
+    """
+    if table is None:
+        schemas = (schema, "_" + schema)
+        _TABLES.discard_if(lambda key: key[0] in schemas)
+        DESCRIPTIONS.discard_if(lambda key: key[0] == schema)
+        COMPILED_QUERIES.discard_values_if(
+            lambda entry: any(key[0] == schema for key in entry.tables)
+        )
+    else:
+        for key in [(schema, table)] + _meta_table_keys(schema, table):
+            _TABLES.pop(key)
+        DESCRIPTIONS.pop((schema, table))
+        COMPILED_QUERIES.discard_values_if(
+            lambda entry: (schema, table) in entry.tables
+        )
+
+
+# Relation kinds that count as tables: tables, partitioned tables, foreign
+# tables, views and materialized views
+_TABLE_KINDS = "('r', 'p', 'f', 'v', 'm')"
+
+_CATALOG_QUERY = text(
+    "SELECT n.nspname, c.relname, v.version FROM pg_namespace AS n "
+    "LEFT JOIN pg_class AS c ON c.relnamespace = n.oid "
+    "AND c.relkind IN " + _TABLE_KINDS + " "
+    'LEFT JOIN public.table_versions AS v ON v."schema" = n.nspname '
+    'AND v."table" = c.relname'
+)
+
+_SCHEMA_QUERY = text("SELECT 1 FROM pg_namespace WHERE nspname = :schema")
+
+_TABLE_QUERY = text(
+    "SELECT 1 FROM pg_class AS c "
+    "JOIN pg_namespace AS n ON n.oid = c.relnamespace "
+    "WHERE n.nspname = :schema AND c.relname = :table "
+    "AND c.relkind IN " + _TABLE_KINDS
+)
+
+
+class CatalogSnapshot:
+    """
+    Names of all schemas and tables, loaded with a single query and reloaded
+    after `ttl` seconds. Names that are missing in the snapshot are looked
+    up in the catalog before they are reported as missing. Names that are
+    missing there as well are not looked up again for `miss_ttl` seconds.
+    So only tables dropped by other processes within the last `ttl` seconds
+    and tables created by them within the last `miss_ttl` seconds may be
+    reported wrongly.
+
+    The snapshot also holds the versions of the tables. Tables whose version
+    changed between two snapshots, e.g. by another worker process, are
+    dropped from the caches of this module. :func:`load_table` refreshes the
+    snapshot before it caches a table, so no table is cached before the
+    versions are known.
+    """
+
+    def __init__(self, ttl, miss_ttl=0):
+        self.ttl = ttl
+        self.miss_ttl = miss_ttl
+        self._lock = threading.Lock()
+        self._loaded = threading.Condition(self._lock)
+        self._expires = 0
+        self._schemas = set()
+        self._tables = set()
+        self._versions = None
+        # Only one thread reloads the snapshot. Tables added or discarded
+        # meanwhile are recorded, since the new snapshot may predate them.
+        self._refreshing = False
+        self._changes = []
+        self._cleared = False
+        # Expiry times of names found missing in the catalog. Tables are
+        # keyed by schema and name, schemas by name and None.
+        self._misses = LRUCache(REFLECTION_CACHE_SIZE)
+
+    def refresh(self):
+        """
+        Reloads the snapshot if it is older than `ttl` seconds. The catalog is
+        queried without holding the lock, and other threads keep using the
+        previous snapshot meanwhile. Only the first snapshot is waited for.
+        """
+        with self._lock:
+            while self._refreshing and self._versions is None:
+                self._loaded.wait()
+            if self._refreshing or time.monotonic() < self._expires:
+                return
+            self._refreshing = True
+            self._changes = []
+            self._cleared = False
+        try:
+            expires = time.monotonic() + self.ttl
+            schemas = set()
+            tables = set()
+            versions = {}
+            for schema, table, version in _get_engine().execute(_CATALOG_QUERY):
+                schemas.add(schema)
+                if table is not None:
+                    tables.add((schema, table))
+                    if version is not None:
+                        versions[(schema, table)] = version
+        except:
+            with self._lock:
+                self._refreshing = False
+                self._loaded.notify_all()
+            raise
+        with self._lock:
+            for change in self._changes:
+                change(schemas, tables)
+            previous = self._versions
+            self._schemas = schemas
+            self._tables = tables
+            self._versions = versions
+            self._expires = 0 if self._cleared else expires
+            self._refreshing = False
+            self._loaded.notify_all()
+        if previous is not None:
+            for key in previous.keys() | versions.keys():
+                if previous.get(key) != versions.get(key):
+                    invalidate_table(*key)
+
+    def _missing(self, key):
+        expires = self._misses.get(key)
+        if expires is None:
+            return False
+        if time.monotonic() < expires:
+            return True
+        self._misses.pop(key)
+        return False
+
+    def _add_miss(self, key):
+        if self.miss_ttl > 0:
+            self._misses.put(key, time.monotonic() + self.miss_ttl)
+
+    def has_schema(self, schema):
+        self.refresh()
+        with self._lock:
+            if schema in self._schemas:
+                return True
+        key = (schema, None)
+        if self._missing(key):
+            return False
+        if _get_engine().execute(_SCHEMA_QUERY, schema=schema).first() is None:
+            self._add_miss(key)
+            return False
+        self.add_schema(schema)
+        return True
+
+    def has_table(self, schema, table):
+        self.refresh()
+        with self._lock:
+            if (schema, table) in self._tables:
+                return True
+        key = (schema, table)
+        if self._missing(key):
+            return False
+        if (
+            _get_engine().execute(_TABLE_QUERY, schema=schema, table=table).first()
+            is None
+        ):
+            self._add_miss(key)
+            return False
+        self.add_table(schema, table)
+        return True
+
+    def _change(self, change):
+        # Must be called with the lock held
+        change(self._schemas, self._tables)
+        if self._refreshing:
+            self._changes.append(change)
+
+    def add_schema(self, schema):
+        with self._lock:
+            self._change(lambda schemas, tables: schemas.add(schema))
+        self._misses.pop((schema, None))
+
+    def add_table(self, schema, table):
+        def change(schemas, tables):
+            schemas.add(schema)
+            tables.add((schema, table))
+
+        with self._lock:
+            self._change(change)
+        self._misses.pop((schema, None))
+        self._misses.pop((schema, table))
+
+    def discard_table(self, schema, table):
+        with self._lock:
+            self._change(lambda schemas, tables: tables.discard((schema, table)))
+
+    def clear(self):
+        with self._lock:
+            self._expires = 0
+            self._cleared = True
+        self._misses.clear()
+
+
+CATALOG = CatalogSnapshot(CATALOG_CACHE_TTL, CATALOG_MISS_TTL)
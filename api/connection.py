@@ -1,6 +1,23 @@
+import threading
+import time
+from collections import OrderedDict, deque
+
+import psycopg2.extensions
 import sqlalchemy as sqla
+from sqlalchemy import exc
+from sqlalchemy.pool import NullPool, QueuePool
 
 import oeplatform.securitysettings as sec
+from api import metrics
+
+# Connections for short work (reflection, catalog lookups, single statements).
+# Long-lived sessions of the advanced API use their own connections.
+DB_POOL_SIZE = getattr(sec, "DB_POOL_SIZE", 10)
+
+DB_POOL_MAX_OVERFLOW = getattr(sec, "DB_POOL_MAX_OVERFLOW", 10)
+
+# Seconds to wait for a connection before the request fails
+DB_POOL_TIMEOUT = getattr(sec, "DB_POOL_TIMEOUT", 10)
 
 
 def get_connection_string():
@@ -9,10 +26,265 @@ def get_connection_string():
     )
 
 
+_local = threading.local()
+
+
+def set_pool_user(user):
+    """
+    Sets the user on whose behalf the current thread checks out connections.
+    Connections are handed out to the waiting users in turn.
+
+    :param user: A user or None. All anonymous users share one turn.
+    """
+    if user is None or user.is_anonymous:
+        _local.user = None
+    else:
+        _local.user = user.pk
+
+
+def _get_pool_user():
+    return getattr(_local, "user", None)
+
+
+class FairQueue:
+    """
+    Hands out up to `capacity` slots. If all slots are taken, waiting threads
+    are served in turn by user, so a burst of requests by one user does not
+    delay everybody else.
+    """
+
+    def __init__(self, capacity):
+        self.capacity = capacity
+        self._used = 0
+        self._waiting = OrderedDict()
+        self._lock = threading.Lock()
+
+    def acquire(self, user, timeout):
+        """
+        :return: False if no slot became free within `timeout` seconds
+        """
+        with self._lock:
+            if self._used < self.capacity and not self._waiting:
+                self._used += 1
+                return True
+            granted = threading.Event()
+            self._waiting.setdefault(user, deque()).append(granted)
+        if granted.wait(timeout):
+            return True
+        with self._lock:
+            # The slot may have been passed on after the wait timed out
+            if granted.is_set():
+                return True
+            waiters = self._waiting[user]
+            waiters.remove(granted)
+            if not waiters:
+                del self._waiting[user]
+        return False
+
+    def release(self):
+        with self._lock:
+            if not self._waiting:
+                self._used -= 1
+                return
+            # The freed slot is passed to the first waiter of the user whose
+            # turn it is. That user moves to the end of the line.
+            user, waiters = self._waiting.popitem(last=False)
+            granted = waiters.popleft()
+            if waiters:
+                self._waiting[user] = waiters
+            granted.set()
+
+    def waiting(self):
+        with self._lock:
+            return sum(len(w) for w in self._waiting.values())
+
+
+class PoolStats:
+    """Counters of connection checkouts"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.checkouts = 0
+        self.timeouts = 0
+        self.wait_seconds = 0.0
+        self.max_wait_seconds = 0.0
+
+    def record(self, wait, timed_out=False):
+        with self._lock:
+            if timed_out:
+                self.timeouts += 1
+            else:
+                self.checkouts += 1
+            self.wait_seconds += wait
+            self.max_wait_seconds = max(self.max_wait_seconds, wait)
+
+    def as_dict(self):
+        with self._lock:
+            return {
+                "checkouts": self.checkouts,
+                "timeouts": self.timeouts,
+                "wait_seconds": self.wait_seconds,
+                "max_wait_seconds": self.max_wait_seconds,
+            }
+
+
+POOL_STATS = PoolStats()
+
+
+def _held_connections():
+    # A list holding the number of pooled connections checked out by the
+    # current thread. Connections keep a reference to it, so they are
+    # counted correctly even if another thread returns them.
+    held = getattr(_local, "held", None)
+    if held is None:
+        held = _local.held = [0]
+    return held
+
+
+class FairQueuePool(QueuePool):
+    """
+    A :class:`sqlalchemy.pool.QueuePool` whose checkouts are queued fairly
+    between users (see :func:`set_pool_user`).
+
+    Only the first connection of a thread is queued and counts towards
+    `pool_size` + `max_overflow`. A thread that already holds a connection
+    often needs another one for a nested call (e.g. reflection while changes
+    are applied). Such checkouts are served right away, possibly by a
+    temporary connection, as waiting for them could exhaust the pool by
+    threads that wait on each other.
+    """
+
+    def __init__(self, creator, pool_size=5, max_overflow=10, timeout=30, **kw):
+        super(FairQueuePool, self).__init__(
+            creator, pool_size=pool_size, max_overflow=-1, timeout=timeout, **kw
+        )
+        self._fair = FairQueue(pool_size + max_overflow)
+        self._fair_timeout = timeout
+
+    def recreate(self):
+        pool = super(FairQueuePool, self).recreate()
+        pool._fair = FairQueue(self._fair.capacity)
+        return pool
+
+    def _do_get(self):
+        held = _held_connections()
+        queued = held[0] == 0
+        start = time.monotonic()
+        if queued and not self._fair.acquire(_get_pool_user(), self._fair_timeout):
+            POOL_STATS.record(time.monotonic() - start, timed_out=True)
+            raise exc.TimeoutError(
+                "No database connection available within %d seconds"
+                % self._fair_timeout
+            )
+        try:
+            record = super(FairQueuePool, self)._do_get()
+        except:
+            if queued:
+                self._fair.release()
+            raise
+        if queued:
+            POOL_STATS.record(time.monotonic() - start)
+        record._fair_held = held
+        record._fair_queued = queued
+        held[0] += 1
+        return record
+
+    def _do_return_conn(self, conn):
+        held = conn.__dict__.pop("_fair_held", None)
+        queued = conn.__dict__.pop("_fair_queued", False)
+        if held is not None:
+            held[0] -= 1
+        try:
+            super(FairQueuePool, self)._do_return_conn(conn)
+        finally:
+            if queued:
+                self._fair.release()
+
+    def waiting(self):
+        return self._fair.waiting()
+
+
+class CountingCursor(psycopg2.extensions.cursor):
+    """A cursor that counts the statements of each request for api.metrics"""
+
+    def execute(self, query, vars=None):
+        metrics.count_statement()
+        return super(CountingCursor, self).execute(query, vars)
+
+    def executemany(self, query, vars_list):
+        metrics.count_statement()
+        return super(CountingCursor, self).executemany(query, vars_list)
+
+    def copy_expert(self, sql, file, size=8192):
+        metrics.count_statement()
+        return super(CountingCursor, self).copy_expert(sql, file, size)
+
+
+_CONNECT_ARGS = {"cursor_factory": CountingCursor}
+
 __ENGINE = sqla.create_engine(
-    get_connection_string(), pool_size=0, pool_recycle=600, max_overflow=200
+    get_connection_string(),
+    connect_args=_CONNECT_ARGS,
+    poolclass=FairQueuePool,
+    pool_size=DB_POOL_SIZE,
+    max_overflow=DB_POOL_MAX_OVERFLOW,
+    pool_timeout=DB_POOL_TIMEOUT,
+    pool_recycle=600,
+)
+
+# Sessions of the advanced API hold their connection until they are closed,
+# which would starve the pool above. Their number is limited per user by
+# USER_CONNECTION_LIMIT and ANON_CONNECTION_LIMIT instead.
+__SESSION_ENGINE = sqla.create_engine(
+    get_connection_string(), connect_args=_CONNECT_ARGS, poolclass=NullPool
 )
 
 
 def _get_engine():
     return __ENGINE
+
+
+def _get_session_engine():
+    return __SESSION_ENGINE
+
+
+def pool_status():
+    """
+    :return: A dictionary with the state of the connection pool and the
+        checkout counters
+    """
+    pool = __ENGINE.pool
+    status = {
+        "size": pool.size(),
+        "in_use": pool.checkedout(),
+        "idle": pool.checkedin(),
+        "overflow": max(pool.overflow(), 0),
+        "waiting": pool.waiting(),
+    }
+    status.update(POOL_STATS.as_dict())
+    return status
+
+
+def _pool_gauge(key):
+    return lambda: pool_status()[key]
+
+
+for _key, _documentation in (
+    ("size", "Persistent connections of the database pool"),
+    ("in_use", "Pooled database connections in use"),
+    ("overflow", "Temporary database connections beyond the pool size"),
+    ("waiting", "Threads waiting for a pooled database connection"),
+):
+    metrics.Gauge("oep_api_db_pool_" + _key, _documentation, _pool_gauge(_key))
+
+for _key, _documentation in (
+    ("checkouts", "Checkouts of pooled database connections"),
+    ("timeouts", "Checkouts of pooled database connections that timed out"),
+    ("wait_seconds", "Time spent waiting for pooled database connections"),
+):
+    metrics.Gauge(
+        "oep_api_db_pool_{0}_total".format(_key),
+        _documentation,
+        _pool_gauge(_key),
+        type="counter",
+    )
@@ -1,11 +1,18 @@
+import json
 from json.encoder import INFINITY, encode_basestring, encode_basestring_ascii
 from types import GeneratorType
 import itertools as it
-    
+
 from django.core.serializers.json import DjangoJSONEncoder
 
+# Approximate size of the chunks ChunkedJSONEncoder yields
+CHUNK_SIZE = 64 * 1024
+
 
 class GeneratorJSONEncoder(DjangoJSONEncoder):
+    # Optional callable that encodes a list in one go. See ChunkedJSONEncoder.
+    fast_encode = None
+
     def iterencode(self, o, _one_shot=False):
         if self.check_circular:
             markers = {}
@@ -50,11 +57,63 @@ class GeneratorJSONEncoder(DjangoJSONEncoder):
             self.sort_keys,
             self.skipkeys,
             _one_shot,
+            _fast_encode=self.fast_encode,
         )
 
         return _iterencode(o, 0)
 
 
+class ChunkedJSONEncoder(GeneratorJSONEncoder):
+    """
+    Streams JSON in chunks of about `chunk_size` characters instead of single
+    tokens. Lists are encoded in groups by the C encoder of the standard
+    library. Only items it cannot handle (e.g. generators) are encoded token
+    by token. The output is the same as that of :class:`DjangoJSONEncoder`
+    with the same arguments.
+    """
+
+    def __init__(self, *args, chunk_size=CHUNK_SIZE, **kwargs):
+        super(ChunkedJSONEncoder, self).__init__(*args, **kwargs)
+        self.chunk_size = chunk_size
+
+    def fast_encode(self, o):
+        return "".join(json.JSONEncoder.iterencode(self, o, _one_shot=True))
+
+    def iterencode(self, o, _one_shot=False):
+        return chunked(
+            super(ChunkedJSONEncoder, self).iterencode(o, _one_shot),
+            self.chunk_size,
+        )
+
+    def iterencode_lines(self, items):
+        """Encodes each of `items` as one line of newline-delimited JSON"""
+        return chunked((self._encode_line(item) for item in items), self.chunk_size)
+
+    def _encode_line(self, item):
+        try:
+            return self.fast_encode(item) + "\n"
+        except (TypeError, ValueError):
+            parts = super(ChunkedJSONEncoder, self).iterencode(item)
+            return "".join(parts) + "\n"
+
+
+def chunked(parts, size=CHUNK_SIZE):
+    """Joins the strings yielded by `parts` to chunks of at least `size`
+    characters (except for the last one).
+    """
+    buffer = []
+    length = 0
+    for part in parts:
+        buffer.append(part)
+        length += len(part)
+        if length >= size:
+            yield "".join(buffer)
+            buffer = []
+            length = 0
+    if buffer:
+        yield "".join(buffer)
+
+
 def _make_iterencode(
     markers,
     _default,
@@ -66,6 +125,8 @@ def _make_iterencode(
     _sort_keys,
     _skipkeys,
     _one_shot,
+    _fast_encode=None,
+    _group_size=1000,
     ## HACK: hand-optimized bytecode; turn globals into locals
     ValueError=ValueError,
     dict=dict,
@@ -82,6 +143,30 @@ def _make_iterencode(
     if _indent is not None and not isinstance(_indent, str):
         _indent = " " * _indent
 
+    def _iterencode_item(value, _current_indent_level):
+        if isinstance(value, str):
+            yield _encoder(value)
+        elif value is None:
+            yield "null"
+        elif value is True:
+            yield "true"
+        elif value is False:
+            yield "false"
+        elif isinstance(value, int):
+            # Subclasses of int/float may override __str__, but we still
+            # want to encode them as integers/floats in JSON. One example
+            # within the standard library is IntEnum.
+            yield _intstr(value)
+        elif isinstance(value, float):
+            # see comment above for int
+            yield _floatstr(value)
+        elif isinstance(value, (list, tuple, GeneratorType, map, it.chain)):
+            yield from _iterencode_list(value, _current_indent_level)
+        elif isinstance(value, dict):
+            yield from _iterencode_dict(value, _current_indent_level)
+        else:
+            yield from _iterencode(value, _current_indent_level)
+
     def _iterencode_list(lst, _current_indent_level):
         if not lst:
             yield "[]"
@@ -92,46 +177,38 @@ def _make_iterencode(
                 raise ValueError("Circular reference detected")
             markers[markerid] = lst
         yield "["
-        buf = ""
         if _indent is not None:
             _current_indent_level += 1
             newline_indent = "\n" + _indent * _current_indent_level
             separator = _item_separator + newline_indent
-            buf += newline_indent
+            buf = newline_indent
         else:
             newline_indent = None
             separator = _item_separator
-        first = True
-        for value in lst:
-            if first:
-                first = False
-            else:
+            buf = ""
+        if _fast_encode is not None and _indent is None:
+            # Encode groups of items at once. Only groups that the fast
+            # encoder cannot handle (e.g. because they contain generators)
+            # are encoded item by item.
+            items = iter(lst)
+            groups = iter(lambda: list(it.islice(items, _group_size)), [])
+        else:
+            groups = [lst]
+        for group in groups:
+            encoded = None
+            if _fast_encode is not None and _indent is None:
+                try:
+                    encoded = _fast_encode(group)
+                except (TypeError, ValueError):
+                    encoded = None
+            if encoded is not None:
+                yield buf + encoded[1:-1]
                 buf = separator
-            if isinstance(value, str):
-                yield buf + _encoder(value)
-            elif value is None:
-                yield buf + "null"
-            elif value is True:
-                yield buf + "true"
-            elif value is False:
-                yield buf + "false"
-            elif isinstance(value, int):
-                # Subclasses of int/float may override __str__, but we still
-                # want to encode them as integers/floats in JSON. One example
-                # within the standard library is IntEnum.
-                yield buf + _intstr(value)
-            elif isinstance(value, float):
-                # see comment above for int
-                yield buf + _floatstr(value)
             else:
-                yield buf
-                if isinstance(value, (list, tuple, GeneratorType, map, it.chain)):
-                    chunks = _iterencode_list(value, _current_indent_level)
-                elif isinstance(value, dict):
-                    chunks = _iterencode_dict(value, _current_indent_level)
-                else:
-                    chunks = _iterencode(value, _current_indent_level)
-                yield from chunks
+                for value in group:
+                    yield buf
+                    buf = separator
+                    yield from _iterencode_item(value, _current_indent_level)
         if newline_indent is not None:
             _current_indent_level -= 1
             yield "\n" + _indent * _current_indent_level
@@ -259,3 +336,25 @@ class Echo:
     def write(self, value):
         """Write the value by returning it, instead of storing in a buffer."""
         return value
+
+
+class IteratorReader:
+    """A read-only file-like object that serves the strings produced by an
+    iterator, e.g. to stream data into psycopg2's `copy_expert`.
+    """
+
+    def __init__(self, iterable):
+        self._iterator = iter(iterable)
+        self._buffer = ""
+
+    def read(self, size=-1):
+        while size < 0 or len(self._buffer) < size:
+            try:
+                self._buffer += next(self._iterator)
+            except StopIteration:
+                break
+        if size < 0:
+            chunk, self._buffer = self._buffer, ""
+        else:
+            chunk, self._buffer = self._buffer[:size], self._buffer[size:]
+        return chunk
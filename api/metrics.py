@@ -0,0 +1,432 @@
+"""
+This module collects metrics of the API and renders them in the Prometheus
+text format (see :func:`render`). Metrics are kept per worker process. If
+METRICS_DIRECTORY is set, every worker writes its metrics to a file in that
+directory (see :func:`write`) and :func:`render` adds up the metrics of all
+workers, so that it does not matter which worker answers a scrape. The counts
+of exited workers are kept in one file.
+"""
+
+import atexit
+import fcntl
+import json
+import os
+import threading
+import time
+
+import oeplatform.securitysettings as sec
+
+# Upper bounds of the latency buckets in seconds
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+
+STATEMENT_BUCKETS = (0, 1, 2, 5, 10, 20, 50, 100)
+
+DIRECTORY = getattr(sec, "METRICS_DIRECTORY", None)
+
+_REGISTRY = []
+
+
+def _escape(value):
+    return str(value).replace("\\", r"\\").replace("\n", r"\n").replace('"', r"\"")
+
+
+def _format_labels(pairs):
+    if not pairs:
+        return ""
+    return (
+        "{"
+        + ",".join('{0}="{1}"'.format(name, _escape(value)) for name, value in pairs)
+        + "}"
+    )
+
+
+def _format_value(value):
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class _Metric:
+    type = None
+
+    def __init__(self, name, documentation, labels=()):
+        self.name = name
+        self.documentation = documentation
+        self.labels = tuple(labels)
+        self._lock = threading.Lock()
+        self._values = {}
+        _REGISTRY.append(self)
+
+    def _key(self, labels):
+        return tuple(labels[name] for name in self.labels)
+
+    def values(self):
+        """
+        :return: A dictionary of the values of this process by their label
+            values
+        """
+        with self._lock:
+            return {key: _copy(value) for key, value in self._values.items()}
+
+    def samples(self, values=None):
+        """
+        :param values: Values as returned by :meth:`values`. Defaults to the
+            values of this process.
+        :return: A list of tuples of the sample name suffix, the label pairs
+            and the value
+        """
+        raise NotImplementedError
+
+    def render(self, values=None):
+        lines = [
+            "# HELP {0} {1}".format(self.name, self.documentation),
+            "# TYPE {0} {1}".format(self.name, self.type),
+        ]
+        for suffix, labels, value in self.samples(values):
+            lines.append(
+                "{0}{1}{2} {3}".format(
+                    self.name,
+                    suffix,
+                    _format_labels(labels),
+                    _format_value(value),
+                )
+            )
+        return "\n".join(lines)
+
+
+class Counter(_Metric):
+    type = "counter"
+
+    def __init__(self, name, documentation, labels=()):
+        super(Counter, self).__init__(name, documentation, labels)
+        if not self.labels:
+            self._values[()] = 0
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def samples(self, values=None):
+        if values is None:
+            values = self.values()
+        return [
+            ("", list(zip(self.labels, key)), value)
+            for key, value in sorted(values.items())
+        ]
+
+
+class Gauge(_Metric):
+    """
+    A metric whose value is read from `function` whenever it is rendered.
+    Values that are counted elsewhere may be exported with `type` "counter".
+    """
+
+    type = "gauge"
+
+    def __init__(self, name, documentation, function, type="gauge"):
+        super(Gauge, self).__init__(name, documentation)
+        self.function = function
+        self.type = type
+
+    def values(self):
+        return {(): self.function()}
+
+    def samples(self, values=None):
+        if values is None:
+            values = self.values()
+        return [("", [], values.get((), 0))]
+
+
+class Histogram(_Metric):
+    type = "histogram"
+
+    def __init__(self, name, documentation, buckets, labels=()):
+        super(Histogram, self).__init__(name, documentation, labels)
+        self.buckets = tuple(buckets) + (float("inf"),)
+
+    def observe(self, value, **labels):
+        key = self._key(labels)
+        with self._lock:
+            counts = self._values.get(key)
+            if counts is None:
+                # One count per bucket, followed by the sum of all values
+                counts = self._values[key] = [0] * len(self.buckets) + [0]
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    counts[i] += 1
+                    break
+            counts[-1] += value
+
+    def samples(self, values=None):
+        if values is None:
+            values = self.values()
+        samples = []
+        for key, counts in sorted(values.items()):
+            labels = list(zip(self.labels, key))
+            cumulative = 0
+            for bound, count in zip(self.buckets, counts):
+                cumulative += count
+                samples.append(
+                    ("_bucket", labels + [("le", _format_value(bound))], cumulative)
+                )
+            samples.append(("_sum", labels, counts[-1]))
+            samples.append(("_count", labels, cumulative))
+        return samples
+
+
+def _copy(value):
+    return list(value) if isinstance(value, list) else value
+
+
+def _add(a, b):
+    if isinstance(a, list):
+        return [x + y for x, y in zip(a, b)]
+    return a + b
+
+
+def _start_time(pid):
+    """
+    :return: The start time of process `pid` in clock ticks after boot, or
+        None if it cannot be read (e.g. without /proc)
+    """
+    try:
+        with open("/proc/{0}/stat".format(pid)) as f:
+            stat = f.read()
+    except OSError:
+        return None
+    # The command name in parentheses may contain spaces
+    return int(stat.rsplit(")", 1)[1].split()[19])
+
+
+def _alive(pid, start):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    # The pid of an exited worker may have been reused by another process
+    current = _start_time(pid)
+    return current is None or str(current) == start
+
+
+_identity = (None, None)
+
+
+def _name():
+    """
+    :return: The name of the file of this process. Processes are identified by
+        their pid and start time, since pids are reused.
+    """
+    global _identity
+    pid = os.getpid()
+    if _identity[0] != pid:
+        # Worker processes are forked after this module was imported
+        start = _start_time(pid)
+        if start is None:
+            start = int(time.time() * 1000)
+        _identity = (pid, "{0}-{1}.json".format(pid, start))
+    return _identity[1]
+
+
+# Metrics of exited workers. Their files are folded into this one.
+_EXITED = "exited.json"
+
+# Seconds between two writes of the metrics of a process
+WRITE_INTERVAL = 1
+
+_write_lock = threading.Lock()
+_last_write = float("-inf")
+_pending = None
+
+
+def _dump(path, data):
+    temporary = path + ".tmp"
+    with open(temporary, "w") as f:
+        json.dump(data, f)
+    # Readers see either the previous or the new file, never a partial one
+    os.replace(temporary, path)
+
+
+def _load(path):
+    try:
+        with open(path) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+def write(force=False):
+    """
+    Writes the metrics of this process to METRICS_DIRECTORY, if it is set. The
+    file is written at most every WRITE_INTERVAL seconds unless `force` is
+    set. Later changes are written by a timer at the end of the interval.
+    """
+    global _last_write, _pending
+    if DIRECTORY is None:
+        return
+    with _write_lock:
+        wait = _last_write + WRITE_INTERVAL - time.monotonic()
+        if wait > 0 and not force:
+            # Timers do not survive a fork
+            if _pending is None or not _pending.is_alive():
+                _pending = threading.Timer(wait, _flush)
+                _pending.daemon = True
+                _pending.start()
+            return
+        _last_write = time.monotonic()
+        data = {
+            metric.name: [
+                [list(key), value] for key, value in metric.values().items()
+            ]
+            for metric in _REGISTRY
+        }
+        _dump(os.path.join(DIRECTORY, _name()), data)
+
+
+def _flush():
+    global _pending
+    with _write_lock:
+        _pending = None
+    write()
+
+
+atexit.register(write, force=True)
+
+
+def _parse(name):
+    """
+    :return: The pid and start time of the worker that wrote the file `name`,
+        or None if it is no file of a worker
+    """
+    base, extension = os.path.splitext(name)
+    pid, _, start = base.partition("-")
+    if extension != ".json" or not pid.isdigit() or not start.isdigit():
+        return None
+    return int(pid), start
+
+
+def _merge(collected, data, gauges=True):
+    for metric in _REGISTRY:
+        if metric.type == "gauge" and not gauges:
+            continue
+        values = collected.setdefault(metric.name, {})
+        for key, value in data.get(metric.name, []):
+            key = tuple(key)
+            if key in values:
+                values[key] = _add(values[key], value)
+            else:
+                values[key] = value
+
+
+def _fold(names):
+    """
+    Adds the counts of exited workers in the files `names` to the counts of
+    all exited workers and removes their files. Current values (e.g. open
+    sessions) of exited workers are dropped.
+    """
+    with open(os.path.join(DIRECTORY, "exited.lock"), "w") as lock:
+        # Scrapes answered by other workers must not fold a file twice
+        fcntl.flock(lock, fcntl.LOCK_EX)
+        path = os.path.join(DIRECTORY, _EXITED)
+        exited = {}
+        _merge(exited, _load(path) or {}, gauges=False)
+        folded = []
+        for name in names:
+            data = _load(os.path.join(DIRECTORY, name))
+            if data is not None:
+                _merge(exited, data, gauges=False)
+                folded.append(name)
+        _dump(
+            path,
+            {
+                metric: [[list(key), value] for key, value in values.items()]
+                for metric, values in exited.items()
+            },
+        )
+        for name in folded:
+            os.remove(os.path.join(DIRECTORY, name))
+
+
+def _collect():
+    """
+    :return: A dictionary of the values of all workers that wrote their metrics
+        to METRICS_DIRECTORY by metric name
+    """
+    write(force=True)
+    exited = []
+    for name in os.listdir(DIRECTORY):
+        worker = _parse(name)
+        if worker is not None and not _alive(*worker):
+            exited.append(name)
+    if exited:
+        _fold(exited)
+
+    collected = {}
+    for name in os.listdir(DIRECTORY):
+        if name != _EXITED and _parse(name) is None:
+            continue
+        data = _load(os.path.join(DIRECTORY, name))
+        if data is not None:
+            _merge(collected, data)
+    return collected
+
+
+def render():
+    """
+    :return: All metrics in the Prometheus text format
+    """
+    if DIRECTORY is None:
+        return "\n".join(metric.render() for metric in _REGISTRY) + "\n"
+    collected = _collect()
+    return (
+        "\n".join(
+            metric.render(collected.get(metric.name, {})) for metric in _REGISTRY
+        )
+        + "\n"
+    )
+
+
+_local = threading.local()
+
+
+def start_request():
+    """Starts counting the SQL statements executed by the current thread"""
+    _local.statements = 0
+
+
+def finish_request():
+    """
+    :return: The number of SQL statements executed by the current thread
+        since :func:`start_request`
+    """
+    return _local.__dict__.pop("statements", 0)
+
+
+def count_statement():
+    if hasattr(_local, "statements"):
+        _local.statements += 1
+
+
+REQUEST_LATENCY = Histogram(
+    "oep_api_request_duration_seconds",
+    "Time until the response of an API request was sent",
+    LATENCY_BUCKETS,
+    labels=("route", "method", "status"),
+)
+
+REQUEST_STATEMENTS = Histogram(
+    "oep_api_request_sql_statements",
+    "SQL statements executed per API request",
+    STATEMENT_BUCKETS,
+    labels=("route",),
+)
+
+ROWS_STREAMED = Counter(
+    "oep_api_rows_streamed_total", "Rows fetched from cursors for streamed responses"
+)
+
+BYTES_STREAMED = Counter(
+    "oep_api_stream_bytes_total", "Bytes sent in streamed responses"
+)
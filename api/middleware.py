@@ -0,0 +1,48 @@
+import time
+
+from api import metrics
+
+
+class MetricsMiddleware:
+    """
+    Records the latency and the number of SQL statements of every API request
+    by the URL pattern it was routed to (see :mod:`api.metrics`). Both include
+    the body of streamed responses.
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        if not request.path.startswith("/api/"):
+            return self.get_response(request)
+        metrics.start_request()
+        start = time.monotonic()
+        try:
+            response = self.get_response(request)
+        except:
+            metrics.finish_request()
+            raise
+        match = request.resolver_match
+        # Patterns in api.urls are regular expressions, which also serve as
+        # names of the routes. Unmatched paths are grouped together.
+        route = match.route if match is not None else "unmatched"
+
+        def observe():
+            statements = metrics.finish_request()
+            metrics.REQUEST_LATENCY.observe(
+                time.monotonic() - start,
+                route=route,
+                method=request.method,
+                status=response.status_code,
+            )
+            metrics.REQUEST_STATEMENTS.observe(statements, route=route)
+            metrics.write()
+
+        if response.streaming:
+            # Streamed bodies are produced after this returns, by the same
+            # thread. The server closes the response once it was sent.
+            response._resource_closers.append(observe)
+        else:
+            observe()
+        return response
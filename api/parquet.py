@@ -0,0 +1,111 @@
+"""
+This module writes query results as Parquet files using pyarrow.
+"""
+
+import json
+
+import pyarrow
+import pyarrow.parquet
+
+import oeplatform.securitysettings as sec
+
+# Number of rows per row group. Each row group is converted in memory.
+ROW_GROUP_SIZE = getattr(sec, "PARQUET_ROW_GROUP_SIZE", 65536)
+
+CONTENT_TYPE = "application/vnd.apache.parquet"
+
+_BINARY_TYPES = ("bytea", "geometry", "geography")
+
+_SIMPLE_TYPES = {
+    "smallint": "int16",
+    "integer": "int32",
+    "bigint": "int64",
+    "real": "float32",
+    "double precision": "float64",
+    "boolean": "bool_",
+    "text": "string",
+    "character varying": "string",
+    "character": "string",
+    "date": "date32",
+}
+
+
+def _to_bytes(value):
+    return bytes(value)
+
+
+def _to_json(value):
+    return json.dumps(value)
+
+
+def arrow_type(column):
+    """
+    Maps a column as described by :func:`api.actions.describe_columns` to a
+    pyarrow type.
+
+    :param column: Description of the column
+    :return: A tuple of the pyarrow type and a function that converts values
+        fetched by psycopg2 to values pyarrow accepts for that type (`None` if
+        no conversion is needed)
+    """
+    data_type = column["data_type"]
+    if data_type.endswith("[]"):
+        item_type, convert_item = arrow_type(dict(column, data_type=data_type[:-2]))
+        if convert_item is None:
+            return pyarrow.list_(item_type), None
+
+        def convert_list(values):
+            return [None if v is None else convert_item(v) for v in values]
+
+        return pyarrow.list_(item_type), convert_list
+    if data_type in _SIMPLE_TYPES:
+        return getattr(pyarrow, _SIMPLE_TYPES[data_type])(), None
+    if data_type in _BINARY_TYPES:
+        # Geometries are selected as WKB (see api.views.Rows)
+        return pyarrow.binary(), _to_bytes
+    if data_type == "numeric":
+        precision = column.get("numeric_precision")
+        if precision and precision <= 38:
+            return pyarrow.decimal128(precision, column.get("numeric_scale") or 0), None
+        return pyarrow.string(), str
+    if data_type.startswith("timestamp"):
+        tz = "UTC" if data_type.endswith("with time zone") else None
+        return pyarrow.timestamp("us", tz=tz), None
+    if data_type == "time without time zone":
+        return pyarrow.time64("us"), None
+    if data_type == "interval":
+        return pyarrow.duration("us"), None
+    if data_type in ("json", "jsonb"):
+        return pyarrow.string(), _to_json
+    return pyarrow.string(), str
+
+
+def write_parquet(file, names, columns, batches):
+    """
+    Writes rows to `file` as a Parquet file with one row group per batch.
+
+    :param file: A binary file-like object
+    :param names: Names of the columns
+    :param columns: Descriptions of the columns as returned by
+        :func:`api.actions.describe_columns`
+    :param batches: Iterable of lists of rows
+    """
+    types = [arrow_type(c) for c in columns]
+    schema = pyarrow.schema(
+        [
+            pyarrow.field(name, arrow, nullable=column["is_nullable"])
+            for name, column, (arrow, _) in zip(names, columns, types)
+        ]
+    )
+    writer = pyarrow.parquet.ParquetWriter(file, schema)
+    try:
+        for rows in batches:
+            arrays = []
+            for i, (arrow, convert) in enumerate(types):
+                values = [row[i] for row in rows]
+                if convert is not None:
+                    values = [None if v is None else convert(v) for v in values]
+                arrays.append(pyarrow.array(values, type=arrow))
+            writer.write_table(pyarrow.Table.from_arrays(arrays, schema=schema))
+    finally:
+        writer.close()
@@ -3,13 +3,14 @@
 ###########
 import decimal
 import re
+import uuid
+from collections import namedtuple
 from datetime import datetime, date
 
 import geoalchemy2  # Although this import seems unused is has to be here
 import sqlalchemy as sa
 from sqlalchemy import (
     Column,
-    MetaData,
     Table,
     and_,
     not_,
@@ -30,7 +31,9 @@ from sqlalchemy.sql.annotation import Annotated
 from sqlalchemy.sql.elements import Slice
 from sqlalchemy.sql.expression import ColumnClause, CompoundSelect
 from sqlalchemy.sql.sqltypes import Interval, _AbstractInterval
+from sqlalchemy.sql.visitors import iterate
 
+from api.cache import CATALOG, COMPILED_QUERIES, load_table, search_path_schema
 from api.connection import _get_engine
 from api.error import APIError, APIKeyError
 from api.connection import _get_engine
@@ -104,11 +107,8 @@ def set_meta_info(method, user, message=None):
 
 
 def parse_insert(d, context, message=None, mapper=None):
-    table = Table(
-        read_pgid(get_or_403(d, "table")),
-        MetaData(bind=_get_engine()),
-        autoload=True,
-        schema=read_pgid(get_or_403(d, "schema")),
+    table = load_table(
+        read_pgid(get_or_403(d, "schema")), read_pgid(get_or_403(d, "table"))
     )
     field_strings = []
     for field in d.get("fields", []):
@@ -265,6 +265,186 @@ def parse_select(d):
     return query
 
 
+CompiledQuery = namedtuple("CompiledQuery", ["statement", "params"])
+
+# A compiled query with named parameters for the literals of a request. slots
+# maps parameter names to the positions of the literals in the fingerprint,
+# params holds all other parameters. Shapes that can not be turned into a
+# template have no statement.
+_QueryTemplate = namedtuple(
+    "_QueryTemplate", ["statement", "params", "slots", "tables"]
+)
+
+_SLOT_TYPES = (str, int, float)
+
+# Comparisons whose literal operands become slots if the other operand is a
+# column. Literals elsewhere may be interpreted while the query is parsed
+# (e.g. keys of getitem or values that are added up), so they remain part
+# of the fingerprint.
+_SLOT_OPERATORS = {
+    "equals",
+    "=",
+    "greater",
+    ">",
+    "lower",
+    "<",
+    "notequal",
+    "<>",
+    "!=",
+    "notgreater",
+    "<=",
+    "notlower",
+    ">=",
+    "like",
+    "in",
+}
+
+
+def _is_literal(d):
+    return (
+        isinstance(d, dict)
+        and d.get("type") == "value"
+        and "datatype" not in d
+        and type(d.get("value")) in _SLOT_TYPES
+    )
+
+
+def _slot_operands(d):
+    """
+    Returns the literals that are compared with a column by the operator
+    `d`. Lists of literals are accepted for `in`.
+    """
+    if d.get("type") != "operator":
+        return []
+    operator = d.get("operator")
+    if not isinstance(operator, str):
+        return []
+    operator = operator.lower().strip()
+    operands = d.get("operands")
+    if operator not in _SLOT_OPERATORS or not isinstance(operands, list):
+        return []
+    if len(operands) != 2:
+        return []
+    x, y = operands
+    if isinstance(x, dict) and x.get("type") == "column":
+        values = y
+    elif isinstance(y, dict) and y.get("type") == "column" and operator != "in":
+        values = x
+    else:
+        return []
+    if operator == "in":
+        if not isinstance(values, list):
+            return []
+        return [v for v in values if _is_literal(v)]
+    return [values] if _is_literal(values) else []
+
+
+def _fingerprint(d, slots, slotted=frozenset()):
+    """
+    Returns a hashable representation of the query `d` in which literals
+    compared with columns are replaced by their type. Nodes holding these
+    literals are added to `slots` in the order of the fingerprint.
+    """
+    if isinstance(d, dict):
+        if id(d) in slotted:
+            slots.append(d)
+            return ("$", type(d["value"]).__name__) + tuple(
+                sorted(
+                    (k, _fingerprint(v, slots)) for k, v in d.items() if k != "value"
+                )
+            )
+        slotted = frozenset(id(v) for v in _slot_operands(d))
+        return ("{",) + tuple(
+            (k, _fingerprint(d[k], slots, slotted)) for k in sorted(d, key=str)
+        )
+    if isinstance(d, list):
+        return ("[",) + tuple(_fingerprint(x, slots, slotted) for x in d)
+    return (type(d).__name__, d)
+
+
+def _compile_query(query):
+    try:
+        return query.compile(dialect=_get_engine().dialect)
+    except sa.exc.SQLAlchemyError as e:
+        raise APIError(repr(e))
+
+
+def _placeholder(value_type, index, token):
+    # A value of the same type as the literal that can not appear in the
+    # query by chance
+    if value_type is str:
+        return "{token}:{index}".format(token=token.hex, index=index)
+    if value_type is int:
+        return ((token.int >> 66) << 16) + index
+    return float(((token.int >> 76) << 8) + index) + 0.5
+
+
+def _compile_template(d, slots):
+    # The query is parsed with placeholders in place of the literals in
+    # slots, so it is compiled exactly like the query itself. Afterwards,
+    # the parameters holding the placeholders are looked up.
+    token = uuid.uuid4()
+    values = [node["value"] for node in slots]
+    placeholders = {}
+    for i, node in enumerate(slots):
+        node["value"] = _placeholder(type(node["value"]), i, token)
+        placeholders[(type(node["value"]), node["value"])] = i
+    try:
+        query = parse_select(d)
+    finally:
+        for node, value in zip(slots, values):
+            node["value"] = value
+    compiled = _compile_query(query)
+    statement = str(compiled)
+    params = {}
+    names = {}
+    for name, value in compiled.params.items():
+        index = placeholders.get((type(value), value))
+        if index is None:
+            params[name] = value
+        else:
+            names[name] = index
+    tables = frozenset(
+        (t.schema or search_path_schema(), t.name)
+        for t in iterate(query, {})
+        if isinstance(t, Table)
+    )
+    # Every placeholder must have ended up in a parameter of its own.
+    # Otherwise, its literal was interpreted while the query was built.
+    if sorted(names.values()) != list(range(len(slots))) or token.hex in statement:
+        return _QueryTemplate(None, None, None, tables)
+    return _QueryTemplate(statement, params, names, tables)
+
+
+def compile_select(d):
+    """
+    Parses and compiles the select query `d` (see :func:`parse_select`).
+    Queries that only differ in the literals they compare columns with share
+    one compiled statement, which is cached until one of its tables changes.
+
+    :return: A :class:`CompiledQuery` of the SQL statement and its parameters
+    """
+    slots = []
+    key = _fingerprint(d, slots)
+    template = COMPILED_QUERIES.get(key)
+    if template is None:
+        try:
+            template = _compile_template(d, slots)
+        except APIError:
+            # Errors are reported by the query itself below and are not
+            # cached, e.g. the table may be created later.
+            template = None
+        else:
+            COMPILED_QUERIES.put(key, template)
+    if template is None or template.statement is None:
+        compiled = _compile_query(parse_select(d))
+        return CompiledQuery(str(compiled), dict(compiled.params))
+    params = dict(template.params)
+    for name, index in template.slots.items():
+        params[name] = slots[index]["value"]
+    return CompiledQuery(template.statement, params)
+
+
 def parse_from_item(d):
     """
         Defintion of a from_item according to 
@@ -285,26 +465,13 @@ def parse_from_item(d):
     dtype = get_or_403(d, "type")
     if dtype == "table":
         schema_name = read_pgid(d["schema"]) if "schema" in d else None
-        only = d.get("only", False)
-        ext_name = table_name = read_pgid(get_or_403(d, "table"))
-        tkwargs = dict(autoload=True)
-        if schema_name:
-            ext_name = schema_name + "." + ext_name
-            tkwargs["schema"] = d["schema"]
-        if ext_name in __PARSER_META.tables:
-            item = __PARSER_META.tables[ext_name]
-        else:
-            try:
-                item = Table(d["table"], __PARSER_META, **tkwargs)
-            except sa.exc.NoSuchTableError as e:
-                raise APIError("Table {table} not found".format(table=ext_name))
-
-        engine = _get_engine()
-        conn = engine.connect()
-        exists = engine.dialect.has_table(conn, item.name, item.schema)
-        conn.close()
-        if not exists:
-            raise APIError("Table not found: " + str(item), status=400)
+        table_name = read_pgid(get_or_403(d, "table"))
+        item = load_table_from_metadata(table_name, schema_name=schema_name)
+        if item is None:
+            ext_name = table_name
+            if schema_name:
+                ext_name = schema_name + "." + ext_name
+            raise APIError("Table {table} not found".format(table=ext_name))
     elif dtype == "select":
         item = parse_select(d)
     elif dtype == "join":
@@ -324,20 +491,20 @@ def parse_from_item(d):
     return item
 
 
-__PARSER_META = MetaData(bind=_get_engine())
-
-
 def load_table_from_metadata(table_name, schema_name=None):
-    ext_name = table_name
-    if schema_name:
-        ext_name = schema_name + "." + ext_name
-    if ext_name and ext_name in __PARSER_META.tables:
-        return __PARSER_META.tables[ext_name]
-    else:
-        if _get_engine().dialect.has_table(
-            _get_engine().connect(), table_name, schema=schema_name
-        ):
-            return Table(table_name, __PARSER_META, autoload=True, schema=schema_name)
+    """
+    Returns the reflected table `schema_name`.`table_name` or None if it does
+    not exist. Reflections are shared with api.actions and dropped once the
+    table changes (see :func:`api.cache.load_table`). Tables without a schema
+    are looked up in the schema of the search_path, like PostgreSQL would.
+    """
+    schema_name = schema_name or search_path_schema()
+    if not CATALOG.has_table(schema_name, table_name):
+        return None
+    try:
+        return load_table(schema_name, table_name)
+    except sa.exc.NoSuchTableError:
+        return None
 
 
 def parse_column(d, mapper):
@@ -2,67 +2,341 @@
 This module handles all relevant features that belong to specific sessions.
 """
 
+import heapq
+import logging
+import os
+import socket
 import sys
+import threading
 import time
+from contextlib import contextmanager
 from random import randrange
 
+from sqlalchemy import text
+
 from oeplatform.securitysettings import (
     ANON_CONNECTION_LIMIT,
     TIME_OUT,
     USER_CONNECTION_LIMIT,
 )
 
+from . import metrics
 from .actions import _get_engine, get_or_403
+from .connection import _get_session_engine
 from .error import APIError
 
-_SESSION_CONTEXTS = {}
+logger = logging.getLogger("oeplatform")
+
+# Session ids consist of the key of the worker process that holds the session
+# followed by _RANDOM_BITS random bits. Sessions live in the memory of one
+# worker, so any other worker can tell from the id alone that a request was
+# misrouted.
+_RANDOM_BITS = 43
+_WORKER_KEYS = 1 << 20
+
+# Keys are reused only from workers that are gone, i.e. whose heartbeat is
+# older than `timeout`. Otherwise, nothing is returned.
+_REGISTER_WORKER = text(
+    "INSERT INTO public.api_workers (key, host, pid) "
+    "VALUES (nextval('public.api_workers_key_seq') % :keys, :host, :pid) "
+    "ON CONFLICT (key) DO UPDATE SET host = EXCLUDED.host, pid = EXCLUDED.pid, "
+    "started = now(), heartbeat = now() "
+    "WHERE api_workers.heartbeat <= now() - make_interval(secs => :timeout) "
+    "RETURNING key"
+)
+
+# Returns nothing if the key was taken over by another worker
+_TOUCH_WORKER = text(
+    "UPDATE public.api_workers SET heartbeat = now() "
+    "WHERE key = :key AND host = :host AND pid = :pid "
+    "RETURNING key"
+)
+
+_FIND_WORKER = text(
+    "SELECT host, pid, heartbeat > now() - make_interval(secs => :timeout) AS alive "
+    "FROM public.api_workers WHERE key = :key"
+)
+
+
+class _Worker:
+    """
+    This process as registered in the table public.api_workers, which all
+    workers share. Workers that hold sessions renew their heartbeat regularly.
+    Workers whose heartbeat is older than two session timeouts are considered
+    gone and their keys may be reused.
+    """
+
+    def __init__(self, timeout):
+        self.timeout = timeout
+        self._lock = threading.Lock()
+        self._key = None
+        self._pid = None
+        self._heartbeat = 0
+
+    def _touch(self, key):
+        return (
+            _get_engine()
+            .execute(_TOUCH_WORKER, key=key, host=socket.gethostname(), pid=os.getpid())
+            .scalar()
+            is not None
+        )
+
+    def _register(self):
+        engine = _get_engine()
+        for _ in range(_WORKER_KEYS):
+            key = engine.execute(
+                _REGISTER_WORKER,
+                keys=_WORKER_KEYS,
+                host=socket.gethostname(),
+                pid=os.getpid(),
+                timeout=2 * self.timeout,
+            ).scalar()
+            if key is not None:
+                return key
+        raise APIError("All worker keys are in use", status=503)
+
+    @property
+    def key(self):
+        """
+        The key of this process. It is registered on first use and registered
+        again if it was taken over while this process held no sessions.
+        """
+        with self._lock:
+            now = time.monotonic()
+            # Forked workers inherit the key of their parent
+            if self._pid == os.getpid():
+                if now - self._heartbeat < self.timeout or self._touch(self._key):
+                    self._heartbeat = now
+                    return self._key
+            self._key = self._register()
+            self._pid = os.getpid()
+            self._heartbeat = now
+            return self._key
+
+    def owns(self, session_id):
+        with self._lock:
+            return (
+                self._pid == os.getpid()
+                and session_id >> _RANDOM_BITS == self._key
+            )
+
+    def beat(self, interval):
+        """Renews the heartbeat if it is older than `interval` seconds"""
+        with self._lock:
+            if self._pid != os.getpid() or (
+                time.monotonic() - self._heartbeat < interval
+            ):
+                return
+            self._heartbeat = time.monotonic()
+            key = self._key
+        try:
+            if not self._touch(key):
+                logger.error("The key of this worker was taken over by another one")
+        except Exception:
+            logger.exception("Could not renew the heartbeat of this worker")
+
+
+_WORKER = _Worker(TIME_OUT)
+
+
+class _SessionRegistry:
+    """
+    The sessions of this process, indexed by id and by owner. All sessions are
+    also kept in a heap ordered by their last activity, from which idle
+    sessions are closed by a background thread. Sessions that are held by a
+    request (see :meth:`acquire`) are not idle.
+    """
+
+    def __init__(self, timeout):
+        self.timeout = timeout
+        self._sessions = {}
+        self._by_owner = {}
+        self._idle = []
+        self._lock = threading.Lock()
+        self._wakeup = threading.Condition(self._lock)
+        self._reaper_pid = None
+
+    def get(self, session_id):
+        with self._lock:
+            return self._sessions.get(session_id)
+
+    def acquire(self, session_id):
+        """
+        :return: The session `session_id`, which is marked as in use until
+            :meth:`release` is called, or None if it does not exist
+        """
+        with self._lock:
+            session = self._sessions.get(session_id)
+            if session is not None:
+                session.in_use += 1
+                session.last_activity = time.time()
+            return session
+
+    def release(self, session):
+        with self._lock:
+            session.in_use -= 1
+            session.last_activity = time.time()
+
+    def count(self, owner):
+        with self._lock:
+            return len(self._by_owner.get(owner, ()))
+
+    def cursor_count(self):
+        with self._lock:
+            return sum(len(s.cursors) for s in self._sessions.values())
+
+    def __len__(self):
+        with self._lock:
+            return len(self._sessions)
+
+    def owned_by(self, owner):
+        with self._lock:
+            return [self._sessions[sid] for sid in self._by_owner.get(owner, ())]
+
+    def add(self, session, limit, worker_key):
+        """
+        Registers `session` under a new id for the worker `worker_key`,
+        unless its owner already holds `limit` sessions.
+
+        :return: The id of the session or None if the limit is exceeded
+        """
+        expired = []
+        try:
+            with self._lock:
+                # Idle sessions must not count against the limit
+                expired = self._pop_expired(time.time())
+                if len(self._by_owner.get(session.owner, ())) >= limit:
+                    return None
+                session_id = _get_new_key(
+                    self._sessions, worker_key << _RANDOM_BITS, 1 << _RANDOM_BITS
+                )
+                self._sessions[session_id] = session
+                self._by_owner.setdefault(session.owner, set()).add(session_id)
+                heapq.heappush(self._idle, (session.last_activity, session_id))
+                self._start_reaper()
+                self._wakeup.notify()
+                return session_id
+        finally:
+            _close_expired(expired)
+
+    def remove(self, session_id):
+        with self._lock:
+            self._remove(session_id)
+
+    def _remove(self, session_id):
+        session = self._sessions.pop(session_id, None)
+        if session is not None:
+            owned = self._by_owner[session.owner]
+            owned.discard(session_id)
+            if not owned:
+                del self._by_owner[session.owner]
+
+    def _pop_expired(self, now):
+        # Must be called with the lock held. Each session has exactly one entry
+        # in the heap; entries of sessions that were active since they were
+        # pushed are pushed again with their current activity.
+        expired = []
+        while self._idle and self._idle[0][0] + self.timeout < now:
+            _, session_id = heapq.heappop(self._idle)
+            session = self._sessions.get(session_id)
+            if session is None:
+                continue
+            if session.cursors or session.in_use:
+                # Sessions with open cursors or in use are kept alive
+                heapq.heappush(self._idle, (now, session_id))
+            elif session.last_activity + self.timeout >= now:
+                heapq.heappush(self._idle, (session.last_activity, session_id))
+            else:
+                self._remove(session_id)
+                expired.append(session)
+        return expired
+
+    def _start_reaper(self):
+        # Must be called with the lock held. Threads do not survive a fork, so
+        # every worker process starts its own.
+        if self._reaper_pid != os.getpid():
+            self._reaper_pid = os.getpid()
+            threading.Thread(
+                target=self._reap, name="api-session-reaper", daemon=True
+            ).start()
+
+    def _reap(self):
+        while True:
+            with self._lock:
+                expired = self._pop_expired(time.time())
+                if not expired:
+                    if self._idle:
+                        timeout = self._idle[0][0] + self.timeout - time.time()
+                        self._wakeup.wait(max(timeout, 0) + 1)
+                    else:
+                        self._wakeup.wait()
+            _close_expired(expired)
+            if self._sessions:
+                # Other workers treat this one as gone after two timeouts
+                _WORKER.beat(self.timeout / 2)
+
+
+def _close_expired(sessions):
+    for session in sessions:
+        try:
+            session.connection.close()
+        except Exception:
+            logger.exception("Could not close idle session")
+
+
+_SESSIONS = _SessionRegistry(TIME_OUT)
+
+metrics.Gauge(
+    "oep_api_sessions", "Open sessions of the advanced API", _SESSIONS.__len__
+)
+metrics.Gauge(
+    "oep_api_cursors", "Open cursors of the advanced API", _SESSIONS.cursor_count
+)
 
 
 class SessionContext:
-    def __init__(self, connection_id=None, owner=None):
-        user_connections = 0
-        current_time = time.time()
-
-        self.last_activity = current_time
-        for sid in dict(_SESSION_CONTEXTS):
-            try:
-                sess = _SESSION_CONTEXTS[sid]
-                if current_time - sess.last_activity > TIME_OUT and not sess.cursors:
-                    sess.close()
-                else:
-                    if sess.owner == owner:
-                        user_connections += 1
-            except KeyError:
-                pass
+    def __init__(self, owner=None):
+        self.last_activity = time.time()
+        self.owner = owner
+        self.session_context = self
+        self.cursors = {}
+        # Ids of named cursors that run a search with a statement timeout
+        self.limited_cursors = set()
+        # Number of requests that hold this session (see hold_sessions)
+        self.in_use = 0
 
         if owner.is_anonymous:
-            if user_connections >= ANON_CONNECTION_LIMIT:
-                raise APIError(
-                    "Connection limit for anonymous users is exceeded"
-                    ". Please login to get your own connection pool."
-                )
+            limit = ANON_CONNECTION_LIMIT
+            message = (
+                "Connection limit for anonymous users is exceeded"
+                ". Please login to get your own connection pool."
+            )
         else:
-            if user_connections >= USER_CONNECTION_LIMIT:
-                raise APIError(
-                    "This user exceeded the connection limit."
-                    "If you are using the oedialect, this may be "
-                    "caused by a known bug that has been fixed in"
-                    "v0.0.5.dev0. You can close al your connections"
-                    "manually at https://openenergy-platform.org/api/v0/advanced/connection/close_all"
-                )
+            limit = USER_CONNECTION_LIMIT
+            message = (
+                "This user exceeded the connection limit."
+                "If you are using the oedialect, this may be "
+                "caused by a known bug that has been fixed in"
+                "v0.0.5.dev0. You can close al your connections"
+                "manually at https://openenergy-platform.org/api/v0/advanced/connection/close_all"
+            )
+        # Fail early without opening a connection. The limit is checked again
+        # when the session is registered.
+        if _SESSIONS.count(owner) >= limit:
+            raise APIError(message)
 
-        engine = _get_engine()
+        worker_key = _WORKER.key
+        engine = _get_session_engine()
         self.connection = engine.connect().connection
+        try:
+            connection_id = _SESSIONS.add(self, limit, worker_key)
+        except:
+            self.connection.close()
+            raise
         if connection_id is None:
-            connection_id = _add_entry(self, _SESSION_CONTEXTS)
-        elif connection_id not in _SESSION_CONTEXTS:
-            _SESSION_CONTEXTS[connection_id] = self
-        else:
-            raise Exception("Tried to open existing")
-        self.owner = owner
+            self.connection.close()
+            raise APIError(message)
         self.connection._id = connection_id
-        self.session_context = self
-        self.cursors = {}
 
     def get_cursor(self, cursor_id):
         try:
@@ -86,8 +360,7 @@ class SessionContext:
 
     def close(self):
         self.connection.close()
-        if self.connection._id in _SESSION_CONTEXTS:
-            del _SESSION_CONTEXTS[self.connection._id]
+        _SESSIONS.remove(self.connection._id)
 
     def rollback(self):
         self.connection.rollback()
@@ -98,16 +371,11 @@ class SessionContext:
 def close_all_for_user(owner):
     if owner.is_anonymous:
         raise PermissionError
-    for sid in dict(_SESSION_CONTEXTS):
-        try:
-            sess = _SESSION_CONTEXTS[sid]
-            if sess.owner == owner:
-                for cursor_id in dict(sess.cursors):
-                    if cursor_id in sess.cursors:
-                        sess.cursors[cursor_id].close()
-                sess.close()
-        except KeyError:
-            pass
+    for sess in _SESSIONS.owned_by(owner):
+        for cursor_id in dict(sess.cursors):
+            if cursor_id in sess.cursors:
+                sess.cursors[cursor_id].close()
+        sess.close()
 
 
 def load_cursor_from_context(context):
@@ -116,27 +384,75 @@ def load_cursor_from_context(context):
     return session.get_cursor(cursor_id)
 
 
+_local = threading.local()
+
+
+@contextmanager
+def hold_sessions():
+    """
+    Sessions loaded from a context (see :func:`load_session_from_context`)
+    within this block are not closed as idle before the outermost block ends.
+    """
+    if hasattr(_local, "held"):
+        yield
+        return
+    _local.held = []
+    try:
+        yield
+    finally:
+        for session in _local.__dict__.pop("held"):
+            _SESSIONS.release(session)
+
+
 def load_session_from_context(context):
     connection_id = get_or_403(context, "connection_id")
-    user = context.get("user")
     try:
-        sess = _SESSION_CONTEXTS[connection_id]
-        sess.last_activity = time.time()
-        if user and sess.owner != user:
-            raise PermissionError
-        return sess
-    except KeyError:
-        return SessionContext(connection_id=connection_id, owner=user)
+        connection_id = int(connection_id)
+    except (TypeError, ValueError):
+        raise APIError("Invalid connection id %s" % connection_id)
+    user = context.get("user")
+    held = getattr(_local, "held", None)
+    if held is None:
+        sess = _SESSIONS.get(connection_id)
+        if sess is not None:
+            sess.last_activity = time.time()
+    else:
+        sess = _SESSIONS.acquire(connection_id)
+        if sess is not None:
+            held.append(sess)
+    if sess is None:
+        raise _missing_session(connection_id)
+    if user and sess.owner != user:
+        raise PermissionError
+    return sess
 
 
-def _get_new_key(dictionary):
-    key = randrange(0, sys.maxsize)
-    while key in dictionary:
-        key = randrange(0, sys.maxsize)
-    return key
+def _missing_session(connection_id):
+    """
+    Returns the error for a connection that does not exist in this process.
+    If it is held by another worker that is still alive, the request was
+    misrouted and may be retried there.
+    """
+    worker_key = connection_id >> _RANDOM_BITS
+    if not _WORKER.owns(connection_id) and 0 <= worker_key < _WORKER_KEYS:
+        worker = (
+            _get_engine()
+            .execute(_FIND_WORKER, key=worker_key, timeout=2 * TIME_OUT)
+            .first()
+        )
+        if worker is not None and worker.alive:
+            return APIError(
+                "Connection %s is held by another worker (%s, pid %s)"
+                % (connection_id, worker.host, worker.pid),
+                status=421,
+            )
+    return APIError(
+        "Connection %s does not exist or was closed" % connection_id, status=404
+    )
 
-def _add_entry(value, dictionary, key=None):
-    if key is None:
-        key = _get_new_key(dictionary)
-    dictionary[key] = value
+
+def _get_new_key(dictionary, prefix=0, limit=sys.maxsize):
+    key = prefix | randrange(0, limit)
+    while key in dictionary:
+        key = prefix | randrange(0, limit)
     return key
@@ -0,0 +1,113 @@
+"""
+This module hands large downloads over to the front proxy. The body of a
+streaming response is written to a file in `DOWNLOAD_SPOOL_DIRECTORY` as fast
+as the database delivers it, and the proxy is told to send that file
+(`X-Accel-Redirect`). The worker is free again once the file is written, no
+matter how slowly the client reads it.
+
+The proxy has to serve the directory at the internal location
+`DOWNLOAD_SPOOL_LOCATION`, e.g. for nginx::
+
+    location /spool/ {
+        internal;
+        alias /var/spool/oeplatform/;
+    }
+"""
+
+import os
+import tempfile
+import time
+
+from django.http import HttpResponse
+
+import oeplatform.securitysettings as sec
+
+# Directory shared with the proxy. None streams all responses from the worker.
+DIRECTORY = getattr(sec, "DOWNLOAD_SPOOL_DIRECTORY", None)
+
+# Location at which the proxy serves DIRECTORY
+LOCATION = getattr(sec, "DOWNLOAD_SPOOL_LOCATION", "/spool/")
+
+# Responses of up to this many bytes are sent by the worker directly
+THRESHOLD = getattr(sec, "DOWNLOAD_SPOOL_THRESHOLD", 1 << 20)
+
+# Seconds after which spooled files are removed
+TTL = getattr(sec, "DOWNLOAD_SPOOL_TTL", 3600)
+
+_PREFIX = "download-"
+
+# Headers that describe the body the proxy sends instead
+_BODY_HEADERS = ("content-length", "content-encoding")
+
+
+def spool(response):
+    """
+    Returns `response` with its body spooled to a file sent by the proxy, or
+    as a plain response if the body is small. Other responses are returned
+    unchanged.
+    """
+    if DIRECTORY is None or not response.streaming or response.status_code != 200:
+        return response
+    try:
+        chunks = iter(response)
+        head = []
+        size = 0
+        for chunk in chunks:
+            head.append(chunk)
+            size += len(chunk)
+            if size > THRESHOLD:
+                break
+        else:
+            return _copy_headers(response, HttpResponse(b"".join(head)))
+        path = _write(head, chunks)
+    finally:
+        _close(response)
+    spooled = _copy_headers(response, HttpResponse())
+    spooled["X-Accel-Redirect"] = LOCATION.rstrip("/") + "/" + os.path.basename(path)
+    return spooled
+
+
+def _write(head, chunks):
+    _prune()
+    fd, path = tempfile.mkstemp(prefix=_PREFIX, dir=DIRECTORY)
+    try:
+        with os.fdopen(fd, "wb") as file:
+            file.writelines(head)
+            for chunk in chunks:
+                file.write(chunk)
+        # The proxy usually runs as another user. Access to the files is
+        # restricted by the permissions of the directory.
+        os.chmod(path, 0o644)
+    except:
+        os.remove(path)
+        raise
+    return path
+
+
+def _close(response):
+    # Like response.close(), but without sending request_finished, as the
+    # request goes on with the new response
+    for closer in response._resource_closers:
+        closer()
+    response._resource_closers.clear()
+
+
+def _copy_headers(source, target):
+    for name, value in source.items():
+        if name.lower() not in _BODY_HEADERS:
+            target[name] = value
+    return target
+
+
+def _prune():
+    deadline = time.time() - TTL
+    with os.scandir(DIRECTORY) as entries:
+        for entry in entries:
+            if not entry.name.startswith(_PREFIX):
+                continue
+            try:
+                if entry.stat().st_mtime < deadline:
+                    os.remove(entry.path)
+            except FileNotFoundError:
+                # Removed by another worker
+                pass
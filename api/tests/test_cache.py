@@ -0,0 +1,172 @@
+import threading
+import time
+from unittest import TestCase, mock
+
+from api import actions, cache
+from api.cache import CatalogSnapshot, LRUCache
+
+from . import APITestCase
+
+
+def _later(seconds):
+    return mock.patch("time.monotonic", return_value=time.monotonic() + seconds)
+
+
+class TestLRUCache(TestCase):
+    def test_eviction(self):
+        lru = LRUCache(2)
+        lru.put("a", 1)
+        lru.put("b", 2)
+        # Reading an entry makes it the most recently used one
+        self.assertEqual(lru.get("a"), 1)
+        lru.put("c", 3)
+        self.assertEqual(len(lru), 2)
+        self.assertIn("a", lru)
+        self.assertNotIn("b", lru)
+        self.assertIn("c", lru)
+
+        lru.put("a", 4)
+        lru.put("d", 5)
+        self.assertNotIn("c", lru)
+        self.assertEqual(lru.get("a"), 4)
+
+    def test_discard(self):
+        lru = LRUCache(10)
+        for key in ("a", "b", "c"):
+            lru.put(key, key.upper())
+        lru.discard_if(lambda key: key == "a")
+        lru.discard_values_if(lambda value: value == "B")
+        self.assertEqual(lru.get("a", 0), 0)
+        self.assertNotIn("b", lru)
+        self.assertEqual(lru.pop("c"), "C")
+        self.assertEqual(len(lru), 0)
+
+
+class TestCatalogRefresh(TestCase):
+    def setUp(self):
+        self.snapshot = CatalogSnapshot(60)
+        self.rows = [("s", "a", 1)]
+        self.loading = threading.Event()
+        self.resume = threading.Event()
+        self.resume.set()
+        engine = mock.Mock(execute=self.execute)
+        patcher = mock.patch.object(cache, "_get_engine", return_value=engine)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def execute(self, query, **kwargs):
+        self.loading.set()
+        self.resume.wait()
+        return list(self.rows)
+
+    def test_stale_snapshot_during_refresh(self):
+        self.snapshot.refresh()
+        self.rows = [("s", "b", 1)]
+        self.loading.clear()
+        self.resume.clear()
+        invalidated = []
+
+        def invalidate(schema, table):
+            self.assertFalse(self.snapshot._lock.locked())
+            invalidated.append((schema, table))
+
+        with _later(120), mock.patch.object(cache, "invalidate_table", invalidate):
+            thread = threading.Thread(target=self.snapshot.refresh)
+            thread.start()
+            self.loading.wait()
+            # Other threads neither wait nor query the catalog again
+            self.loading.clear()
+            self.assertTrue(self.snapshot.has_table("s", "a"))
+            self.assertFalse(self.loading.is_set())
+            self.snapshot.add_table("s", "c")
+            self.resume.set()
+            thread.join()
+
+        self.assertEqual(self.snapshot._tables, {("s", "b"), ("s", "c")})
+        self.assertEqual(sorted(invalidated), [("s", "a"), ("s", "b")])
+
+
+class TestCatalogSnapshot(APITestCase):
+    table = "cache_test"
+
+    def setUp(self):
+        actions.perform_sql(
+            'CREATE TABLE "{schema}"."{table}" (id integer)'.format(
+                schema=self.test_schema, table=self.table
+            )
+        )
+        self.snapshot = CatalogSnapshot(60, miss_ttl=1)
+
+    def tearDown(self):
+        actions.perform_sql(
+            'DROP TABLE IF EXISTS "{schema}"."{table}"'.format(
+                schema=self.test_schema, table=self.table
+            )
+        )
+        actions.perform_sql(
+            'DROP TABLE IF EXISTS "{schema}"."{table}_new"'.format(
+                schema=self.test_schema, table=self.table
+            )
+        )
+        cache.invalidate_table(self.test_schema, self.table)
+
+    def count_queries(self):
+        return mock.patch.object(cache, "_get_engine", wraps=cache._get_engine)
+
+    def test_ttl(self):
+        with self.count_queries() as engine:
+            self.assertTrue(self.snapshot.has_table(self.test_schema, self.table))
+            self.assertTrue(self.snapshot.has_schema(self.test_schema))
+            self.assertEqual(engine.call_count, 1)
+            with _later(30):
+                self.snapshot.has_table(self.test_schema, self.table)
+            self.assertEqual(engine.call_count, 1)
+            with _later(120):
+                self.snapshot.has_table(self.test_schema, self.table)
+            self.assertEqual(engine.call_count, 2)
+
+    def test_has_table_fallback(self):
+        table = self.table + "_new"
+        self.snapshot.refresh()
+        # Created after the snapshot was loaded, e.g. by another worker
+        actions.perform_sql(
+            'CREATE TABLE "{schema}"."{table}" (id integer)'.format(
+                schema=self.test_schema, table=table
+            )
+        )
+        with self.count_queries() as engine:
+            self.assertTrue(self.snapshot.has_table(self.test_schema, table))
+            self.assertEqual(engine.call_count, 1)
+            self.assertTrue(self.snapshot.has_table(self.test_schema, table))
+            self.assertEqual(engine.call_count, 1)
+
+    def test_missing_tables(self):
+        self.snapshot.refresh()
+        with self.count_queries() as engine:
+            for _ in range(2):
+                self.assertFalse(self.snapshot.has_table(self.test_schema, "missing"))
+                self.assertFalse(self.snapshot.has_schema("missing"))
+            self.assertEqual(engine.call_count, 2)
+            with _later(2):
+                self.assertFalse(self.snapshot.has_table(self.test_schema, "missing"))
+            self.assertEqual(engine.call_count, 3)
+
+        # Tables created by this worker are known right away
+        self.snapshot.add_table(self.test_schema, "missing")
+        self.assertTrue(self.snapshot.has_table(self.test_schema, "missing"))
+
+    def test_version_invalidates(self):
+        key = (self.test_schema, self.table)
+        with mock.patch.object(cache, "CATALOG", self.snapshot):
+            # The first table is cached after the versions were loaded
+            cache.load_table(*key)
+            self.assertIn(key, cache._TABLES)
+            with _later(120):
+                self.snapshot.refresh()
+            self.assertIn(key, cache._TABLES)
+
+            # Changed by another worker
+            actions.bump_table_version(*key)
+            with _later(240):
+                self.snapshot.refresh()
+            self.assertNotIn(key, cache._TABLES)
@@ -128,6 +128,47 @@ class TestPut(APITestCase):
         }
         self.assertEqual(response.json()["columns"]["new_column"], new_structure)
 
+    def test_insert_after_add(self):
+        # Reflected tables are cached, so inserting into the new column only
+        # works if adding it invalidated the cached table.
+        response = self.__class__.client.post(
+            "/api/v0/schema/{schema}/tables/{table}/rows/new".format(
+                schema=self.test_schema, table=self.test_table
+            ),
+            data=json.dumps({"query": {"id": 1, "name": "John Doe"}}),
+            HTTP_AUTHORIZATION="Token %s" % self.__class__.token,
+            content_type="application/json",
+        )
+        self.assertEqual(response.status_code, 201)
+
+        structure_data = {"data_type": "varchar", "character_maximum_length": 30}
+        response = self.__class__.client.put(
+            "/api/v0/schema/{schema}/tables/{table}/columns/new_column".format(
+                schema=self.test_schema, table=self.test_table
+            ),
+            data=json.dumps({"query": structure_data}),
+            HTTP_AUTHORIZATION="Token %s" % self.__class__.token,
+            content_type="application/json",
+        )
+        self.assertEqual(response.status_code, 201)
+
+        response = self.__class__.client.post(
+            "/api/v0/schema/{schema}/tables/{table}/rows/new".format(
+                schema=self.test_schema, table=self.test_table
+            ),
+            data=json.dumps({"query": {"id": 2, "new_column": "value"}}),
+            HTTP_AUTHORIZATION="Token %s" % self.__class__.token,
+            content_type="application/json",
+        )
+        self.assertEqual(response.status_code, 201)
+
+        response = self.__class__.client.get(
+            "/api/v0/schema/{schema}/tables/{table}/rows/2".format(
+                schema=self.test_schema, table=self.test_table
+            )
+        )
+        self.assertEqual(response.json()["new_column"], "value")
+
     def test_anonymous(self):
         structure_data = {"data_type": "varchar", "character_maximum_length": 30}
         response = self.__class__.client.put(
@@ -0,0 +1,103 @@
+import sqlite3
+import threading
+import time
+from unittest import TestCase
+
+from sqlalchemy import exc
+
+from api.connection import FairQueue, FairQueuePool
+
+
+def _wait_for(condition, timeout=5):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        if time.monotonic() > deadline:
+            raise AssertionError("Condition not met within %d seconds" % timeout)
+        time.sleep(0.001)
+
+
+class TestFairQueue(TestCase):
+    def enqueue(self, queue, user, served):
+        # Starts a thread that waits for a slot and records when it got one
+        waiting = queue.waiting()
+
+        def run():
+            if queue.acquire(user, timeout=5):
+                served.append(user)
+
+        thread = threading.Thread(target=run)
+        thread.start()
+        _wait_for(lambda: queue.waiting() == waiting + 1)
+        return thread
+
+    def test_acquire_and_release(self):
+        queue = FairQueue(2)
+        self.assertTrue(queue.acquire("a", timeout=0))
+        self.assertTrue(queue.acquire("a", timeout=0))
+        self.assertFalse(queue.acquire("b", timeout=0))
+        queue.release()
+        self.assertTrue(queue.acquire("b", timeout=0))
+
+    def test_timeout(self):
+        queue = FairQueue(1)
+        self.assertTrue(queue.acquire("a", timeout=0))
+        start = time.monotonic()
+        self.assertFalse(queue.acquire("b", timeout=0.05))
+        self.assertGreaterEqual(time.monotonic() - start, 0.05)
+        # The waiter that timed out does not take the next free slot
+        self.assertEqual(queue.waiting(), 0)
+        queue.release()
+        self.assertTrue(queue.acquire("c", timeout=0))
+
+    def test_order(self):
+        queue = FairQueue(1)
+        self.assertTrue(queue.acquire(None, timeout=0))
+        served = []
+        threads = [
+            self.enqueue(queue, user, served) for user in ("a", "a", "a", "b", "c")
+        ]
+        for i in range(len(threads)):
+            queue.release()
+            _wait_for(lambda: len(served) == i + 1)
+        for thread in threads:
+            thread.join()
+        # Users take turns, the requests of each user are served in order
+        self.assertEqual(served, ["a", "b", "c", "a", "a"])
+
+
+class TestFairQueuePool(TestCase):
+    def setUp(self):
+        self.pool = FairQueuePool(
+            lambda: sqlite3.connect(":memory:", check_same_thread=False),
+            pool_size=1,
+            max_overflow=0,
+            timeout=0.05,
+        )
+
+    def tearDown(self):
+        self.pool.dispose()
+
+    def test_nested_checkout(self):
+        outer = self.pool.connect()
+        # A thread that holds a connection gets another one right away
+        inner = self.pool.connect()
+        inner.close()
+
+        errors = []
+
+        def other():
+            try:
+                self.pool.connect().close()
+            except exc.TimeoutError as e:
+                errors.append(e)
+
+        thread = threading.Thread(target=other)
+        thread.start()
+        thread.join()
+        self.assertEqual(len(errors), 1)
+
+        outer.close()
+        thread = threading.Thread(target=other)
+        thread.start()
+        thread.join()
+        self.assertEqual(len(errors), 1)
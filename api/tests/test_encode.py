@@ -0,0 +1,74 @@
+import datetime
+from decimal import Decimal
+from unittest import TestCase
+
+from django.core.serializers.json import DjangoJSONEncoder
+
+from api.encode import ChunkedJSONEncoder
+
+
+def _rows(count):
+    return [
+        [
+            i,
+            "row %d äöü" % i,
+            datetime.datetime(2020, 1, 2, 3, 4, 5, 600000)
+            + datetime.timedelta(days=i),
+            datetime.date(2020, 1, 2),
+            Decimal("1.50") * i,
+            None,
+            float("nan"),
+            float("inf"),
+            -float("inf"),
+            1e16,
+            {"b": i, "a": [Decimal("0.1"), None]},
+        ]
+        for i in range(count)
+    ]
+
+
+class TestChunkedJSONEncoder(TestCase):
+    options = [
+        {},
+        {"separators": (",", ":")},
+        {"sort_keys": True},
+        {"ensure_ascii": False},
+    ]
+
+    def assertEncodesLikeDjango(self, o, expected=None, **kwargs):
+        if expected is None:
+            expected = o
+        encoded = "".join(ChunkedJSONEncoder(chunk_size=100, **kwargs).iterencode(o))
+        self.assertEqual(encoded, DjangoJSONEncoder(**kwargs).encode(expected))
+
+    def test_values(self):
+        for kwargs in self.options:
+            for value in _rows(1)[0]:
+                self.assertEncodesLikeDjango(value, **kwargs)
+            self.assertEncodesLikeDjango({"data": _rows(3)}, **kwargs)
+
+    def test_groups(self):
+        # More rows than are encoded at once
+        rows = _rows(2500)
+        for kwargs in self.options:
+            self.assertEncodesLikeDjango(rows, **kwargs)
+            self.assertEncodesLikeDjango(
+                {"data": (row for row in rows)}, {"data": rows}, **kwargs
+            )
+            # Generators are encoded token by token
+            self.assertEncodesLikeDjango(
+                [(value for value in row) for row in rows[:10]], rows[:10], **kwargs
+            )
+
+    def test_lines(self):
+        rows = _rows(3)
+        encoder = ChunkedJSONEncoder(separators=(",", ":"))
+        expected = DjangoJSONEncoder(separators=(",", ":"))
+        self.assertEqual(
+            "".join(encoder.iterencode_lines(rows)),
+            "".join(expected.encode(row) + "\n" for row in rows),
+        )
+
+    def test_nan_not_allowed(self):
+        encoder = ChunkedJSONEncoder(allow_nan=False)
+        self.assertRaises(ValueError, lambda: "".join(encoder.iterencode(_rows(1))))
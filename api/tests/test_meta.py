@@ -1,8 +1,10 @@
 import json
 
+import sqlalchemy as sa
 from shapely import wkb, wkt
 
 from api import actions
+from dataedit.structures import TableVersion
 
 from . import APITestCase
 from .util import content2json, load_content, load_content_as_json
@@ -127,6 +129,41 @@ class TestPut(APITestCase):
         meta = {"id": self.test_table}
         self.metadata_roundtrip(meta)
 
+    def test_conditional_get(self):
+        url = "/api/v0/schema/{schema}/tables/{table}/meta/".format(
+            schema=self.test_schema, table=self.test_table
+        )
+        response = self.__class__.client.get(url)
+        self.assertEqual(response.status_code, 200, response.content)
+        etag = response["ETag"]
+
+        response = self.__class__.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+
+        self.metadata_roundtrip({"id": self.test_table})
+
+        response = self.__class__.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200, response.content)
+        self.assertNotEqual(response["ETag"], etag)
+
+    def test_conditional_get_untracked(self):
+        versions = TableVersion.__table__
+        actions._get_engine().execute(
+            versions.delete().where(
+                sa.and_(
+                    versions.c["schema"] == self.test_schema,
+                    versions.c["table"] == self.test_table,
+                )
+            )
+        )
+        url = "/api/v0/schema/{schema}/tables/{table}/meta/".format(
+            schema=self.test_schema, table=self.test_table
+        )
+        response = self.__class__.client.get(url)
+        self.assertEqual(response.status_code, 200, response.content)
+        self.assertNotIn("ETag", response)
+        self.assertNotIn("Last-Modified", response)
+
     def test_complete_metadata(self):
         null = None
         meta = {"name": "oep_metadata_table_example_v14",
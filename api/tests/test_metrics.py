@@ -0,0 +1,139 @@
+import json
+import os
+import tempfile
+import time
+from unittest import TestCase, mock
+
+from django.http import HttpResponse, StreamingHttpResponse
+
+from api import metrics
+from api.middleware import MetricsMiddleware
+
+
+class TestMetricsDirectory(TestCase):
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        patcher = mock.patch.object(metrics, "DIRECTORY", self.directory.name)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.addCleanup(self.directory.cleanup)
+
+    def write_worker(self, name, values):
+        # Writes the metrics of another worker process
+        with mock.patch.object(metrics, "_name", lambda: name), mock.patch.object(
+            metrics.ROWS_STREAMED, "values", lambda: {(): values["rows"]}
+        ), mock.patch.object(
+            metrics.REQUEST_STATEMENTS, "values", lambda: values["statements"]
+        ):
+            metrics.write(force=True)
+
+    def sample(self, content, name):
+        for line in content.splitlines():
+            if line.startswith(name + " "):
+                return float(line.split()[-1])
+        raise AssertionError("%s not found" % name)
+
+    def test_workers_are_added_up(self):
+        rows = metrics.ROWS_STREAMED.values()[()]
+        buckets = len(metrics.REQUEST_STATEMENTS.buckets)
+        statements = [0] * buckets + [3]
+        statements[1] = 3
+        # Workers that have exited still count
+        with mock.patch.object(metrics, "_alive", lambda pid, start: pid != 2):
+            for name, rows_streamed in (("1-100.json", 5), ("2-100.json", 7)):
+                self.write_worker(
+                    name,
+                    {"rows": rows_streamed, "statements": {("/a",): statements}},
+                )
+            content = metrics.render()
+            # The file of the exited worker was folded into the totals
+            self.assertEqual(metrics.render(), content)
+
+        self.assertEqual(
+            self.sample(content, "oep_api_rows_streamed_total"), rows + 12
+        )
+        self.assertEqual(
+            self.sample(content, 'oep_api_request_sql_statements_count{route="/a"}'),
+            6,
+        )
+        files = os.listdir(self.directory.name)
+        self.assertIn(metrics._name(), files)
+        self.assertIn("1-100.json", files)
+        self.assertNotIn("2-100.json", files)
+        self.assertIn(metrics._EXITED, files)
+
+    def test_gauges_of_exited_workers(self):
+        gauge = metrics.Gauge("oep_test_gauge", "Test", lambda: 1)
+        self.addCleanup(metrics._REGISTRY.remove, gauge)
+        for name in ("1-100.json", "2-100.json"):
+            with mock.patch.object(metrics, "_name", lambda: name):
+                metrics.write(force=True)
+        with mock.patch.object(
+            metrics, "_alive", lambda pid, start: pid in (1, os.getpid())
+        ):
+            content = metrics.render()
+        self.assertEqual(self.sample(content, "oep_test_gauge"), 2)
+        with open(os.path.join(self.directory.name, metrics._EXITED)) as f:
+            self.assertNotIn("oep_test_gauge", json.load(f))
+
+    def test_reused_pid(self):
+        # A file of a worker whose pid now belongs to this process
+        start = metrics._name()[: -len(".json")].split("-")[1]
+        name = "{0}-{1}0.json".format(os.getpid(), start)
+        self.write_worker(name, {"rows": 5, "statements": {}})
+        self.assertTrue(metrics._alive(os.getpid(), start))
+        self.assertFalse(metrics._alive(os.getpid(), start + "0"))
+        metrics.render()
+        self.assertNotIn(name, os.listdir(self.directory.name))
+
+    def test_writes_are_throttled(self):
+        path = os.path.join(self.directory.name, metrics._name())
+        metrics.write(force=True)
+        written = os.stat(path).st_mtime_ns
+        with mock.patch.object(metrics, "_dump") as dump:
+            metrics.write()
+            dump.assert_not_called()
+            # Changes are written at the end of the interval
+            metrics._pending.join()
+            dump.assert_called_once()
+        self.assertEqual(os.stat(path).st_mtime_ns, written)
+        with mock.patch(
+            "time.monotonic", return_value=time.monotonic() + metrics.WRITE_INTERVAL
+        ), mock.patch.object(metrics, "_dump") as dump:
+            metrics.write()
+            dump.assert_called_once()
+
+
+class TestMetricsMiddleware(TestCase):
+    def request(self, route):
+        return mock.Mock(
+            path="/api/v0/test", method="GET", resolver_match=mock.Mock(route=route)
+        )
+
+    def statements(self, route):
+        counts = metrics.REQUEST_STATEMENTS.values().get((route,))
+        return counts and counts[-1]
+
+    def test_response(self):
+        def view(request):
+            metrics.count_statement()
+            return HttpResponse()
+
+        MetricsMiddleware(view)(self.request("test-response"))
+        self.assertEqual(self.statements("test-response"), 1)
+
+    def test_streamed_response(self):
+        def content():
+            metrics.count_statement()
+            yield b"rows"
+
+        def view(request):
+            metrics.count_statement()
+            return StreamingHttpResponse(content())
+
+        response = MetricsMiddleware(view)(self.request("test-stream"))
+        # Observed once the body was sent
+        self.assertIsNone(self.statements("test-stream"))
+        self.assertEqual(b"".join(response), b"rows")
+        response.close()
+        self.assertEqual(self.statements("test-stream"), 2)
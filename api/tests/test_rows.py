@@ -1,8 +1,15 @@
+import io
 import json
+import os
+import tempfile
+from unittest import mock
 
+import geoalchemy2
+import sqlalchemy as sa
 from shapely import wkb, wkt
 
-from api import actions
+from api import actions, metrics, parquet, spool, views
+from api.cache import invalidate_table
 
 from . import APITestCase
 from .util import content2json, load_content, load_content_as_json
@@ -483,6 +490,34 @@ class TestPost(APITestCase):
             expected_result=row,
         )
 
+    def test_post_existing_with_column_added_outside_api(self):
+        self.test_simple_post_new()
+        # A column added by SQL is missing in the existing meta tables
+        actions.perform_sql(
+            'ALTER TABLE "{schema}"."{table}" ADD COLUMN extra integer'.format(
+                schema=self.test_schema, table=self.test_table
+            )
+        )
+        invalidate_table(self.test_schema, self.test_table)
+
+        self.check_api_post(
+            "/api/v0/schema/{schema}/tables/{table}/rows/1".format(
+                schema=self.test_schema, table=self.test_table
+            ),
+            data={"query": {"id": 1, "name": "Jane Doe"}},
+        )
+
+        response = self.__class__.client.get(
+            "/api/v0/schema/{schema}/tables/{table}/rows/1".format(
+                schema=self.test_schema, table=self.test_table
+            )
+        )
+        content = load_content_as_json(response)
+        self.assertEqual(response.status_code, 200, content)
+        self.assertEqual(content["name"], "Jane Doe")
+        self.assertEqual(content["address"], "Mary's Street")
+        self.assertIsNone(content["extra"])
+
     def test_bulk_insert(self):
         rows = [
             {"id": rid, "name": "Mary Doe", "address": "Mary's Street", "geom": None}
@@ -521,6 +556,117 @@ class TestPost(APITestCase):
         content = content2json(content)
         self.assertListEqual(content, rows)
 
+    def test_bulk_insert_copy(self):
+        rows = [
+            {
+                "id": rid,
+                "name": 'Mary "Bulk" Doe',
+                "address": "" if rid % 2 else None,
+                "geom": "0101000000E44A3D0B42CA51C06EC328081E214540",
+            }
+            for rid in range(0, 23)
+        ]
+
+        response = self.__class__.client.post(
+            "/api/v0/schema/{schema}/tables/{table}/rows/new?bulk=true".format(
+                schema=self.test_schema, table=self.test_table
+            ),
+            data=json.dumps({"query": rows}),
+            HTTP_AUTHORIZATION="Token %s" % self.__class__.token,
+            content_type="application/json",
+        )
+
+        self.assertEqual(
+            response.status_code,
+            201,
+            load_content_as_json(response).get("reason", "No reason returned"),
+        )
+
+        response = self.__class__.client.get(
+            "/api/v0/schema/{schema}/tables/{table}/rows/".format(
+                schema=self.test_schema, table=self.test_table
+            )
+        )
+
+        content = load_content_as_json(response)
+        self.assertEqual(response.status_code, 200, content)
+        self.assertListEqual(content, rows)
+
+    def test_bulk_insert_copy_json(self):
+        table = "test_json_copy"
+        self.create_table(
+            {
+                "columns": [
+                    {"name": "id", "data_type": "bigserial", "is_nullable": False},
+                    {"name": "doc", "data_type": "jsonb", "is_nullable": True},
+                    {"name": "tags", "data_type": "text[]", "is_nullable": True},
+                ],
+                "constraints": [
+                    {"constraint_type": "PRIMARY KEY", "constraint_parameter": "id"}
+                ],
+            },
+            table=table,
+        )
+        rows = [
+            {"id": 1, "doc": [1, "two", {"three": 3}], "tags": ["a", "b"]},
+            {"id": 2, "doc": {"list": [1, 2]}, "tags": []},
+            {"id": 3, "doc": None, "tags": None},
+        ]
+        url = "/api/v0/schema/{schema}/tables/{table}/".format(
+            schema=self.test_schema, table=table
+        )
+        try:
+            # The same rows are inserted by a regular INSERT and via COPY
+            expected = []
+            for offset, bulk in ((0, "false"), (10, "true")):
+                batch = [dict(row, id=row["id"] + offset) for row in rows]
+                expected += batch
+                response = self.__class__.client.post(
+                    url + "rows/new?bulk=" + bulk,
+                    data=json.dumps({"query": batch}),
+                    HTTP_AUTHORIZATION="Token %s" % self.__class__.token,
+                    content_type="application/json",
+                )
+                content = load_content_as_json(response)
+                self.assertEqual(response.status_code, 201, content)
+
+            response = self.__class__.client.get(url + "rows/?orderby=id")
+            content = load_content_as_json(response)
+            self.assertEqual(response.status_code, 200, content)
+            self.assertListEqual(content, expected)
+        finally:
+            self.__class__.client.delete(
+                url, HTTP_AUTHORIZATION="Token %s" % self.__class__.token
+            )
+
+    def test_bulk_insert_duplicate(self):
+        rows = [{"id": 1, "name": "John Doe"}, {"id": 2}, {"id": 1}]
+
+        response = self.__class__.client.post(
+            "/api/v0/schema/{schema}/tables/{table}/rows/new".format(
+                schema=self.test_schema, table=self.test_table
+            ),
+            data=json.dumps({"query": rows}),
+            HTTP_AUTHORIZATION="Token %s" % self.__class__.token,
+            content_type="application/json",
+        )
+
+        self.assertEqual(response.status_code, 400, load_content(response))
+
+    def test_insert_existing_key(self):
+        self.test_simple_post_new()
+
+        response = self.__class__.client.post(
+            "/api/v0/schema/{schema}/tables/{table}/rows/new".format(
+                schema=self.test_schema, table=self.test_table
+            ),
+            data=json.dumps({"query": [{"id": 5}, {"id": 1}]}),
+            HTTP_AUTHORIZATION="Token %s" % self.__class__.token,
+            content_type="application/json",
+        )
+
+        self.assertEqual(response.status_code, 400, load_content(response))
+
 
 class TestGet(APITestCase):
     @classmethod
@@ -700,6 +846,311 @@ class TestGet(APITestCase):
         ):
             self.assertDictEqualKeywise(*c)
 
+    def test_csv(self):
+        response = self.__class__.client.get(
+            "/api/v0/schema/{schema}/tables/{table}/rows/"
+            "?form=csv&column=id&column=name&where=id>=50&orderby=id&limit=10".format(
+                schema=self.test_schema, table=self.test_table
+            )
+        )
+
+        content = load_content(response).decode("utf-8")
+        self.assertEqual(response.status_code, 200, content)
+        self.assertEqual(response["Content-Type"], "text/csv")
+
+        lines = content.splitlines()
+        self.assertEqual(lines[0], "id,name")
+        self.assertEqual(
+            lines[1:],
+            ['"{id}","{name}"'.format(**row) for row in self.rows[50:60]],
+        )
+
+    def test_spooled_csv(self):
+        url = "/api/v0/schema/{schema}/tables/{table}/rows/?form=csv&column=id&orderby=id".format(
+            schema=self.test_schema, table=self.test_table
+        )
+        with tempfile.TemporaryDirectory() as directory:
+            with mock.patch.multiple(spool, DIRECTORY=directory, THRESHOLD=100):
+                response = self.__class__.client.get(url)
+            self.assertEqual(response.status_code, 200, response.content)
+            self.assertEqual(response["Content-Type"], "text/csv")
+            name = response["X-Accel-Redirect"][len("/spool/") :]
+            with open(os.path.join(directory, name), "rb") as file:
+                lines = file.read().decode("utf-8").splitlines()
+        self.assertEqual(lines[0], "id")
+        self.assertEqual(lines[1:], ['"{id}"'.format(**row) for row in self.rows])
+
+    def test_pagination_token(self):
+        url = "/api/v0/schema/{schema}/tables/{table}/rows/?column=name&limit=30&after=".format(
+            schema=self.test_schema, table=self.test_table
+        )
+        pages = []
+        token = ""
+        while token is not None:
+            response = self.__class__.client.get(url + token)
+            content = load_content_as_json(response)
+            self.assertEqual(response.status_code, 200, content)
+            pages.append(content)
+            token = response.get("X-Next-Token")
+
+        self.assertEqual([len(page) for page in pages], [30, 30, 30, 10])
+        self.assertEqual(
+            [row for page in pages for row in page],
+            [{"name": row["name"]} for row in self.rows],
+        )
+
+    def test_invalid_pagination_token(self):
+        response = self.__class__.client.get(
+            "/api/v0/schema/{schema}/tables/{table}/rows/?limit=30&after=foo".format(
+                schema=self.test_schema, table=self.test_table
+            )
+        )
+        self.assertEqual(response.status_code, 400, load_content(response))
+
+    def test_ndjson(self):
+        response = self.__class__.client.get(
+            "/api/v0/schema/{schema}/tables/{table}/rows/?form=ndjson".format(
+                schema=self.test_schema, table=self.test_table
+            )
+        )
+
+        content = load_content(response).decode("utf-8")
+        self.assertEqual(response.status_code, 200, content)
+        self.assertEqual(response["Content-Type"], "application/x-ndjson")
+
+        lines = content.splitlines()
+        self.assertEqual(len(lines), len(self.rows))
+        for c in zip(map(json.loads, lines), self.rows):
+            self.assertDictEqualKeywise(*c)
+
+    def test_metrics(self):
+        rows_before = metrics.ROWS_STREAMED.samples()[0][2]
+        response = self.__class__.client.get(
+            "/api/v0/schema/{schema}/tables/{table}/rows/".format(
+                schema=self.test_schema, table=self.test_table
+            )
+        )
+        load_content(response)
+        self.assertEqual(
+            metrics.ROWS_STREAMED.samples()[0][2] - rows_before, len(self.rows)
+        )
+
+        with mock.patch.object(
+            views.sec, "METRICS_ALLOWED_IPS", ["127.0.0.1"], create=True
+        ):
+            response = self.__class__.client.get("/api/metrics")
+        content = load_content(response).decode("utf-8")
+        self.assertEqual(response.status_code, 200, content)
+        self.assertIn("oep_api_request_duration_seconds_bucket{", content)
+        self.assertIn("oep_api_sessions ", content)
+
+    def test_metrics_access(self):
+        with mock.patch.object(views.sec, "METRICS_ALLOWED_IPS", None, create=True):
+            response = self.__class__.client.get("/api/metrics")
+        self.assertEqual(response.status_code, 403)
+
+        with mock.patch.multiple(
+            views.sec,
+            METRICS_ALLOWED_IPS=["10.0.0.1"],
+            METRICS_NUM_PROXIES=1,
+            create=True,
+        ):
+            # The last address is appended by the proxy, the others are not
+            # trustworthy
+            response = self.__class__.client.get(
+                "/api/metrics", HTTP_X_FORWARDED_FOR="127.0.0.1, 10.0.0.1"
+            )
+            self.assertEqual(response.status_code, 200)
+            response = self.__class__.client.get(
+                "/api/metrics", HTTP_X_FORWARDED_FOR="10.0.0.1, 127.0.0.1"
+            )
+            self.assertEqual(response.status_code, 403)
+
+    def test_batch(self):
+        search = {
+            "fields": ["id", "name"],
+            "from": {
+                "type": "table",
+                "schema": self.test_schema,
+                "table": self.test_table,
+            },
+            "order_by": [{"type": "column", "column": "id"}],
+            "limit": 8,
+        }
+        operations = [
+            {"action": "cursor/open"},
+            {"action": "search", "cursor_id": {"step": 0}, "query": search},
+            {
+                "action": "cursor/fetch_many",
+                "cursor_id": {"step": 1},
+                "query": {"size": 5},
+            },
+            {"action": "cursor/fetch_all", "cursor_id": {"step": 0}},
+            {"action": "cursor/close", "cursor_id": {"step": 0}},
+        ]
+        response = self.__class__.client.post(
+            "/api/v0/advanced/batch",
+            data=json.dumps({"query": {"operations": operations}}),
+            content_type="application/json",
+        )
+        content = load_content_as_json(response)
+        self.assertEqual(response.status_code, 200, content)
+        results = content["content"]
+        self.assertEqual(len(results), len(operations))
+        self.assertEqual(results[1]["rowcount"], 8)
+        expected = [[row["id"], row["name"]] for row in self.rows[:8]]
+        self.assertEqual(results[2], expected[:5])
+        self.assertEqual(results[3], expected[5:])
+
+        operations[1]["query"] = dict(search, fields=["missing"])
+        response = self.__class__.client.post(
+            "/api/v0/advanced/batch",
+            data=json.dumps({"query": {"operations": operations}}),
+            content_type="application/json",
+        )
+        self.assertEqual(response.status_code, 400)
+        self.assertTrue(response.json()["reason"].startswith("Step 1 failed"))
+
+    def test_batch_fetch_steps(self):
+        # Fetches may refer to the cursor used by an earlier fetch
+        search = {
+            "fields": ["id"],
+            "from": {
+                "type": "table",
+                "schema": self.test_schema,
+                "table": self.test_table,
+            },
+            "order_by": [{"type": "column", "column": "id"}],
+        }
+        operations = [
+            {"action": "cursor/open"},
+            {"action": "search", "cursor_id": {"step": 0}, "query": search},
+            {
+                "action": "cursor/fetch_many",
+                "cursor_id": {"step": 1},
+                "query": {"size": 2},
+            },
+            {
+                "action": "cursor/fetch_many",
+                "cursor_id": {"step": 2},
+                "query": {"size": 2},
+            },
+            {"action": "cursor/fetch_one", "cursor_id": {"step": 3}},
+        ]
+        response = self.__class__.client.post(
+            "/api/v0/advanced/batch",
+            data=json.dumps({"query": {"operations": operations}}),
+            content_type="application/json",
+        )
+        content = load_content_as_json(response)
+        self.assertEqual(response.status_code, 200, content)
+        results = content["content"]
+        ids = [[row["id"]] for row in self.rows]
+        self.assertEqual(results[2], ids[:2])
+        self.assertEqual(results[3], ids[2:4])
+        self.assertEqual(results[4], ids[4])
+
+        # Operations without a cursor of their own cannot be referred to
+        operations = [
+            {"action": "has_schema", "query": {"schema": self.test_schema}},
+            {"action": "cursor/fetch_one", "cursor_id": {"step": 0}},
+        ]
+        response = self.__class__.client.post(
+            "/api/v0/advanced/batch",
+            data=json.dumps({"query": {"operations": operations}}),
+            content_type="application/json",
+        )
+        self.assertEqual(response.status_code, 400)
+        self.assertIn("did not use a cursor", response.json()["reason"])
+
+    def test_fetch(self):
+        def post(path, **data):
+            return self.__class__.client.post(
+                "/api/v0/advanced/" + path,
+                data=json.dumps(data),
+                content_type="application/json",
+            )
+
+        context = load_content_as_json(post("connection/open"))["content"]
+        context.update(load_content_as_json(post("cursor/open", **context))["content"])
+        query = {
+            "fields": ["id", "name"],
+            "from": {
+                "type": "table",
+                "schema": self.test_schema,
+                "table": self.test_table,
+            },
+            "order_by": [{"type": "column", "column": "id"}],
+        }
+        response = post("search", query=query, **context)
+        self.assertEqual(response.status_code, 200, load_content(response))
+        expected = [[row["id"], row["name"]] for row in self.rows]
+
+        response = post("cursor/fetch_many", size=3, **context)
+        lines = load_content(response).decode("utf-8").splitlines()
+        self.assertEqual(response.status_code, 200, lines)
+        self.assertEqual([json.loads(line) for line in lines], expected[:3])
+
+        response = post("cursor/fetch_all", compact=True, **context)
+        lines = load_content(response).decode("utf-8").splitlines()
+        self.assertEqual(response.status_code, 200, lines)
+        self.assertEqual(json.loads(lines[0]), {"columns": ["id", "name"]})
+        rows = [row for line in lines[1:] for row in json.loads(line)]
+        self.assertEqual(rows, expected[3:])
+
+        post("connection/close", **context)
+
+    def test_parquet(self):
+        response = self.__class__.client.get(
+            "/api/v0/schema/{schema}/tables/{table}/rows/"
+            "?form=parquet&where=id>=50&orderby=id".format(
+                schema=self.test_schema, table=self.test_table
+            )
+        )
+
+        content = load_content(response)
+        self.assertEqual(response.status_code, 200, content)
+
+        result = parquet.pyarrow.parquet.read_table(io.BytesIO(content)).to_pylist()
+        expected = [row for row in self.rows if row["id"] >= 50]
+        self.assertEqual(len(result), len(expected))
+        for r, e in zip(result, expected):
+            self.assertEqual(r["id"], e["id"])
+            self.assertEqual(r["name"], e["name"])
+            self.assertEqual(
+                wkb.loads(r["geom"]), wkb.loads(e["geom"], hex=True)
+            )
+
+
+class TestTranslateGeometries(APITestCase):
+    def test_fetched_rows(self):
+        geometries = [
+            "POINT(-71.160281 42.258729)",
+            "LINESTRING(0 0,1 1.5)",
+            "MULTIPOINT(1 2,3 4)",
+            "POINT Z (1 2 3)",
+        ]
+        engine = actions._get_engine()
+        columns = [sa.cast(g, geoalchemy2.Geometry) for g in geometries]
+        # SQLAlchemy returns geometries as WKBElement
+        row = engine.execute(sa.select(columns)).first()
+        self.assertIsInstance(row[0], geoalchemy2.WKBElement)
+        expected = engine.execute(
+            sa.select([sa.func.ST_AsText(c) for c in columns])
+        ).first()
+
+        # All geometries of a batch are converted with one query
+        with mock.patch.object(
+            actions, "_get_engine", wraps=actions._get_engine
+        ) as get_engine:
+            self.assertEqual(
+                actions._translate_fetched_rows(
+                    [list(row) + [1, None], list(reversed(row))]
+                ),
+                [list(expected) + [1, None], list(reversed(expected))],
+            )
+        self.assertEqual(get_engine.call_count, 1)
+
 
 class TestDelete(APITestCase):
     @classmethod
@@ -0,0 +1,248 @@
+import copy
+import json
+from unittest import mock
+
+from api import actions, parser, sessions
+from api.cache import COMPILED_QUERIES, invalidate_table, search_path_schema
+from api.error import APIError
+
+from . import APITestCase
+from .util import load_content_as_json
+
+
+def _column(name):
+    return {"type": "column", "column": name}
+
+
+def _value(value):
+    return {"type": "value", "value": value}
+
+
+def _operator(operator, *operands):
+    return {"type": "operator", "operator": operator, "operands": list(operands)}
+
+
+class SearchTestCase(APITestCase):
+    def setUp(self):
+        self.rows = [
+            {"id": i, "name": "name%d" % (i % 3), "value": i * 10}
+            for i in range(1, 10)
+        ]
+        self.create_table(
+            {
+                "constraints": [
+                    {
+                        "constraint_type": "PRIMARY KEY",
+                        "constraint_parameter": "id",
+                        "reference_table": None,
+                        "reference_column": None,
+                    }
+                ],
+                "columns": [
+                    {"name": "id", "data_type": "bigserial", "is_nullable": False},
+                    {
+                        "name": "name",
+                        "data_type": "character varying",
+                        "is_nullable": True,
+                        "character_maximum_length": 50,
+                    },
+                    {"name": "value", "data_type": "integer", "is_nullable": True},
+                ],
+            },
+            data=self.rows,
+        )
+
+    def tearDown(self):
+        self.drop_table()
+
+    def query(self, where=None, fields=None):
+        query = {
+            "from": {
+                "type": "table",
+                "schema": self.test_schema,
+                "table": self.test_table,
+            },
+            "fields": fields or [_column("id")],
+            "order_by": [_column("id")],
+        }
+        if where is not None:
+            query["where"] = where
+        return query
+
+    def post(self, path, **data):
+        return self.__class__.client.post(
+            "/api/v0/advanced/" + path,
+            data=json.dumps(data),
+            content_type="application/json",
+        )
+
+    def search(self, query):
+        response = self.post("search", query=query)
+        content = load_content_as_json(response)
+        self.assertEqual(response.status_code, 200, content)
+        return [row[0] for row in content["data"]]
+
+
+class TestCompiledSearch(SearchTestCase):
+    def assertCompiledAsUncached(self, query):
+        compiled = parser._compile_query(parser.parse_select(copy.deepcopy(query)))
+        # The first call fills the cache, the second one is answered from it
+        for _ in range(2):
+            statement, params = parser.compile_select(copy.deepcopy(query))
+            self.assertEqual(statement, str(compiled))
+            self.assertEqual(params, dict(compiled.params))
+
+    def test_cached_matches_uncached(self):
+        queries = [
+            self.query(_operator("=", _column("name"), _value("name1"))),
+            self.query(_operator(">", _value(40), _column("value"))),
+            self.query(_operator("in", _column("id"), [_value(2), _value(5)])),
+            self.query(_operator("like", _column("name"), _value("%2"))),
+            self.query(fields=[_column("id"), _value(1)]),
+            self.query(
+                fields=[
+                    {
+                        "type": "function",
+                        "function": "+",
+                        "operands": [_value(1), _value(2)],
+                    }
+                ]
+            ),
+            self.query(_operator("=", _value(1), _value(2))),
+        ]
+        for query in queries:
+            self.assertCompiledAsUncached(query)
+
+    def test_cached_results(self):
+        for name in ("name0", "name1", "name2"):
+            query = self.query(_operator("=", _column("name"), _value(name)))
+            self.assertEqual(
+                self.search(query), [r["id"] for r in self.rows if r["name"] == name]
+            )
+        for limit in (15, 45):
+            query = self.query(_operator(">", _value(limit), _column("value")))
+            self.assertEqual(
+                self.search(query), [r["id"] for r in self.rows if r["value"] < limit]
+            )
+
+    def test_ddl_invalidates_cache(self):
+        query = self.query(_operator("=", _column("name"), _value("name1")))
+        key = parser._fingerprint(query, [])
+        parser.compile_select(query)
+        self.assertIn(key, COMPILED_QUERIES)
+
+        response = self.__class__.client.put(
+            "/api/v0/schema/{schema}/tables/{table}/columns/extra".format(
+                schema=self.test_schema, table=self.test_table
+            ),
+            data=json.dumps({"query": {"data_type": "integer"}}),
+            HTTP_AUTHORIZATION="Token %s" % self.__class__.token,
+            content_type="application/json",
+        )
+        self.assertEqual(response.status_code, 201, response.json())
+        self.assertNotIn(key, COMPILED_QUERIES)
+
+    def test_errors_are_not_cached(self):
+        query = self.query(_operator("=", _column("name"), _value("name1")))
+        query["from"]["table"] = "not_yet_created"
+        key = parser._fingerprint(query, [])
+        self.assertRaises(APIError, parser.compile_select, query)
+        self.assertNotIn(key, COMPILED_QUERIES)
+
+
+class TestSearchLimits(SearchTestCase):
+    def test_cost_limit(self):
+        query = self.query()
+        with mock.patch.dict(actions.SEARCH_COST_LIMITS, anonymous=0.001):
+            response = self.post("search", query=query)
+        self.assertEqual(response.status_code, 400)
+        self.assertIn("estimated cost", response.json()["reason"])
+
+        with mock.patch.dict(actions.SEARCH_COST_LIMITS, anonymous=1e9):
+            self.assertEqual(self.search(query), [r["id"] for r in self.rows])
+
+    def test_statement_timeout(self):
+        sleep = {"type": "function", "function": "pg_sleep", "operands": [_value(5)]}
+        query = self.query(fields=[sleep])
+        query["limit"] = 1
+        with mock.patch.dict(actions.SEARCH_STATEMENT_TIMEOUTS, anonymous=1):
+            response = self.post("search", query=query)
+        self.assertEqual(response.status_code, 400)
+        self.assertIn("cancelled", response.json()["reason"])
+
+    def test_statement_timeout_is_reset(self):
+        context = load_content_as_json(self.post("connection/open"))["content"]
+        cursor = load_content_as_json(self.post("cursor/open", **context))
+        context.update(cursor["content"])
+        session = sessions.load_session_from_context(context)
+
+        def statement_timeout():
+            cursor = session.connection.cursor()
+            try:
+                cursor.execute("SHOW statement_timeout")
+                return cursor.fetchone()[0]
+            finally:
+                cursor.close()
+
+        try:
+            before = statement_timeout()
+            with mock.patch.dict(actions.SEARCH_STATEMENT_TIMEOUTS, anonymous=1):
+                response = self.post("search", query=self.query(), **context)
+            content = load_content_as_json(response)
+            self.assertEqual(response.status_code, 200, content)
+            # Later statements of the same transaction are not limited
+            self.assertEqual(statement_timeout(), before)
+        finally:
+            self.post("connection/close", **context)
+
+
+class TestSchemalessFrom(APITestCase):
+    table = "parser_schemaless"
+
+    def setUp(self):
+        self.schema = search_path_schema()
+        actions.perform_sql(
+            'CREATE TABLE "{schema}"."{table}" (id integer)'.format(
+                schema=self.schema, table=self.table
+            )
+        )
+        actions.perform_sql(
+            'INSERT INTO "{schema}"."{table}" VALUES (1), (2)'.format(
+                schema=self.schema, table=self.table
+            )
+        )
+
+    def tearDown(self):
+        actions.perform_sql(
+            'DROP TABLE "{schema}"."{table}"'.format(
+                schema=self.schema, table=self.table
+            )
+        )
+        invalidate_table(self.schema, self.table)
+
+    def test_parse_from_item(self):
+        table = parser.parse_from_item({"type": "table", "table": self.table})
+        self.assertEqual((table.schema, table.name), (self.schema, self.table))
+
+    def test_compiled_tables(self):
+        query = {
+            "from": {"type": "table", "table": self.table},
+            "fields": [_column("id")],
+            "order_by": [_column("id")],
+        }
+        parser.compile_select(copy.deepcopy(query))
+        key = parser._fingerprint(query, [])
+        self.assertIn((self.schema, self.table), COMPILED_QUERIES.get(key).tables)
+
+        response = self.__class__.client.post(
+            "/api/v0/advanced/search",
+            data=json.dumps({"query": query}),
+            content_type="application/json",
+        )
+        content = load_content_as_json(response)
+        self.assertEqual(response.status_code, 200, content)
+        self.assertEqual([row[0] for row in content["data"]], [1, 2])
+
+        # Changes of the table drop the compiled query
+        invalidate_table(self.schema, self.table)
+        self.assertNotIn(key, COMPILED_QUERIES)
@@ -0,0 +1,173 @@
+import json
+import os
+import socket
+import time
+from unittest import TestCase, mock
+
+from sqlalchemy import text
+
+from api import actions, sessions
+from api.error import APIError
+
+from . import APITestCase
+
+
+def _session(owner="user"):
+    return mock.Mock(owner=owner, last_activity=time.time(), cursors={}, in_use=0)
+
+
+class TestSessionRegistry(TestCase):
+    def setUp(self):
+        self.registry = sessions._SessionRegistry(60)
+
+    def expire(self, after=120):
+        # Expires sessions as if `after` seconds had passed. The reaper thread
+        # does not, since the timeout is measured in real time.
+        return self.registry._pop_expired(time.time() + after)
+
+    def test_idle_sessions_are_closed(self):
+        session = _session()
+        session_id = self.registry.add(session, 10, 1)
+        self.assertEqual(session_id >> sessions._RANDOM_BITS, 1)
+        self.assertIs(self.registry.get(session_id), session)
+
+        self.assertEqual(self.expire(), [session])
+        self.assertIsNone(self.registry.get(session_id))
+        self.assertEqual(self.registry.count(session.owner), 0)
+
+    def test_sessions_with_cursors_are_kept(self):
+        session = _session()
+        session.cursors = {1: mock.Mock()}
+        session_id = self.registry.add(session, 10, 1)
+        self.assertEqual(self.expire(), [])
+        self.assertIs(self.registry.get(session_id), session)
+
+    def test_sessions_in_use_are_kept(self):
+        session = _session()
+        session_id = self.registry.add(session, 10, 1)
+        self.assertIs(self.registry.acquire(session_id), session)
+        self.assertEqual(self.expire(), [])
+
+        self.registry.release(session)
+        self.assertEqual(session.in_use, 0)
+        # Sessions are idle from the time they were released
+        self.assertEqual(self.expire(), [])
+        self.assertEqual(self.expire(240), [session])
+
+    def test_idle_sessions_do_not_count_against_limit(self):
+        session = _session()
+        self.registry.add(session, 1, 1)
+        self.assertIsNone(self.registry.add(_session(), 1, 1))
+        with mock.patch("time.time", return_value=time.time() + 120):
+            self.assertIsNotNone(self.registry.add(_session(), 1, 1))
+        session.connection.close.assert_called_once_with()
+
+
+class WorkerTestCase(APITestCase):
+    def setUp(self):
+        self.keys = []
+
+    def tearDown(self):
+        for key in self.keys:
+            actions._get_engine().execute(
+                text("DELETE FROM public.api_workers WHERE key = :key"), key=key
+            )
+
+    def register(self):
+        worker = sessions._Worker(60)
+        self.keys.append(worker.key)
+        return worker
+
+    def add_worker(self, key, age):
+        # Registers another worker whose heartbeat is `age` seconds old
+        actions._get_engine().execute(
+            text(
+                "INSERT INTO public.api_workers (key, host, pid, heartbeat) "
+                "VALUES (:key, 'other', 1, now() - make_interval(secs => :age))"
+            ),
+            key=key,
+            age=age,
+        )
+        self.keys.append(key)
+        # The next worker is offered this key first
+        actions._get_engine().execute(
+            text("SELECT setval('public.api_workers_key_seq', :key, false)"),
+            key=key,
+        )
+
+    def find_worker(self, key):
+        return (
+            actions._get_engine()
+            .execute(
+                text("SELECT host, pid FROM public.api_workers WHERE key = :key"),
+                key=key,
+            )
+            .first()
+        )
+
+
+class TestWorkerRegistration(WorkerTestCase):
+    def test_register(self):
+        worker = self.register()
+        self.assertEqual(
+            tuple(self.find_worker(worker.key)), (socket.gethostname(), os.getpid())
+        )
+        self.assertTrue(worker.owns(worker.key << sessions._RANDOM_BITS))
+        self.assertFalse(worker.owns((worker.key + 1) << sessions._RANDOM_BITS))
+
+    def test_live_worker_keeps_key(self):
+        self.add_worker(1000, 0)
+        worker = self.register()
+        self.assertNotEqual(worker.key, 1000)
+        self.assertEqual(tuple(self.find_worker(1000)), ("other", 1))
+
+    def test_key_of_gone_worker_is_reused(self):
+        self.add_worker(1000, 300)
+        worker = self.register()
+        self.assertEqual(worker.key, 1000)
+        self.assertEqual(
+            tuple(self.find_worker(1000)), (socket.gethostname(), os.getpid())
+        )
+
+    def test_key_taken_over(self):
+        worker = self.register()
+        key = worker.key
+        # Another worker took over the key while this one held no sessions
+        actions._get_engine().execute(
+            text("UPDATE public.api_workers SET pid = 1 WHERE key = :key"), key=key
+        )
+        with mock.patch("time.monotonic", return_value=time.monotonic() + 120):
+            self.assertNotEqual(worker.key, key)
+        self.keys.append(worker.key)
+        self.assertEqual(tuple(self.find_worker(key)), (socket.gethostname(), 1))
+
+
+class TestMisroutedSessions(WorkerTestCase):
+    def assertMissing(self, connection_id, status):
+        with self.assertRaises(APIError) as context:
+            sessions.load_session_from_context({"connection_id": connection_id})
+        self.assertEqual(context.exception.status, status)
+        return context.exception
+
+    def test_closed_session(self):
+        self.keys.append(sessions._WORKER.key)
+        self.assertMissing(sessions._WORKER.key << sessions._RANDOM_BITS | 1, 404)
+
+    def test_session_of_other_worker(self):
+        self.add_worker(2000, 0)
+        error = self.assertMissing(2000 << sessions._RANDOM_BITS | 1, 421)
+        self.assertIn("other", error.message)
+
+        response = self.__class__.client.post(
+            "/api/v0/advanced/cursor/open",
+            data=json.dumps({"connection_id": 2000 << sessions._RANDOM_BITS | 1}),
+            content_type="application/json",
+        )
+        self.assertEqual(response.status_code, 421, response.content)
+
+    def test_session_of_gone_worker(self):
+        self.add_worker(2000, 300)
+        self.assertMissing(2000 << sessions._RANDOM_BITS | 1, 404)
+
+    def test_session_of_unknown_worker(self):
+        self.assertMissing(2001 << sessions._RANDOM_BITS | 1, 404)
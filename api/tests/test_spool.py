@@ -0,0 +1,96 @@
+import os
+import tempfile
+import time
+from unittest import TestCase, mock
+
+from django.core.signals import request_finished
+from django.http import HttpResponse, StreamingHttpResponse
+
+from api import spool
+
+
+def _response(chunks):
+    response = StreamingHttpResponse(iter(chunks), content_type="text/csv")
+    response["Content-Disposition"] = 'attachment; filename="a.csv"'
+    response["X-Next-Token"] = "token"
+    return response
+
+
+class TestSpool(TestCase):
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        patcher = mock.patch.multiple(
+            spool, DIRECTORY=self.directory.name, LOCATION="/spool/", THRESHOLD=10
+        )
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.addCleanup(self.directory.cleanup)
+
+    def files(self):
+        return os.listdir(self.directory.name)
+
+    def assertHeaders(self, response):
+        self.assertEqual(response["Content-Type"], "text/csv")
+        self.assertEqual(
+            response["Content-Disposition"], 'attachment; filename="a.csv"'
+        )
+        self.assertEqual(response["X-Next-Token"], "token")
+
+    def test_large_response(self):
+        closed = mock.Mock()
+        streaming = _response([b"id,name\n", b"1,a\n", b"2,b\n"])
+        streaming._resource_closers.append(closed)
+        finished = mock.Mock()
+        request_finished.connect(finished)
+        self.addCleanup(request_finished.disconnect, finished)
+        response = spool.spool(streaming)
+        self.assertFalse(response.streaming)
+        self.assertEqual(response.content, b"")
+        self.assertHeaders(response)
+        closed.assert_called_once_with()
+        # The request goes on with the new response
+        finished.assert_not_called()
+
+        [name] = self.files()
+        self.assertEqual(response["X-Accel-Redirect"], "/spool/" + name)
+        with open(os.path.join(self.directory.name, name), "rb") as file:
+            self.assertEqual(file.read(), b"id,name\n1,a\n2,b\n")
+
+    def test_small_response(self):
+        response = spool.spool(_response([b"id\n", b"1\n"]))
+        self.assertFalse(response.streaming)
+        self.assertEqual(response.content, b"id\n1\n")
+        self.assertHeaders(response)
+        self.assertNotIn("X-Accel-Redirect", response)
+        self.assertEqual(self.files(), [])
+
+    def test_unchanged(self):
+        response = HttpResponse(b"x" * 100)
+        self.assertIs(spool.spool(response), response)
+        response = _response([b"x" * 100])
+        response.status_code = 400
+        self.assertIs(spool.spool(response), response)
+        with mock.patch.object(spool, "DIRECTORY", None):
+            response = _response([b"x" * 100])
+            self.assertIs(spool.spool(response), response)
+        self.assertEqual(self.files(), [])
+
+    def test_failed_response(self):
+        def chunks():
+            yield b"x" * 100
+            raise ValueError
+
+        with self.assertRaises(ValueError):
+            spool.spool(_response(chunks()))
+        self.assertEqual(self.files(), [])
+
+    def test_prune(self):
+        old = os.path.join(self.directory.name, spool._PREFIX + "old")
+        other = os.path.join(self.directory.name, "other")
+        for path in (old, other):
+            open(path, "wb").close()
+            os.utime(path, (time.time() - spool.TTL - 1,) * 2)
+        spool.spool(_response([b"x" * 100]))
+        self.assertNotIn(spool._PREFIX + "old", self.files())
+        self.assertIn("other", self.files())
+        self.assertEqual(len(self.files()), 2)
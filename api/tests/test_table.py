@@ -1,6 +1,9 @@
 import json
 
+import sqlalchemy as sa
+
 from api import actions
+from api.cache import invalidate_table
 from api.tests import APITestCase
 
 _TYPES = [
@@ -458,3 +461,174 @@ class TestDelete(APITestCase):
             content_type="application/json",
         )
         self.assertEqual(response.status_code, 403)
+
+
+# The information_schema queries describe_columns, describe_indexes and
+# describe_constraints used before describe_table
+_INFORMATION_SCHEMA_COLUMNS = sa.text(
+    "SELECT c.column_name, c.ordinal_position, c.column_default, c.is_nullable, "
+    "c.data_type, c.character_maximum_length, c.character_octet_length, "
+    "c.numeric_precision, c.numeric_precision_radix, c.numeric_scale, "
+    "c.datetime_precision, c.interval_type, c.interval_precision, "
+    "c.maximum_cardinality, c.dtd_identifier, c.udt_name, c.is_updatable, "
+    "e.data_type AS element_type "
+    "FROM information_schema.columns AS c "
+    "LEFT JOIN information_schema.element_types AS e "
+    "ON ((c.table_catalog, c.table_schema, c.table_name, 'TABLE', c.dtd_identifier) "
+    "= (e.object_catalog, e.object_schema, e.object_name, e.object_type, "
+    "e.collection_type_identifier)) "
+    "WHERE c.table_name = :table AND c.table_schema = :schema"
+)
+
+_INFORMATION_SCHEMA_INDEXES = sa.text(
+    "SELECT indexname, indexdef FROM pg_indexes "
+    "WHERE tablename = :table AND schemaname = :schema"
+)
+
+_INFORMATION_SCHEMA_CONSTRAINTS = sa.text(
+    "SELECT constraint_name, constraint_type, is_deferrable, initially_deferred, "
+    "pg_get_constraintdef(c.oid) AS definition "
+    "FROM information_schema.table_constraints AS t "
+    "JOIN pg_constraint AS c ON c.conname = t.constraint_name "
+    "AND c.conrelid = CAST(quote_ident(t.table_schema) || '.' "
+    "|| quote_ident(t.table_name) AS regclass) "
+    "WHERE t.table_name = :table AND t.constraint_schema = :schema"
+)
+
+
+def _data_type(column):
+    if column.data_type == "ARRAY":
+        return column.element_type + "[]"
+    if column.data_type == "USER-DEFINED":
+        return column.udt_name
+    return column.data_type
+
+
+def _describe_by_information_schema(schema, table):
+    engine = actions._get_engine()
+    columns = engine.execute(_INFORMATION_SCHEMA_COLUMNS, schema=schema, table=table)
+    indexes = engine.execute(_INFORMATION_SCHEMA_INDEXES, schema=schema, table=table)
+    constraints = engine.execute(
+        _INFORMATION_SCHEMA_CONSTRAINTS, schema=schema, table=table
+    )
+    return {
+        "columns": {
+            c.column_name: {
+                "ordinal_position": c.ordinal_position,
+                "column_default": c.column_default,
+                "is_nullable": c.is_nullable == "YES",
+                "data_type": _data_type(c),
+                "character_maximum_length": c.character_maximum_length,
+                "character_octet_length": c.character_octet_length,
+                "numeric_precision": c.numeric_precision,
+                "numeric_precision_radix": c.numeric_precision_radix,
+                "numeric_scale": c.numeric_scale,
+                "datetime_precision": c.datetime_precision,
+                "interval_type": c.interval_type,
+                "interval_precision": c.interval_precision,
+                "maximum_cardinality": c.maximum_cardinality,
+                "dtd_identifier": c.dtd_identifier,
+                "is_updatable": c.is_updatable == "YES",
+            }
+            for c in columns
+        },
+        "indexes": {i.indexname: {"indexdef": i.indexdef} for i in indexes},
+        "constraints": {
+            c.constraint_name: {
+                "constraint_type": c.constraint_type,
+                "is_deferrable": c.is_deferrable,
+                "initially_deferred": c.initially_deferred,
+                "definition": c.definition,
+            }
+            for c in constraints
+        },
+    }
+
+
+class TestDescribe(APITestCase):
+    tables = ("describe_parent", "describe_child", "describe_no_pk")
+
+    def setUp(self):
+        for statement in (
+            "CREATE DOMAIN {schema}.positive AS integer CHECK (VALUE > 0)",
+            "CREATE TABLE {schema}.describe_parent (id bigserial PRIMARY KEY)",
+            "CREATE TABLE {schema}.describe_child ("
+            "id bigserial PRIMARY KEY, "
+            "parent bigint REFERENCES {schema}.describe_parent (id) "
+            "DEFERRABLE INITIALLY DEFERRED, "
+            "name character varying(50) NOT NULL DEFAULT 'unnamed', "
+            "code character(3) UNIQUE, "
+            "amount numeric(10, 2) CHECK (amount >= 0), "
+            "ratio double precision, "
+            "flags boolean[], "
+            "labels character varying(20)[], "
+            "created timestamp with time zone DEFAULT now(), "
+            "duration interval hour to minute, "
+            "count {schema}.positive, "
+            "geom geometry(Point, 4326), "
+            "data jsonb)",
+            "CREATE INDEX describe_child_name ON {schema}.describe_child (name)",
+            "CREATE TABLE {schema}.describe_no_pk (value integer, note text)",
+        ):
+            actions.perform_sql(statement.format(schema=self.test_schema))
+
+    def tearDown(self):
+        for table in reversed(self.tables):
+            actions.perform_sql(
+                "DROP TABLE IF EXISTS {schema}.{table}".format(
+                    schema=self.test_schema, table=table
+                )
+            )
+            invalidate_table(self.test_schema, table)
+        actions.perform_sql(
+            "DROP DOMAIN IF EXISTS {schema}.positive".format(schema=self.test_schema)
+        )
+
+    def test_matches_information_schema(self):
+        for table in self.tables:
+            expected = _describe_by_information_schema(self.test_schema, table)
+            self.assertEqual(
+                actions.describe_columns(self.test_schema, table), expected["columns"]
+            )
+            self.assertEqual(
+                actions.describe_indexes(self.test_schema, table), expected["indexes"]
+            )
+            self.assertEqual(
+                actions.describe_constraints(self.test_schema, table),
+                expected["constraints"],
+            )
+
+    def test_child(self):
+        description = actions.describe_table(self.test_schema, "describe_child")
+        columns = description["columns"]
+        self.assertEqual(
+            columns["name"]["column_default"], "'unnamed'::character varying"
+        )
+        self.assertFalse(columns["name"]["is_nullable"])
+        self.assertEqual(columns["name"]["character_maximum_length"], 50)
+        self.assertEqual(columns["amount"]["numeric_precision"], 10)
+        self.assertEqual(columns["amount"]["numeric_scale"], 2)
+        self.assertEqual(columns["flags"]["data_type"], "boolean[]")
+        self.assertEqual(columns["labels"]["data_type"], "character varying[]")
+        self.assertEqual(columns["count"]["data_type"], "integer")
+        self.assertEqual(columns["geom"]["data_type"], "geometry")
+        constraints = description["constraints"]
+        self.assertEqual(
+            {name: c["constraint_type"] for name, c in constraints.items()},
+            {
+                "describe_child_pkey": "PRIMARY KEY",
+                "describe_child_parent_fkey": "FOREIGN KEY",
+                "describe_child_code_key": "UNIQUE",
+                "describe_child_amount_check": "CHECK",
+            },
+        )
+        self.assertEqual(
+            constraints["describe_child_parent_fkey"]["initially_deferred"], "YES"
+        )
+        self.assertIn("describe_child_name", description["indexes"])
+
+    def test_without_primary_key(self):
+        description = actions.describe_table(self.test_schema, "describe_no_pk")
+        self.assertEqual(list(description["columns"]), ["value", "note"])
+        self.assertEqual(description["indexes"], {})
+        self.assertEqual(description["constraints"], {})
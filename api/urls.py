@@ -45,6 +45,7 @@ urlpatterns = [
             actions.data_search, allow_cors=True, requires_cursor=True
         ),
     ),
+    url(r"^v0/advanced/batch", views.create_ajax_handler(actions.batch)),
     url(
         r"^v0/advanced/insert",
         views.create_ajax_handler(actions.data_insert, requires_cursor=True),
@@ -119,7 +120,7 @@ urlpatterns = [
     url(
         r"^v0/advanced/cursor/fetch_many",
         views.FetchView.as_view(),
-        dict(fetchtype="all"),
+        dict(fetchtype="many"),
     ),
     url(
         r"^v0/advanced/cursor/fetch_all",
@@ -158,6 +159,7 @@ urlpatterns = [
         r"^v0/advanced/show_revisions",
         views.create_ajax_handler(actions.get_unique_constraints),
     ),
+    url(r"^metrics$", views.metrics_view),
     url(r"usrprop/", views.get_users),
     url(r"grpprop/", views.get_groups),
 ]
@@ -1,8 +1,12 @@
-import csv
+import base64
+import hashlib
 import itertools
 import json
 import logging
+import queue
 import re
+import tempfile
+import threading
 import time
 import psycopg2
 
@@ -13,28 +17,41 @@ import sqlalchemy as sqla
 from django.contrib.auth.mixins import LoginRequiredMixin
 from django.core.exceptions import PermissionDenied
 from django.db.models import Q
-from django.http import Http404, HttpResponse, JsonResponse, StreamingHttpResponse
+from django.http import (
+    FileResponse,
+    Http404,
+    HttpResponse,
+    JsonResponse,
+    StreamingHttpResponse,
+)
+from django.utils.decorators import method_decorator
 from django.views.decorators.csrf import csrf_exempt
+from django.views.decorators.http import condition
 from django.views.generic import View
 from omi.dialects.oep.compiler import JSONCompiler
 from omi.dialects.oep.parser import JSONParser_1_4 as OmiParser
 from rest_framework import status
 from rest_framework.views import APIView
 
+import api.parquet
 import api.parser
 import login.models as login_models
-from api import actions, parser, sessions
-from api.encode import Echo, GeneratorJSONEncoder
+from api import actions, metrics, parser, sessions, spool
+from api.connection import set_pool_user
+from api.encode import CHUNK_SIZE, ChunkedJSONEncoder
 from api.error import APIError
 from api.helpers.http import ModHttpResponse
 from dataedit.models import Table as DBTable
 from dataedit.views import load_metadata_from_db, save_metadata_as_table_comment
+import oeplatform.securitysettings as sec
 from oeplatform.securitysettings import PLAYGROUNDS, UNVERSIONED_SCHEMAS
 
 import json
 
 logger = logging.getLogger("oeplatform")
 
+NDJSON_CONTENT_TYPE = "application/x-ndjson"
+
 WHERE_EXPRESSION = re.compile(
     "^(?P<first>[\w\d_\.]+)\s*(?P<operator>"
     + "|".join(parser.sql_operators)
@@ -42,11 +59,172 @@ WHERE_EXPRESSION = re.compile(
 )
 
 
+def fetch_batches(cursor, size=None):
+    """
+    Fetches the remaining rows of `cursor` in batches of `size` rows (default:
+    the cursor's itersize) and translates each batch as a unit.
+    """
+    if size is None:
+        size = getattr(cursor, "itersize", 2000)
+    while True:
+        rows = cursor.fetchmany(size)
+        if not rows:
+            return
+        metrics.ROWS_STREAMED.inc(len(rows))
+        yield actions._translate_fetched_rows(rows, cursor.description)
+
+
+def count_rows(batches):
+    """Passes batches of rows through and counts their rows as streamed"""
+    for rows in batches:
+        metrics.ROWS_STREAMED.inc(len(rows))
+        yield rows
+
+
+def encode_page_token(key, values):
+    """
+    Encodes the position after a row as an opaque token for keyset pagination.
+
+    :param key: Names of the columns the rows are ordered by
+    :param values: Values of these columns in the last row of a page
+    :return: The token as URL-safe string
+    """
+    token = json.dumps([key, values], default=str, separators=(",", ":"))
+    return base64.urlsafe_b64encode(token.encode("utf-8")).decode("ascii")
+
+
+def decode_page_token(token, key):
+    """
+    Inverse of :func:`encode_page_token`. Raises an :class:`APIError` if the
+    token is malformed or was issued for a different order.
+
+    :return: The values of the key columns
+    """
+    try:
+        token_key, values = json.loads(base64.urlsafe_b64decode(token.encode("ascii")))
+    except (TypeError, ValueError):
+        raise APIError("Invalid pagination token")
+    if token_key != key or not isinstance(values, list) or len(values) != len(key):
+        raise APIError("Pagination token does not match this query")
+    return values
+
+
+class _Failure:
+    def __init__(self, exception):
+        self.exception = exception
+
+
+class _Stopped(Exception):
+    """Raised in a producer thread once its consumer has stopped listening"""
+
+
+def produce_in_background(produce, depth=1):
+    """
+    Runs `produce` in a background thread and yields everything it passes to
+    the `put` callable it is called with. The producer stays up to `depth`
+    items ahead of the caller; errors are re-raised in the caller.
+    """
+    items = queue.Queue(maxsize=depth)
+    stopped = threading.Event()
+    done = object()
+
+    def put(item):
+        # Give up if the caller stopped listening, e.g. because the client
+        # closed the connection.
+        while not stopped.is_set():
+            try:
+                items.put(item, timeout=1)
+                return
+            except queue.Full:
+                pass
+        raise _Stopped()
+
+    def run():
+        try:
+            produce(put)
+            put(done)
+        except _Stopped:
+            pass
+        except Exception as e:
+            try:
+                put(_Failure(e))
+            except _Stopped:
+                pass
+
+    producer = threading.Thread(target=run, daemon=True)
+    producer.start()
+    try:
+        while True:
+            item = items.get()
+            if item is done:
+                break
+            if isinstance(item, _Failure):
+                raise item.exception
+            yield item
+    finally:
+        stopped.set()
+        producer.join()
+
+
+def prefetch(iterable, depth=1):
+    """
+    Consumes `iterable` in a background thread that stays up to `depth` items
+    ahead of the caller. This way, the next batch is fetched from the database
+    while the current one is encoded.
+    """
+
+    def produce(put):
+        for item in iterable:
+            put(item)
+
+    return produce_in_background(produce, depth=depth)
+
+
+class _ChunkWriter:
+    """
+    Binary file-like object that collects the small writes of ``copy_expert``
+    into chunks of about `size` bytes and passes them to `emit`.
+    """
+
+    def __init__(self, emit, size=CHUNK_SIZE):
+        self.emit = emit
+        self.size = size
+        self.parts = []
+        self.length = 0
+
+    def write(self, data):
+        self.parts.append(data)
+        self.length += len(data)
+        if self.length >= self.size:
+            self.flush()
+
+    def flush(self):
+        if self.parts:
+            data = b"".join(self.parts)
+            self.parts = []
+            self.length = 0
+            self.emit(data)
+
+
+def copy_chunks(query, cursor, depth=4):
+    """
+    Streams the result of `query` as CSV produced by ``COPY ... TO STDOUT``
+    (see :func:`api.actions._copy_sqla`) in chunks of about
+    :data:`api.encode.CHUNK_SIZE` bytes.
+    """
+
+    def produce(put):
+        writer = _ChunkWriter(put)
+        actions._copy_sqla(query, cursor, writer)
+        writer.flush()
+
+    return produce_in_background(produce, depth=depth)
+
+
 def transform_results(cursor, triggers, trigger_args):
-    row = cursor.fetchone() if not cursor.closed else None
-    while row is not None:
-        yield list(map(actions._translate_fetched_cell, row))
-        row = cursor.fetchone()
+    if not cursor.closed:
+        for batch in prefetch(fetch_batches(cursor)):
+            yield from batch
     for t, targs in zip(triggers, trigger_args):
         t(*targs)
 
@@ -56,10 +234,20 @@ class OEPStream(StreamingHttpResponse):
     def __init__(self, *args, session=None, **kwargs):
         self.session = session
         super(OEPStream, self).__init__(*args, **kwargs)
+        self._resource_closers.append(self._close_session)
 
-    def __del__(self):
+    def __iter__(self):
+        for chunk in super(OEPStream, self).__iter__():
+            metrics.BYTES_STREAMED.inc(len(chunk))
+            yield chunk
+
+    def _close_session(self):
         if self.session:
             self.session.close()
+            self.session = None
+
+    def __del__(self):
+        self._close_session()
 
 
 def load_cursor(named=False):
@@ -113,8 +301,11 @@ def load_cursor(named=False):
                         except psycopg2.errors.InvalidCursorName as e:
                             print(e)
                     if first:
-                        first = map(actions._translate_fetched_cell, first)
+                        metrics.ROWS_STREAMED.inc()
                         if cursor.description:
+                            first = actions._translate_fetched_rows(
+                                [first], cursor.description
+                            )[0]
                             description = [
                                 [
                                     col.name,
@@ -163,16 +354,56 @@ def cors(allow):
 
 def api_exception(f):
     def wrapper(*args, **kwargs):
+        # Connections are queued fairly between the users of concurrent requests
+        set_pool_user(getattr(args[1], "user", None))
         try:
-            return f(*args, **kwargs)
+            with sessions.hold_sessions():
+                return f(*args, **kwargs)
         except actions.APIError as e:
             return JsonResponse({"reason": e.message}, status=e.status)
         except KeyError as e:
             return JsonResponse({"reason": e}, status=400)
+        except sqla.exc.TimeoutError:
+            return JsonResponse(
+                {"reason": "The database is busy. Please try again later."},
+                status=503,
+            )
+        finally:
+            set_pool_user(None)
 
     return wrapper
 
 
+def _table_version(request, schema, table):
+    # ETag and Last-Modified are derived from the same version, so it is
+    # loaded only once per request.
+    if not hasattr(request, "table_version"):
+        request.table_version = actions.get_table_version(schema, table)
+    return request.table_version
+
+
+def _table_etag(request, schema, table, *args, **kwargs):
+    version, _ = _table_version(request, schema, table)
+    if not version:
+        # Changes of tables whose versions are not tracked go unnoticed
+        return None
+    # Responses of the same URL differ in format depending on the Accept header
+    accept = hashlib.md5(request.META.get("HTTP_ACCEPT", "").encode("utf-8"))
+    return "{version}-{accept}".format(version=version, accept=accept.hexdigest()[:8])
+
+
+def _table_last_modified(request, schema, table, *args, **kwargs):
+    return _table_version(request, schema, table)[1]
+
+
+# Answers conditional GET requests on a table with 304 Not Modified as long as
+# its version (see api.actions.bump_table_version) has not changed. Apply it
+# below api_exception, which also handles errors while loading the version.
+table_condition = method_decorator(
+    condition(etag_func=_table_etag, last_modified_func=_table_last_modified)
+)
+
+
 def permission_wrapper(permission, f):
     def wrapper(caller, request, *args, **kwargs):
         schema = kwargs.get("schema", actions.DEFAULT_SCHEMA)
@@ -238,6 +469,7 @@ class Sequence(APIView):
 class Metadata(APIView):
 
     @api_exception
+    @table_condition
     def get(self, request, schema, table):
         table_obj = actions._get_table(schema=schema, table=table)
         comment = table_obj.comment
@@ -253,7 +485,9 @@ class Metadata(APIView):
         metadata, error = actions.try_parse_metadata(raw_input)
         if metadata is not None:
             compiler = JSONCompiler()
-            table_obj.comment = json.dumps(compiler.visit(metadata))
+            # The table object is shared by the reflection cache, so the new
+            # comment must not be written to it directly.
+            comment = json.dumps(compiler.visit(metadata))
             cursor = actions.load_cursor_from_context(request.data)
             # Surprisingly, SQLAlchemy does not seem to escape comment strings
             # properly. Certain strings cause errors database errors.
@@ -262,7 +496,8 @@ class Metadata(APIView):
             sql = "COMMENT ON TABLE {schema}.{table} IS %s".format(
                 schema=table_obj.schema,
                 table=table_obj.name)
-            cursor.execute(sql, (table_obj.comment, ))
+            cursor.execute(sql, (comment, ))
+            actions.table_changed(schema, table, cursor)
             return JsonResponse(raw_input)
         else:
             raise APIError(error)
@@ -273,6 +508,7 @@ class Table(APIView):
     """
 
     @api_exception
+    @table_condition
     def get(self, request, schema, table):
         """
         Returns a dictionary that describes the DDL-make-up of this table.
@@ -291,13 +527,16 @@ class Table(APIView):
 
         schema, table = actions.get_table_name(schema, table, restrict_schemas=False)
 
+        version, _ = _table_version(request, schema, table)
+        description = actions.describe_table(schema, table, version)
+
         return JsonResponse(
             {
                 "schema": schema,
                 "name": table,
-                "columns": actions.describe_columns(schema, table),
-                "indexed": actions.describe_indexes(schema, table),
-                "constraints": actions.describe_constraints(schema, table),
+                "columns": description["columns"],
+                "indexed": description["indexes"],
+                "constraints": description["constraints"],
             }
         )
 
@@ -454,6 +693,10 @@ class Table(APIView):
         actions._get_engine().execute(
             "DROP TABLE {schema}.{table} CASCADE;".format(schema=schema, table=table)
         )
+        actions.CATALOG.discard_table(schema, table)
+        # The version is kept, so a new table of the same name does not
+        # reuse the ETags of this one.
+        actions.table_changed(schema, table)
 
         return JsonResponse({}, status=status.HTTP_200_OK)
 
@@ -471,9 +714,11 @@ class Index(APIView):
 
 class Column(APIView):
     @api_exception
+    @table_condition
     def get(self, request, schema, table, column=None):
         schema, table = actions.get_table_name(schema, table, restrict_schemas=False)
-        response = actions.describe_columns(schema, table)
+        version, _ = _table_version(request, schema, table)
+        response = actions.describe_table(schema, table, version)["columns"]
         if column:
             try:
                 response = response[column]
@@ -535,6 +780,7 @@ def build_csv(header, result_iterator):
 
 class Rows(APIView):
     @api_exception
+    @table_condition
     def get(self, request, schema, table, row_id=None):
         schema, table = actions.get_table_name(schema, table, restrict_schemas=False)
         columns = request.GET.getlist("column")
@@ -604,6 +850,38 @@ class Rows(APIView):
             "offset": offset,
         }
 
+        # Keyset pagination: Pages are selected by the key of the last row of
+        # the previous page (encoded in the token) instead of an offset.
+        after = request.GET.get("after")
+        page_key = None
+        hidden = []
+        if after is not None:
+            if row_id or offset:
+                raise actions.APIError(
+                    "Pagination tokens are not allowed together with a row id or "
+                    "an offset"
+                )
+            if not limit:
+                raise actions.APIError("Pagination tokens require a limit")
+            if format in ("csv", "parquet"):
+                raise actions.APIError(
+                    "Pagination tokens are not supported for %s files" % format
+                )
+            page_key = self.__page_key(schema, table, orderby)
+            if columns:
+                # Key columns are always fetched to build the next token, but
+                # only returned if they were requested
+                hidden = [c for c in page_key if c not in columns]
+                data["columns"] = columns + hidden
+            data["orderby"] = page_key
+            if after:
+                data["after"] = (page_key, decode_page_token(after, page_key))
+
+        if format == "csv":
+            return spool.spool(self.__get_csv(request, data))
+        if format == "parquet":
+            return spool.spool(self.__get_parquet(request, data))
+
         return_obj = self.__get_rows(request, data)
         session = sessions.load_session_from_context(return_obj.pop("context")) if "context" in return_obj else None
         # Extract column names from description
@@ -613,36 +891,35 @@ class Rows(APIView):
             cols = []
             return_obj["data"] = []
             return_obj["rowcount"] = 0
-        if format == "csv":
-            pseudo_buffer = Echo()
-            writer = csv.writer(pseudo_buffer, quoting=csv.QUOTE_ALL)
-
-            response = OEPStream(
-                (
-                    writer.writerow(x)
-                    for x in itertools.chain([cols], return_obj["data"])
-                ),
-                content_type="text/csv",
-                session=session,
-            )
-            response[
-                "Content-Disposition"
-            ] = 'attachment; filename="{schema}__{table}.csv"'.format(
-                schema=schema, table=table
-            )
-            return response
-
+        if row_id:
+            dict_list = [dict(zip(cols, row)) for row in return_obj["data"]]
+            if dict_list:
+                dict_list = dict_list[0]
+            else:
+                raise Http404
+            # TODO: Figure out what JsonResponse does different.
+            return JsonResponse(dict_list, safe=False)
+
+        rows = return_obj["data"]
+        next_token = None
+        if page_key is not None:
+            # A page is bounded by its limit, so it can be held in memory.
+            rows = list(rows)
+            if rows and len(rows) == int(limit):
+                last = dict(zip(cols, rows[-1]))
+                next_token = encode_page_token(page_key, [last[c] for c in page_key])
+            if hidden:
+                visible = [i for i, c in enumerate(cols) if c not in hidden]
+                cols = [cols[i] for i in visible]
+                rows = [[row[i] for i in visible] for row in rows]
+
+        if wants_ndjson(request):
+            response = stream_lines((dict(zip(cols, row)) for row in rows), session=session)
         else:
-            if row_id:
-                dict_list = [dict(zip(cols, row)) for row in return_obj["data"]]
-                if dict_list:
-                    dict_list = dict_list[0]
-                else:
-                    raise Http404
-                # TODO: Figure out what JsonResponse does different.
-                return JsonResponse(dict_list, safe=False)
-
-            return stream((dict(zip(cols, row)) for row in return_obj["data"]), session=session)
+            response = stream((dict(zip(cols, row)) for row in rows), session=session)
+        if next_token:
+            response["X-Next-Token"] = next_token
+        return spool.spool(response)
 
     @api_exception
     @require_write_permission
@@ -788,6 +1065,8 @@ class Rows(APIView):
 
         if not row_id:
             query["returning"] = [{"type": "column", "column": "id"}]
+        if "bulk" in request.GET:
+            query["bulk"] = request.GET["bulk"]
         result = actions.data_insert(query, context)
 
         return result
@@ -823,17 +1102,120 @@ class Rows(APIView):
 
         return actions.data_update(query, context)
 
+    def __page_key(self, schema, table, orderby):
+        table_obj = actions._get_table(schema, table)
+        primary_key = [c.name for c in table_obj.primary_key.columns]
+        key = list(orderby) + [c for c in primary_key if c not in orderby]
+        if not key:
+            raise actions.APIError(
+                "Pagination tokens require an order by clause or a primary key"
+            )
+        for name in key:
+            if name not in primary_key and actions.get_column_obj(table_obj, name).nullable:
+                raise actions.APIError(
+                    "Column '%s' may be NULL and cannot be used for pagination" % name
+                )
+        return key
+
+    def __get_csv(self, request, data):
+        query = self.__rows_query(data)
+        context = {"user": request.user}
+        context.update(actions.open_raw_connection({}, context))
+        try:
+            context.update(actions.open_cursor({}, context))
+            session = sessions.load_session_from_context(context)
+            chunks = copy_chunks(query, sessions.load_cursor_from_context(context))
+            # The first chunk holds at least the header. Fetching it here
+            # reports errors in the query as such instead of sending a
+            # truncated file.
+            first = next(chunks, b"")
+        except:
+            actions.close_raw_connection({}, context)
+            raise
+
+        def content():
+            try:
+                yield first
+                yield from chunks
+            finally:
+                actions.close_cursor({}, context)
+                actions.close_raw_connection({}, context)
+
+        response = OEPStream(content(), content_type="text/csv", session=session)
+        response[
+            "Content-Disposition"
+        ] = 'attachment; filename="{schema}__{table}.csv"'.format(
+            schema=data["schema"], table=data["table"]
+        )
+        return response
+
+    def __get_parquet(self, request, data):
+        description = actions.describe_columns(data["schema"], data["table"])
+        query = self.__rows_query(
+            data,
+            wkb_columns={
+                name
+                for name, column in description.items()
+                if column["data_type"] in ("geometry", "geography")
+            },
+        )
+        names = data["columns"] or sorted(
+            description, key=lambda c: description[c]["ordinal_position"]
+        )
+        columns = [description[name] for name in names]
+
+        # Parquet files are spooled to disk first, so only one batch of rows
+        # is held in memory at a time.
+        file = tempfile.TemporaryFile()
+        context = {"user": request.user}
+        context.update(actions.open_raw_connection({}, context))
+        try:
+            context.update(actions.open_cursor({}, context, named=True))
+            cursor = sessions.load_cursor_from_context(context)
+            actions._execute_sqla(query, cursor)
+            batches = iter(lambda: cursor.fetchmany(api.parquet.ROW_GROUP_SIZE), [])
+            api.parquet.write_parquet(
+                file, names, columns, prefetch(count_rows(batches))
+            )
+        except:
+            file.close()
+            raise
+        finally:
+            actions.close_raw_connection({}, context)
+
+        file.seek(0)
+        return FileResponse(
+            file,
+            as_attachment=True,
+            filename="{schema}__{table}.parquet".format(
+                schema=data["schema"], table=data["table"]
+            ),
+            content_type=api.parquet.CONTENT_TYPE,
+        )
+
     @load_cursor(named=True)
     def __get_rows(self, request, data):
+        query = self.__rows_query(data)
+        cursor = sessions.load_cursor_from_context(request.data)
+        actions._execute_sqla(query, cursor)
+
+    def __rows_query(self, data, wkb_columns=()):
         table = actions._get_table(data["schema"], table=data["table"])
         params = {}
         params_count = 0
         columns = data.get("columns")
 
-        if not columns:
+        if not columns and not wkb_columns:
             query = table.select()
         else:
-            columns = [actions.get_column_obj(table, c) for c in columns]
+            if columns:
+                columns = [actions.get_column_obj(table, c) for c in columns]
+            else:
+                columns = list(table.columns)
+            columns = [
+                sqla.func.ST_AsBinary(c).label(c.name) if c.name in wkb_columns else c
+                for c in columns
+            ]
             query = sqla.select(columns=columns)
 
         where_clauses = data.get("where")
@@ -841,6 +1223,14 @@ class Rows(APIView):
         if where_clauses:
             query = query.where(parser.parse_condition(where_clauses))
 
+        after = data.get("after")
+        if after:
+            key, values = after
+            query = query.where(
+                sqla.tuple_(*[actions.get_column_obj(table, c) for c in key])
+                > sqla.tuple_(*values)
+            )
+
         orderby = data.get("orderby")
         if orderby:
             if isinstance(orderby, list):
@@ -858,8 +1248,7 @@ class Rows(APIView):
         if offset and offset.isdigit():
             query = query.offset(int(offset))
 
-        cursor = sessions.load_cursor_from_context(request.data)
-        actions._execute_sqla(query, cursor)
+        return query
 
 class Session(APIView):
     def get(self, request, length=1):
@@ -904,6 +1293,15 @@ def create_ajax_handler(func, allow_cors=False, requires_cursor=False):
         def post(self, request):
             result = self.execute(request)
             session = sessions.load_session_from_context(result.pop("context")) if "context" in result else None
+            if wants_ndjson(request):
+                # The first line holds everything but the rows, which follow
+                # as one array per line.
+                rows = result.pop("data", [])
+                return stream_lines(
+                    itertools.chain([result], rows),
+                    allow_cors=allow_cors and request.user.is_anonymous,
+                    session=session,
+                )
             return stream(result, allow_cors=allow_cors and request.user.is_anonymous, session=session)
 
         def execute(self, request):
@@ -950,39 +1348,63 @@ def create_ajax_handler(func, allow_cors=False, requires_cursor=False):
 
 
 class FetchView(APIView):
+    """
+    Streams rows of a cursor of the advanced API. By default, each row is
+    written as a JSON array on a line of its own. With `compact`, the first
+    line holds the column names and each following line an array of the
+    rows of one batch.
+    """
+
     @api_exception
     def post(self, request, fetchtype):
-        if fetchtype == "all":
-            return self.do_fetch(request, actions.fetchall)
-        elif fetchtype == "many":
-            return self.do_fetch(request, actions.fetchmany)
-        else:
-            raise APIError("Unknown fetchtype: %s" % fetchtype)
-
-    def do_fetch(self, request, fetch):
         context = {
             "connection_id": actions.get_or_403(request.data, "connection_id"),
             "cursor_id": actions.get_or_403(request.data, "cursor_id"),
             "user": request.user,
         }
-        return OEPStream(
-            (
-                part
-                for row in fetch(context)
-                for part in (self.transform_row(row), "\n")
-            ),
-            content_type="application/json",
+        if fetchtype == "all":
+            batches = actions.fetchall(context)
+        elif fetchtype == "many":
+            batches = iter([actions.fetchmany(request.data, context)])
+        else:
+            raise APIError("Unknown fetchtype: %s" % fetchtype)
+        cursor = actions.load_cursor_from_context(context)
+        compact = parser.read_bool(request.data.get("compact", False))
+        return self.do_fetch(cursor, batches, compact)
+
+    def do_fetch(self, cursor, batches, compact=False):
+        # The first batch is fetched before the response is started, so
+        # errors are reported as such and the description of server-side
+        # cursors is known.
+        first = next(batches, [])
+        return spool.spool(
+            OEPStream(
+                self.transform_batches(
+                    cursor, itertools.chain([first], batches), compact
+                ),
+                content_type="application/json",
+            )
         )
 
-    def transform_row(self, row):
-        return json.dumps(
-            [actions._translate_fetched_cell(cell) for cell in row],
-            default=date_handler,
-        )
+    def transform_batches(self, cursor, batches, compact):
+        if compact:
+            names = [col.name for col in cursor.description or []]
+            yield json.dumps({"columns": names}) + "\n"
+        for rows in batches:
+            if not rows:
+                continue
+            metrics.ROWS_STREAMED.inc(len(rows))
+            rows = actions._translate_fetched_rows(rows, cursor.description)
+            if compact:
+                yield json.dumps(rows, default=date_handler) + "\n"
+            else:
+                yield "".join(
+                    json.dumps(row, default=date_handler) + "\n" for row in rows
+                )
 
 
 def stream(data, allow_cors=False, status_code=status.HTTP_200_OK, session=None):
-    encoder = GeneratorJSONEncoder()
+    encoder = ChunkedJSONEncoder()
     response = OEPStream(
         encoder.iterencode(data), content_type="application/json", status=status_code, session=session,
     )
@@ -991,12 +1413,59 @@ def stream(data, allow_cors=False, status_code=status.HTTP_200_OK, session=None)
     return response
 
 
+def wants_ndjson(request):
+    """
+    Returns whether the client asked for newline-delimited JSON, either by
+    `form=ndjson` or by its Accept header.
+    """
+    return request.GET.get("form") == "ndjson" or NDJSON_CONTENT_TYPE in request.META.get(
+        "HTTP_ACCEPT", ""
+    )
+
+
+def stream_lines(items, allow_cors=False, status_code=status.HTTP_200_OK, session=None):
+    """
+    Like :func:`stream` but writes each of `items` as a compact JSON value on
+    a line of its own (newline-delimited JSON).
+    """
+    encoder = ChunkedJSONEncoder(separators=(",", ":"))
+    response = OEPStream(
+        encoder.iterencode_lines(items), content_type=NDJSON_CONTENT_TYPE, status=status_code, session=session,
+    )
+    if allow_cors:
+        response["Access-Control-Allow-Origin"] = "*"
+    return response
+
+
 class CloseAll(LoginRequiredMixin, APIView):
     def get(self, request):
         sessions.close_all_for_user(request.user)
         return HttpResponse("All connections closed")
 
 
+def _client_address(request):
+    """
+    :return: The address of the client. Behind METRICS_NUM_PROXIES reverse
+        proxies, it is taken from the X-Forwarded-For header they append to.
+    """
+    num_proxies = getattr(sec, "METRICS_NUM_PROXIES", 0)
+    forwarded = request.META.get("HTTP_X_FORWARDED_FOR")
+    if num_proxies and forwarded:
+        addresses = [a.strip() for a in forwarded.split(",")]
+        return addresses[-min(num_proxies, len(addresses))]
+    return request.META.get("REMOTE_ADDR")
+
+
+def metrics_view(request):
+    """Metrics of all worker processes in the Prometheus text format"""
+    allowed = getattr(sec, "METRICS_ALLOWED_IPS", None) or ()
+    if _client_address(request) not in allowed:
+        raise PermissionDenied
+    return HttpResponse(
+        metrics.render(), content_type="text/plain; version=0.0.4; charset=utf-8"
+    )
+
+
 def get_users(request):
     string = request.GET["name"]
     users = login_models.myuser.objects.filter(
@@ -84,3 +84,28 @@ class MetaSearch(Base):
     schema = Column("schema", String(100), primary_key=True)
     table = Column("table", String(100), primary_key=True)
     comment = Column("comment", TSVECTOR)
+
+
+class TableVersion(Base):
+    __table_args__ = {"schema": "public"}
+    __tablename__ = "table_versions"
+    schema = Column("schema", String(100), primary_key=True)
+    table = Column("table", String(100), primary_key=True)
+    version = Column("version", BigInteger, nullable=False, server_default="0")
+    modified = Column(
+        "modified", DateTime(timezone=True), nullable=False, server_default=func.now()
+    )
+
+
+class APIWorker(Base):
+    __table_args__ = {"schema": "public"}
+    __tablename__ = "api_workers"
+    key = Column("key", Integer, primary_key=True, autoincrement=False)
+    host = Column("host", String(255), nullable=False)
+    pid = Column("pid", Integer, nullable=False)
+    started = Column(
+        "started", DateTime(timezone=True), nullable=False, server_default=func.now()
+    )
+    heartbeat = Column(
+        "heartbeat", DateTime(timezone=True), nullable=False, server_default=func.now()
+    )
@@ -1147,6 +1147,7 @@ def save_metadata_as_table_comment(schema, table, metadata):
         raise e
     else:
         trans.commit()
+        actions.table_changed(schema, table)
     finally:
         conn.close()
 
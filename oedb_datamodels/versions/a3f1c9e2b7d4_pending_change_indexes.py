@@ -0,0 +1,58 @@
+"""Add partial indexes on pending changes of meta tables
+
+Revision ID: a3f1c9e2b7d4
+Revises: 7dd42bf4925b
+Create Date: 2026-10-17 09:12:31.218503
+
+"""
+import hashlib
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'a3f1c9e2b7d4'
+down_revision = '7dd42bf4925b'
+branch_labels = None
+depends_on = None
+
+
+def _index_name(meta_table):
+    # Same naming as api.actions.get_pending_index_name
+    digest = hashlib.md5(meta_table.encode("utf-8")).hexdigest()[:8]
+    return "{table}_pending_{digest}".format(table=meta_table[:40], digest=digest)
+
+
+def _meta_tables():
+    connection = op.get_bind()
+    return connection.execute(
+        sa.text(
+            "SELECT n.nspname AS schema, c.relname AS table "
+            "FROM pg_inherits AS i "
+            "JOIN pg_class AS c ON c.oid = i.inhrelid "
+            "JOIN pg_namespace AS n ON n.oid = c.relnamespace "
+            "WHERE i.inhparent = CAST('public._edit_base' AS regclass)"
+        )
+    ).fetchall()
+
+
+def upgrade():
+    for meta_table in _meta_tables():
+        op.execute(
+            'CREATE INDEX IF NOT EXISTS "{index}" ON "{schema}"."{table}" '
+            "(_submitted, _id) WHERE _applied = FALSE".format(
+                index=_index_name(meta_table.table),
+                schema=meta_table.schema,
+                table=meta_table.table,
+            )
+        )
+
+
+def downgrade():
+    for meta_table in _meta_tables():
+        op.execute(
+            'DROP INDEX IF EXISTS "{schema}"."{index}"'.format(
+                index=_index_name(meta_table.table), schema=meta_table.schema
+            )
+        )
@@ -0,0 +1,36 @@
+"""Add table versions
+
+Revision ID: d8e2b5c41f07
+Revises: a3f1c9e2b7d4
+Create Date: 2026-10-17 10:41:07.553120
+
+"""
+import sqlalchemy as sa
+from alembic import op
+
+# revision identifiers, used by Alembic.
+revision = "d8e2b5c41f07"
+down_revision = "a3f1c9e2b7d4"
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table(
+        "table_versions",
+        sa.Column("schema", sa.String(length=100), nullable=False),
+        sa.Column("table", sa.String(length=100), nullable=False),
+        sa.Column("version", sa.BigInteger(), server_default="0", nullable=False),
+        sa.Column(
+            "modified",
+            sa.DateTime(timezone=True),
+            server_default=sa.text("now()"),
+            nullable=False,
+        ),
+        sa.PrimaryKeyConstraint("schema", "table"),
+        schema="public",
+    )
+
+
+def downgrade():
+    op.drop_table("table_versions", schema="public")
@@ -0,0 +1,44 @@
+"""Add registry of API worker processes
+
+Revision ID: e41a7c93d2b6
+Revises: d8e2b5c41f07
+Create Date: 2026-10-17 13:05:48.901734
+
+"""
+import sqlalchemy as sa
+from alembic import op
+
+# revision identifiers, used by Alembic.
+revision = "e41a7c93d2b6"
+down_revision = "d8e2b5c41f07"
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.execute(sa.schema.CreateSequence(sa.Sequence("api_workers_key_seq", schema="public")))
+    op.create_table(
+        "api_workers",
+        sa.Column("key", sa.Integer(), autoincrement=False, nullable=False),
+        sa.Column("host", sa.String(length=255), nullable=False),
+        sa.Column("pid", sa.Integer(), nullable=False),
+        sa.Column(
+            "started",
+            sa.DateTime(timezone=True),
+            server_default=sa.text("now()"),
+            nullable=False,
+        ),
+        sa.Column(
+            "heartbeat",
+            sa.DateTime(timezone=True),
+            server_default=sa.text("now()"),
+            nullable=False,
+        ),
+        sa.PrimaryKeyConstraint("key"),
+        schema="public",
+    )
+
+
+def downgrade():
+    op.drop_table("api_workers", schema="public")
+    op.execute(sa.schema.DropSequence(sa.Sequence("api_workers_key_seq", schema="public")))